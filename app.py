@@ -1,41 +1,214 @@
 # app.py
 
 import os
+import json
+import time
 import uuid
-import tempfile
-from datetime import datetime
-from flask import Flask, request, jsonify, redirect, url_for, render_template
+import logging
+from datetime import datetime, timedelta
+from flask import Flask, Response, request, jsonify, redirect, url_for, render_template, stream_with_context, g
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
 from dotenv import load_dotenv
 
 # Módulos del Proyecto
 from database import (
     SessionLocal, 
     Invoice, 
+    check_schema,
     update_invoice_status,
+    bulk_update_invoice_status,
+    get_extraction_log,
+    list_invoices,
+    search_invoices,
+    spend_report,
+    add_approval_notifications,
+    add_invoice_event,
+    find_invoice_by_hash,
+    fill_invoice_from_result,
     STATUS_EN_PROCESO,
     STATUS_APROBADO,
-    STATUS_RECHAZADO
+    STATUS_RECHAZADO,
+    JOB_EN_COLA,
+    JOB_COMPLETADO,
+    JOB_FALLIDO,
+    INVOICE_LIST_FIELDS,
+    INVOICE_LIST_DEFAULT_FIELDS,
+    INVOICE_LIST_DATE_FIELDS,
+    SPEND_REPORT_DIMENSIONS,
+    BULK_ACTUALIZADA,
+    BULK_NO_ENCONTRADA
 )
-from processor import process_invoice_file
-from notification_service import send_approval_email
+from processor import process_invoice_file, rebuild_extraction_log, EXTRACTION_LOG_DEBUG
+from notification_service import APPROVER_EMAILS
+from upload_stream import StreamingUploadRequest
+from metrics import render_metrics, STAGE_SECONDS, REJECTIONS, HTTP_REQUEST_SECONDS, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from profiling import RequestProfile, profiling_requested, PROFILE_REQUESTS
+from event_stream import get_broker, events_since, latest_event_id, serialize_event, format_sse, EVENT_BATCH_SIZE
+
+from log_config import configure_logging
 
 # Cargar variables de entorno del archivo .env
 load_dotenv()
 
+configure_logging()
+logger = logging.getLogger(__name__)
+
 # Configuración de Flask
 app = Flask(__name__)
+# Los archivos subidos se hashean y se verifica su tipo mientras llegan (upload_stream.py)
+app.request_class = StreamingUploadRequest
 app.config['UPLOAD_FOLDER'] = 'uploads' # Directorio para guardar archivos subidos
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'pdf'}
+# Tamaño máximo de la petición: lo que exceda se rechaza con 413 antes de leerlo
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("MAX_UPLOAD_MB", 20)) * 1024 * 1024
+# Modo asíncrono: la subida se encola y la procesa el pool de worker.py
+app.config['ASYNC_OCR'] = os.environ.get("ASYNC_OCR", "false").lower() in ("1", "true", "yes")
+
+# Listado de facturas: tamaño de página por defecto/máximo y lote de las exportaciones NDJSON
+app.config['LIST_DEFAULT_LIMIT'] = 50
+app.config['LIST_MAX_LIMIT'] = 500
+app.config['EXPORT_BATCH_SIZE'] = 1000
+# Búsqueda de texto completo: resultados por página y desplazamiento máximo (paginación por offset)
+app.config['SEARCH_DEFAULT_LIMIT'] = 20
+app.config['SEARCH_MAX_OFFSET'] = 1000
+# Máximo de facturas por decisión en bloque
+app.config['BULK_DECISION_MAX_IDS'] = int(os.environ.get("BULK_DECISION_MAX_IDS", 1000))
+# Stream de estados (SSE): comentario de keepalive cada N segundos y espera de reconexión del cliente (ms)
+app.config['EVENT_KEEPALIVE'] = float(os.environ.get("EVENT_KEEPALIVE", 15))
+app.config['EVENT_RETRY_MS'] = int(os.environ.get("EVENT_RETRY_MS", 3000))
+# Perfilado de todas las subidas/webhooks (sin él, solo con la cabecera X-Profile-Token, ver profiling.py)
+app.config['PROFILE_REQUESTS'] = PROFILE_REQUESTS
 
 # Asegurar que el directorio de subida exista
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
+# La migración es un paso del despliegue (`python database.py migrate`):
+# aquí solo se comprueba que se ha aplicado
+check_schema()
+
+# -------------------------------------------------------------------------
+# SESIÓN DE BASE DE DATOS POR PETICIÓN
+# -------------------------------------------------------------------------
+
+def get_request_db():
+    """Sesión de la petición en curso: se abre en el primer uso y se cierra al terminar la petición."""
+    if 'db' not in g:
+        g.db = SessionLocal()
+    return g.db
+
+@app.teardown_appcontext
+def close_request_db(exception=None):
+    """Devuelve la conexión al pool (deshaciendo lo no confirmado) al terminar la petición."""
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
+
+# -------------------------------------------------------------------------
+# MÉTRICAS (Prometheus)
+# -------------------------------------------------------------------------
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_duration(response):
+    """Duración de cada petición (en los streams, hasta el inicio de la respuesta)."""
+    start = g.pop('request_start', None)
+    if start is not None:
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            endpoint=request.endpoint or "desconocido",
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
+# -------------------------------------------------------------------------
+# PERFILADO BAJO DEMANDA (profiling.py)
+# -------------------------------------------------------------------------
+
+@app.before_request
+def start_request_profile():
+    if profiling_requested(request.endpoint, request.headers, app.config['PROFILE_REQUESTS']):
+        g.profile = RequestProfile.start(request.endpoint)
+
+def profiled_invoice_id(response):
+    """ID de la factura de la petición: el de la respuesta JSON o el de la URL."""
+    data = response.get_json(silent=True) if response.is_json else None
+    if isinstance(data, dict):
+        for key in ("invoice_id", "job_id"):
+            if data.get(key) is not None:
+                return data[key]
+    invoice_id = request.args.get('invoice_id', type=int)
+    if invoice_id is None and request.view_args:
+        invoice_id = request.view_args.get('invoice_id')
+    return invoice_id
+
+@app.after_request
+def save_request_profile(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        base = profile.stop(profiled_invoice_id(response))
+        response.headers['X-Profile'] = os.path.basename(base)
+        logger.info("Perfil de la petición guardado en %s.{pstats,collapsed,svg}", base,
+                    extra={"endpoint": request.endpoint})
+    return response
+
+@app.teardown_request
+def discard_request_profile(exception=None):
+    """Si la petición terminó con una excepción no manejada, el perfil se guarda igualmente."""
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.stop()
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Latencias por etapa y contadores del pipeline en el formato de texto de Prometheus."""
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
 def allowed_file(filename):
     """Verifica que el archivo tenga una extensión permitida."""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+def upload_filename(filename, file_type):
+    """
+    Nombre con la extensión del tipo detectado por contenido: un archivo con
+    la extensión equivocada se procesa según lo que realmente es.
+    """
+    stem, _, extension = filename.rpartition('.')
+    extension = extension.lower()
+    if extension == file_type or (extension, file_type) == ('jpeg', 'jpg'):
+        return filename
+    logger.warning("'%s' es en realidad un archivo %s.", filename, file_type.upper())
+    return f"{stem or filename}.{file_type}"
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    REJECTIONS.inc(reason="too_large")
+    limit_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({"message": f"El archivo supera el tamaño máximo permitido ({limit_mb} MB)."}), 413
+
+@app.errorhandler(UnsupportedMediaType)
+def upload_unsupported_type(e):
+    REJECTIONS.inc(reason="unsupported_type")
+    return jsonify({"message": "Tipo de archivo no permitido", "error": e.description}), 415
+
+def duplicate_file_response(db, file_hash):
+    """Devuelve la respuesta 409 si el mismo archivo ya fue subido, o None."""
+    existing = find_invoice_by_hash(db, file_hash)
+    if existing:
+        REJECTIONS.inc(reason="duplicate")
+        return jsonify({
+            "message": f"El archivo ya fue subido previamente (factura ID {existing.id}).",
+            "invoice_id": existing.id,
+            "status": existing.status
+        }), 409 # Código 409 Conflict
+    return None
+
 # -------------------------------------------------------------------------
 # ENDPOINT PRINCIPAL: Subida y Procesamiento de Factura (Módulo 4 y Módulo 1)
 # -------------------------------------------------------------------------
@@ -54,77 +227,88 @@ def upload_invoice():
         return jsonify({"message": "Nombre de archivo inválido"}), 400
 
     if file and allowed_file(file.filename):
-        # 1. Guarda temporalmente el archivo para el OCR
-        temp_file_path = os.path.join(tempfile.gettempdir(), str(uuid.uuid4()) + file.filename)
-        file.save(temp_file_path)
-
-        # 2. Procesa la factura (Llamada al Módulo 1: OCR y Extracción)
-        processing_result = process_invoice_file(temp_file_path)
-        
-        # ===================================================================
-        # LÍNEAS DE DEBUGGING AGREGADAS: Muestra el log de extracción en la consola
-        # ===================================================================
-        print("\n=======================================================")
-        print("    DIAGNÓSTICO DETALLADO DE OCR Y EXTRACCIÓN (Módulo 1)")
-        print("=======================================================")
-        print(processing_result.get("log", "Log de procesamiento no disponible."))
-        print("=======================================================\n")
-        # ===================================================================
+        # 0. El archivo llegó en streaming con su hash y su tipo real ya calculados;
+        #    se deduplica por contenido antes del OCR
+        upload = file.stream.finish()
+        file_hash = upload.hexdigest
+        filename = upload_filename(file.filename, upload.file_type)
+        db = get_request_db()
+        duplicate = duplicate_file_response(db, file_hash)
+        # La conexión vuelve al pool mientras dura el OCR
+        db.close()
+        if duplicate:
+            return duplicate
+
+        if is_async_request():
+            return enqueue_invoice(filename, file, file_hash)
+
+        # 1-2. Procesa la factura en memoria, sin archivos temporales (Módulo 1: OCR y Extracción)
+        with STAGE_SECONDS.time(stage="process_file"):
+            processing_result = process_invoice_file(filename, file_hash, file_bytes=upload.read())
+        # El log de extracción solo se vuelca a la consola con LOG_LEVEL=DEBUG
+        if processing_result.get("log") and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Log de extracción de '%s':\n%s", filename, processing_result["log"],
+                         extra={"file_hash": file_hash})
 
         extracted_data = processing_result.get("data", {})
         extraction_error = processing_result.get("error")
 
         # 3. Manejo de Errores Críticos (Fallo de OCR)
         if extraction_error:
-            os.remove(temp_file_path)
             return jsonify({
                 "message": "Fallo al procesar el archivo por error de OCR.",
                 "error": extraction_error
             }), 500
 
-        # 4. Inicia la sesión de DB (Módulo 2)
-        db = SessionLocal()
-        
+        # 4. Sesión de DB de la petición (Módulo 2)
         try:
             invoice_number = extracted_data.get("invoice_number")
 
-            # 5. Verificación de duplicados
-            existing_invoice = db.query(Invoice).filter(Invoice.invoice_number == invoice_number).first()
-            if existing_invoice:
-                db.close()
-                os.remove(temp_file_path)
+            # 5. Verificación de duplicados por contenido (el número de factura y, entre
+            #    subidas simultáneas, el hash los garantizan los índices únicos, ver paso 8)
+            duplicate = duplicate_file_response(db, file_hash)
+            if duplicate:
+                return duplicate
+
+            # 6. Creación del nuevo registro en la DB
+            new_invoice = fill_invoice_from_result(Invoice(job_status=JOB_COMPLETADO, file_hash=file_hash), processing_result)
+            db.add(new_invoice)
+
+            # 7. Si el estado es "En Proceso", la notificación (Módulo 3) se registra en el
+            #    outbox en la misma transacción, junto con el evento del stream de estados;
+            #    la envía outbox_relay.py fuera de la petición.
+            # 8. Una subida concurrente con el mismo número choca con la restricción única
+            #    al insertar: ese es el control de duplicados, sin consulta previa.
+            try:
+                db.flush()
+                if new_invoice.status == STATUS_EN_PROCESO:
+                    add_approval_notifications(db, new_invoice.id, APPROVER_EMAILS)
+                add_invoice_event(db, new_invoice.id, new_invoice.status, new_invoice.job_status)
+                with STAGE_SECONDS.time(stage="db_commit"):
+                    db.commit()
+            except IntegrityError:
+                db.rollback()
+                # El mismo archivo subido a la vez: lo rechaza el índice único de file_hash
+                duplicate = duplicate_file_response(db, file_hash)
+                if duplicate:
+                    return duplicate
+                existing_invoice = db.query(Invoice.status).filter(
+                    Invoice.invoice_number == invoice_number
+                ).first() if invoice_number else None
+                if existing_invoice is None:
+                    raise
+                REJECTIONS.inc(reason="duplicate")
                 return jsonify({
                     "message": f"La factura con número {invoice_number} ya existe en la base de datos.",
                     "status": existing_invoice.status
                 }), 409 # Código 409 Conflict
-
-            # 6. Creación del nuevo registro en la DB
-            new_invoice = Invoice(
-                invoice_number=invoice_number,
-                provider_name=extracted_data.get("provider_name"),
-                issue_date=extracted_data.get("issue_date"),
-                due_date=extracted_data.get("due_date"),
-                total_amount=extracted_data.get("total_amount"),
-                taxes=extracted_data.get("taxes"),
-                status=extracted_data.get("status", STATUS_RECHAZADO), # Usa el estado determinado por el Módulo 1
-                extraction_log=processing_result.get("log")
-            )
-            db.add(new_invoice)
-            db.commit()
             db.refresh(new_invoice)
-            
-            # 7. Si el estado es "En Proceso", enviar notificación (Módulo 3)
-            if new_invoice.status == STATUS_EN_PROCESO:
-                send_approval_email(new_invoice)
-
-            # 8. Mueve el archivo a la carpeta final si fue procesado (opcional, para auditoría)
-            # Aquí podrías renombrar el archivo y moverlo a app.config['UPLOAD_FOLDER']
-            os.remove(temp_file_path) # Eliminamos el archivo temporal por simplicidad
 
             return jsonify({
                 "message": "Factura subida y procesada correctamente",
                 "invoice_id": new_invoice.id,
                 "status": new_invoice.status,
+                "text_source": new_invoice.text_source,
                 "extracted_data": {
                     k: (v.isoformat() if isinstance(v, datetime) else v) 
                     for k, v in extracted_data.items()
@@ -133,15 +317,57 @@ def upload_invoice():
 
         except Exception as e:
             db.rollback()
-            print(f"Error interno al manejar la DB o notificar: {e}")
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
+            logger.exception("Error interno al manejar la DB o notificar", extra={"file_hash": file_hash})
             return jsonify({"message": "Error interno del servidor", "error": str(e)}), 500
-        finally:
-            db.close()
     
     return jsonify({"message": "Tipo de archivo no permitido"}), 400
 
+def is_async_request():
+    """Determina si la subida debe encolarse (configuración global o ?mode=async|sync)."""
+    mode = request.args.get('mode')
+    if mode in ('async', 'sync'):
+        return mode == 'async'
+    return app.config['ASYNC_OCR']
+
+def enqueue_invoice(filename, file, file_hash):
+    """
+    Guarda el archivo en UPLOAD_FOLDER y crea un registro 'En Cola' que el
+    pool de OCR (worker.py) procesará. Responde 202 con el ID del trabajo.
+    """
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], str(uuid.uuid4()) + filename)
+    # Copia por bloques: el archivo no se carga entero en memoria
+    file.save(file_path)
+
+    db = get_request_db()
+    try:
+        new_invoice = Invoice(job_status=JOB_EN_COLA, file_path=file_path, file_hash=file_hash)
+        db.add(new_invoice)
+        try:
+            db.flush()
+        except IntegrityError:
+            # Otra subida del mismo archivo se encoló entre la verificación y el INSERT
+            db.rollback()
+            os.remove(file_path)
+            duplicate = duplicate_file_response(db, file_hash)
+            if duplicate:
+                return duplicate
+            raise
+        add_invoice_event(db, new_invoice.id, None, JOB_EN_COLA)
+        db.commit()
+        db.refresh(new_invoice)
+
+        return jsonify({
+            "message": "Factura recibida y encolada para procesamiento",
+            "job_id": new_invoice.id,
+            "job_status": new_invoice.job_status,
+            "status_url": url_for('get_job_status', job_id=new_invoice.id)
+        }), 202
+    except Exception as e:
+        db.rollback()
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        return jsonify({"message": "Error interno del servidor", "error": str(e)}), 500
+
 # -------------------------------------------------------------------------
 # ENDPOINT DE WEBHOOK: Respuesta del Correo (Módulo 3)
 # -------------------------------------------------------------------------
@@ -158,23 +384,71 @@ def webhook_handler():
     new_status = STATUS_APROBADO if action == 'approve' else STATUS_RECHAZADO
     justification = f"Decisión tomada por webhook/email: {new_status}"
     
-    db = SessionLocal()
+    db = get_request_db()
     try:
-        updated_invoice = update_invoice_status(db, invoice_id, new_status, justification)
-        
-        if updated_invoice:
-            print(f"\n--- WEBHOOK ACTIVADO ---")
-            print(f"Factura ID {invoice_id} ha sido marcada como: {new_status}")
-            print("------------------------\n")
-            # Redirige a una página de confirmación simple
-            return f"<h1>Confirmación: Factura {invoice_id} {new_status}</h1><p>El proceso ha finalizado correctamente.</p>", 200
-        else:
-            return "Factura no encontrada", 404
+        result, current_status, _ = update_invoice_status(db, invoice_id, new_status, justification)
     except Exception as e:
         db.rollback()
         return f"Error al actualizar la base de datos: {e}", 500
-    finally:
-        db.close()
+
+    if result == BULK_NO_ENCONTRADA:
+        return "Factura no encontrada", 404
+    if result == BULK_ACTUALIZADA:
+        logger.info("Webhook: factura marcada como %s", new_status,
+                    extra={"invoice_id": invoice_id, "status": new_status})
+    elif current_status != new_status:
+        # Transición no permitida (ya decidida en sentido contrario) o trabajo de OCR sin terminar
+        reason = f"su estado actual es {current_status}" if current_status else "aún se está procesando"
+        return f"<h1>Factura {invoice_id} no modificada</h1><p>No se puede marcar como {new_status}: {reason}.</p>", 409
+    # Confirmación (también si el mismo enlace se abre más de una vez)
+    return f"<h1>Confirmación: Factura {invoice_id} {new_status}</h1><p>El proceso ha finalizado correctamente.</p>", 200
+
+@app.route('/api/v1/invoices/decision', methods=['POST'])
+def bulk_decision_handler():
+    """
+    Aprueba o rechaza varias facturas en una sola transacción.
+    Cuerpo JSON: {"invoice_ids": [1, 2, ...], "action": "approve"|"reject", "justification": "..."}
+    Solo se modifican las facturas 'En Proceso' cuyo OCR terminó; la respuesta detalla el resultado de cada ID.
+    """
+    payload = request.get_json(silent=True) or {}
+    invoice_ids = payload.get('invoice_ids')
+    action = payload.get('action')
+    justification = payload.get('justification')
+
+    if action not in ['approve', 'reject']:
+        return jsonify({"message": "action debe ser 'approve' o 'reject'."}), 400
+    if not isinstance(invoice_ids, list) or not invoice_ids or \
+       not all(isinstance(invoice_id, int) and not isinstance(invoice_id, bool) for invoice_id in invoice_ids):
+        return jsonify({"message": "invoice_ids debe ser una lista no vacía de enteros."}), 400
+    if len(invoice_ids) > app.config['BULK_DECISION_MAX_IDS']:
+        return jsonify({"message": f"Se admiten como máximo {app.config['BULK_DECISION_MAX_IDS']} facturas por solicitud."}), 400
+    if justification is not None and not isinstance(justification, str):
+        return jsonify({"message": "justification debe ser texto."}), 400
+
+    new_status = STATUS_APROBADO if action == 'approve' else STATUS_RECHAZADO
+    justification = justification or f"Decisión en bloque: {new_status}"
+
+    try:
+        results = bulk_update_invoice_status(get_request_db(), invoice_ids, new_status, justification)
+    except Exception as e:
+        return jsonify({"message": f"Error al actualizar la base de datos: {e}"}), 500
+
+    updated = sum(1 for result, _, _ in results.values() if result == BULK_ACTUALIZADA)
+    logger.info("Decisión en bloque: %d/%d factura(s) marcadas como %s", updated, len(results), new_status,
+                extra={"status": new_status})
+    return jsonify({
+        "status": new_status,
+        "updated": updated,
+        "results": [
+            {
+                "invoice_id": invoice_id,
+                "result": result,
+                "current_status": status,
+                "last_updated": last_updated.isoformat() if last_updated else None
+            }
+            for invoice_id, (result, status, last_updated) in results.items()
+        ]
+    }), 200
 
 
 # -------------------------------------------------------------------------
@@ -183,22 +457,360 @@ def webhook_handler():
 
 @app.route('/api/v1/invoice/<int:invoice_id>/status', methods=['GET'])
 def get_invoice_status(invoice_id):
+    invoice = get_request_db().query(
+        Invoice.id, Invoice.invoice_number, Invoice.status, Invoice.total_amount, Invoice.last_updated
+    ).filter(Invoice.id == invoice_id).first()
+    if invoice:
+        return jsonify({
+            "invoice_id": invoice.id,
+            "invoice_number": invoice.invoice_number,
+            "current_status": invoice.status,
+            "total_amount": invoice.total_amount,
+            "last_updated": invoice.last_updated.isoformat()
+        }), 200
+    else:
+        return jsonify({"message": "Factura no encontrada"}), 404
+
+@app.route('/api/v1/invoice/<int:invoice_id>/log', methods=['GET'])
+def get_invoice_log(invoice_id):
+    """
+    Log de extracción de una factura (se lee de invoice_logs solo aquí).
+    Con ?level=debug el log, con el análisis del texto OCR, se reconstruye
+    desde la caché de OCR; si el texto ya no está en caché se devuelve el guardado.
+    """
+    db = get_request_db()
+    if request.args.get('level') == EXTRACTION_LOG_DEBUG:
+        file_hash = db.query(Invoice.file_hash).filter(Invoice.id == invoice_id).scalar()
+        extraction_log = rebuild_extraction_log(file_hash)
+        if extraction_log is not None:
+            return jsonify({"invoice_id": invoice_id, "level": EXTRACTION_LOG_DEBUG,
+                            "extraction_log": extraction_log}), 200
+    extraction_log = get_extraction_log(db, invoice_id)
+    if extraction_log is None:
+        return jsonify({"message": "Log de extracción no encontrado"}), 404
+    return jsonify({"invoice_id": invoice_id, "extraction_log": extraction_log}), 200
+
+# -------------------------------------------------------------------------
+# ENDPOINT DE LISTADO DE FACTURAS (Módulo 2)
+# -------------------------------------------------------------------------
+
+def parse_date_arg(args, name, end_of_day=False):
+    """Fecha ISO de la URL. Como límite superior, una fecha sin hora incluye el día completo."""
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Fecha inválida en '{name}': use el formato AAAA-MM-DD.")
+    if end_of_day and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+def parse_number_arg(args, name, number_type=float):
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return number_type(value)
+    except ValueError:
+        raise ValueError(f"Valor numérico inválido en '{name}'.")
+
+def parse_list_filters(args):
+    """Convierte los parámetros de la URL en argumentos de list_invoices."""
+    fields = tuple(field.strip() for field in args.get('fields', '').split(',') if field.strip())
+    fields = fields or INVOICE_LIST_DEFAULT_FIELDS
+    unknown = [field for field in fields if field not in INVOICE_LIST_FIELDS]
+    if unknown:
+        raise ValueError(f"Campos no permitidos: {', '.join(unknown)}.")
+
+    date_field = args.get('date_field', 'issue_date')
+    if date_field not in INVOICE_LIST_DATE_FIELDS:
+        raise ValueError(f"date_field debe ser uno de: {', '.join(INVOICE_LIST_DATE_FIELDS)}.")
+
+    statuses = [status.strip() for value in args.getlist('status') for status in value.split(',') if status.strip()]
+    return {
+        "fields": fields,
+        "statuses": statuses or None,
+        "provider": args.get('provider') or None,
+        "date_field": date_field,
+        "date_from": parse_date_arg(args, 'date_from'),
+        "date_to": parse_date_arg(args, 'date_to', end_of_day=True),
+        "min_amount": parse_number_arg(args, 'min_amount'),
+        "max_amount": parse_number_arg(args, 'max_amount'),
+    }
+
+def serialize_invoice_row(row):
+    return {key: (value.isoformat() if isinstance(value, datetime) else value) for key, value in row._mapping.items()}
+
+def wants_ndjson():
+    return request.args.get('format') == 'ndjson' or \
+           request.accept_mimetypes.best == 'application/x-ndjson'
+
+@app.route('/api/v1/invoices', methods=['GET'])
+def list_invoices_endpoint():
+    """
+    Listado de facturas con filtros (status, provider, date_from/date_to sobre
+    date_field, min_amount/max_amount), proyección de campos (fields) y
+    paginación por cursor: la respuesta incluye next_cursor, que se pasa como
+    ?cursor= para obtener la página siguiente. Con ?format=ndjson (o
+    Accept: application/x-ndjson) se transmite una factura por línea, sin
+    límite de página salvo que se indique ?limit=.
+    """
+    try:
+        filters = parse_list_filters(request.args)
+        before_id = parse_number_arg(request.args, 'cursor', int)
+        limit = parse_number_arg(request.args, 'limit', int)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    if limit is not None and limit < 1:
+        return jsonify({"message": "limit debe ser mayor que 0."}), 400
+
+    if wants_ndjson():
+        return Response(stream_with_context(stream_invoices_ndjson(filters, before_id, limit)), mimetype='application/x-ndjson')
+
+    limit = min(limit or app.config['LIST_DEFAULT_LIMIT'], app.config['LIST_MAX_LIMIT'])
+    # Se pide una fila de más para saber si existe una página siguiente
+    rows = list_invoices(get_request_db(), before_id=before_id, limit=limit + 1, **filters)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify({
+        "invoices": [serialize_invoice_row(row) for row in rows],
+        "count": len(rows),
+        "next_cursor": rows[-1].id if has_more else None
+    }), 200
+
+def stream_invoices_ndjson(filters, before_id=None, limit=None):
+    """Genera el listado como NDJSON leyendo la base de datos por lotes de keyset."""
+    # Sesión propia: el generador sigue ejecutándose después de la vista
     db = SessionLocal()
     try:
-        invoice = db.query(Invoice).filter(Invoice.id == invoice_id).first()
-        if invoice:
-            return jsonify({
-                "invoice_id": invoice.id,
-                "invoice_number": invoice.invoice_number,
-                "current_status": invoice.status,
-                "total_amount": invoice.total_amount,
-                "last_updated": invoice.last_updated.isoformat()
-            }), 200
+        remaining = limit
+        while remaining is None or remaining > 0:
+            batch_size = app.config['EXPORT_BATCH_SIZE'] if remaining is None else min(app.config['EXPORT_BATCH_SIZE'], remaining)
+            rows = list_invoices(db, before_id=before_id, limit=batch_size, **filters)
+            for row in rows:
+                yield json.dumps(serialize_invoice_row(row), ensure_ascii=False) + "\n"
+            if len(rows) < batch_size:
+                break
+            before_id = rows[-1].id
+            if remaining is not None:
+                remaining -= len(rows)
+    finally:
+        db.close()
+
+# -------------------------------------------------------------------------
+# BÚSQUEDA DE TEXTO COMPLETO SOBRE EL TEXTO OCR
+# -------------------------------------------------------------------------
+
+@app.route('/api/v1/invoices/search', methods=['GET'])
+def search_invoices_endpoint():
+    """
+    Facturas cuyo texto OCR contiene lo buscado en ?q= (palabras, "frases"
+    y prefijos con *), de la más relevante a la menos, con un fragmento del
+    texto con los términos resaltados. Admite los filtros del listado
+    (status, provider, date_field/date_from/date_to, min_amount/max_amount)
+    y paginación con ?offset= (la respuesta incluye next_offset).
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"message": "El parámetro q es obligatorio."}), 400
+    try:
+        filters = parse_list_filters(request.args)
+        limit = parse_number_arg(request.args, 'limit', int)
+        offset = parse_number_arg(request.args, 'offset', int) or 0
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    if (limit is not None and limit < 1) or offset < 0:
+        return jsonify({"message": "limit debe ser mayor que 0 y offset no puede ser negativo."}), 400
+    if offset > app.config['SEARCH_MAX_OFFSET']:
+        return jsonify({"message": f"offset no puede superar {app.config['SEARCH_MAX_OFFSET']}; acote la búsqueda con filtros."}), 400
+    filters.pop('fields')
+
+    limit = min(limit or app.config['SEARCH_DEFAULT_LIMIT'], app.config['LIST_MAX_LIMIT'])
+    # Se pide un resultado de más para saber si existe una página siguiente
+    rows = search_invoices(get_request_db(), query, limit=limit + 1, offset=offset, **filters)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify({
+        "query": query,
+        "results": [serialize_invoice_row(row) for row in rows],
+        "count": len(rows),
+        "next_offset": offset + limit if has_more else None
+    }), 200
+
+# -------------------------------------------------------------------------
+# INFORME DE GASTO POR PROVEEDOR, MES Y ESTADO
+# -------------------------------------------------------------------------
+
+def parse_period_arg(args, name):
+    """Mes 'AAAA-MM' de la URL."""
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m').strftime('%Y-%m')
+    except ValueError:
+        raise ValueError(f"'{name}' debe tener el formato AAAA-MM.")
+
+def serialize_spend_row(row):
+    data = {key: (value or None) for key, value in row._mapping.items() if key in SPEND_REPORT_DIMENSIONS}
+    data["invoice_count"] = row.invoice_count or 0
+    data["total_amount"] = (row.total_amount_cents or 0) / 100
+    data["taxes"] = (row.taxes_cents or 0) / 100
+    return data
+
+@app.route('/api/v1/reports/spend', methods=['GET'])
+def spend_report_endpoint():
+    """
+    Número de facturas, total e impuestos agrupados por ?group_by=
+    (provider_name, period, status; por defecto provider_name,period), con
+    filtros status, provider y period_from/period_to (AAAA-MM, inclusivos).
+    Se lee solo del resumen spend_summary, sin recorrer la tabla invoices.
+    """
+    group_by = tuple(name.strip() for name in request.args.get('group_by', 'provider_name,period').split(',') if name.strip())
+    unknown = [name for name in group_by if name not in SPEND_REPORT_DIMENSIONS]
+    if unknown:
+        return jsonify({"message": f"group_by admite: {', '.join(SPEND_REPORT_DIMENSIONS)}."}), 400
+    try:
+        period_from = parse_period_arg(request.args, 'period_from')
+        period_to = parse_period_arg(request.args, 'period_to')
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    statuses = [status.strip() for value in request.args.getlist('status') for status in value.split(',') if status.strip()]
+
+    rows = spend_report(
+        get_request_db(), group_by, statuses=statuses or None, provider=request.args.get('provider') or None,
+        period_from=period_from, period_to=period_to
+    )
+    rows = [serialize_spend_row(row) for row in rows if row.invoice_count]
+    return jsonify({
+        "group_by": list(group_by),
+        "rows": rows,
+        "totals": {
+            "invoice_count": sum(row["invoice_count"] for row in rows),
+            "total_amount": round(sum(row["total_amount"] for row in rows), 2),
+            "taxes": round(sum(row["taxes"] for row in rows), 2)
+        }
+    }), 200
+
+# -------------------------------------------------------------------------
+# STREAM DE CAMBIOS DE ESTADO (Server-Sent Events)
+# -------------------------------------------------------------------------
+
+def parse_id_list(args, name):
+    """IDs enteros de un parámetro repetible o separado por comas."""
+    try:
+        return [int(value) for raw in args.getlist(name) for value in raw.split(',') if value.strip()]
+    except ValueError:
+        raise ValueError(f"'{name}' debe contener IDs enteros.")
+
+@app.route('/api/v1/events', methods=['GET'])
+def invoice_events_stream():
+    """
+    Stream (text/event-stream) con los cambios de estado de las facturas,
+    en lugar de consultar /status repetidamente. ?invoice_id= (repetible o
+    separado por comas) limita el stream a esas facturas y envía primero su
+    estado actual (evento 'snapshot'). Al reconectarse, el navegador manda
+    Last-Event-ID y recibe los eventos perdidos.
+    """
+    try:
+        invoice_ids = parse_id_list(request.args, 'invoice_id')
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    return Response(
+        stream_with_context(stream_invoice_events(invoice_ids or None, last_event_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def stream_invoice_events(invoice_ids=None, last_event_id=None):
+    """Genera el stream SSE: estado actual, eventos perdidos y luego los nuevos según llegan."""
+    broker = get_broker()
+    subscription = None
+    # Sesión propia: el generador sigue ejecutándose después de la vista
+    db = SessionLocal()
+    try:
+        yield f"retry: {app.config['EVENT_RETRY_MS']}\n\n"
+        if last_event_id is None:
+            # Desde ahora, sin saltarse los eventos de IDs menores aún por confirmar
+            cursor = latest_event_id(db)
+            if broker.resume_id is not None:
+                cursor = min(cursor, broker.resume_id)
         else:
-            return jsonify({"message": "Factura no encontrada"}), 404
+            cursor = last_event_id
+        if last_event_id is None and invoice_ids:
+            for row in db.query(Invoice.id, Invoice.status, Invoice.job_status, Invoice.last_updated).filter(Invoice.id.in_(invoice_ids)):
+                yield format_sse({
+                    "invoice_id": row.id,
+                    "status": row.status,
+                    "job_status": row.job_status,
+                    "last_updated": row.last_updated.isoformat() if row.last_updated else None
+                }, event="snapshot")
+
+        # Suscripción primero y recuperación después: ningún evento queda entre ambas
+        subscription = broker.subscribe(invoice_ids, cursor)
+        while True:
+            # Posición del difusor antes de leer: lo confirmado por debajo entra en esta lectura
+            broker_resume_id = broker.resume_id
+            events = events_since(db, cursor, invoice_ids)
+            for event in events:
+                yield format_sse(serialize_event(event), subscription.catch_up(event.id, broker_resume_id))
+                cursor = event.id
+            if len(events) < EVENT_BATCH_SIZE:
+                break
+        # No se retiene una conexión de la base de datos mientras el cliente espera
+        db.close()
+
+        while not subscription.overflowed:
+            event = subscription.get(timeout=app.config['EVENT_KEEPALIVE'])
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield format_sse(event, subscription.resume_id)
     finally:
+        if subscription is not None:
+            broker.unsubscribe(subscription)
         db.close()
 
+# -------------------------------------------------------------------------
+# ENDPOINT DE CONSULTA DE TRABAJOS ASÍNCRONOS (Módulo 1 en segundo plano)
+# -------------------------------------------------------------------------
+
+@app.route('/api/v1/invoice/job/<int:job_id>', methods=['GET'])
+def get_job_status(job_id):
+    invoice = get_request_db().query(Invoice).filter(Invoice.id == job_id).first()
+    if not invoice or invoice.job_status is None:
+        return jsonify({"message": "Trabajo no encontrado"}), 404
+
+    response = {
+        "job_id": invoice.id,
+        "job_status": invoice.job_status,
+        "created_at": invoice.created_at.isoformat(),
+        "last_updated": invoice.last_updated.isoformat()
+    }
+    if invoice.job_status == JOB_FALLIDO:
+        response["error"] = invoice.job_error
+    if invoice.job_status in (JOB_COMPLETADO, JOB_FALLIDO):
+        response["invoice_id"] = invoice.id
+        response["status"] = invoice.status
+        response["text_source"] = invoice.text_source
+    if invoice.job_status == JOB_COMPLETADO:
+        response["extracted_data"] = {
+            "invoice_number": invoice.invoice_number,
+            "provider_name": invoice.provider_name,
+            "issue_date": invoice.issue_date.isoformat() if invoice.issue_date else None,
+            "due_date": invoice.due_date.isoformat() if invoice.due_date else None,
+            "total_amount": invoice.total_amount,
+            "taxes": invoice.taxes
+        }
+    return jsonify(response), 200
+
 
 if __name__ == '__main__':
     # Usar el puerto del .env o 5000 por defecto
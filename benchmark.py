@@ -0,0 +1,908 @@
+# benchmark.py
+
+"""
+Mediciones de rendimiento del pipeline de facturas sobre las muestras de uploads/.
+
+Uso:
+    python benchmark.py tempfile [--repeat N]
+    python benchmark.py extraction [--invoices N] [--baseline REV]
+    python benchmark.py preprocessing [--repeat N]
+    python benchmark.py backends [--repeat N]
+    python benchmark.py logs [--rows N] [--baseline REV]
+    python benchmark.py db-load [--rows N] [--requests N] [--threads N] [--baseline REV]
+    python benchmark.py search [--rows N] [--queries N] [--like-queries N]
+    python benchmark.py spend [--rows N] [--queries N] [--updates N]
+    python benchmark.py extraction-log [--invoices N]
+    python benchmark.py emails [--count N] [--baseline REV]
+"""
+
+import os
+import io
+import time
+import uuid
+import types
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import statistics
+from datetime import datetime
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+SAMPLES_DIR = "uploads"
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Tamaño de una página A4 renderizada a 200 DPI (resolución por defecto de pdf2image)
+A4_200_DPI = (1654, 2339)
+
+def sample_files(extensions=IMAGE_EXTENSIONS):
+    """Rutas de las facturas de muestra con las extensiones indicadas."""
+    return sorted(
+        os.path.join(SAMPLES_DIR, name)
+        for name in os.listdir(SAMPLES_DIR)
+        if name.lower().endswith(extensions)
+    )
+
+def time_call(func, repeat):
+    """Ejecuta `func` `repeat` veces y devuelve la mediana en milisegundos."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def print_row(name, legacy_ms, new_ms):
+    print(f"{name:<24} {legacy_ms:>10.2f} {new_ms:>10.2f} {legacy_ms - new_ms:>10.2f}")
+
+# -------------------------------------------------------------------------
+# ARCHIVOS TEMPORALES vs. CAMINO EN MEMORIA
+# -------------------------------------------------------------------------
+
+def bench_tempfile(repeat):
+    """
+    Latencia previa a Tesseract: camino antiguo con archivos temporales frente
+    al camino en memoria. El tiempo de Tesseract es el mismo en ambos y no se mide.
+    """
+    print("Subida: archivo en tempdir + Image.open(ruta) vs. Image.open(BytesIO)")
+    print(f"{'archivo':<24} {'antes ms':>10} {'ahora ms':>10} {'ahorro ms':>10}")
+    for path in sample_files():
+        with open(path, 'rb') as f:
+            file_bytes = f.read()
+
+        def legacy_upload():
+            temp_path = os.path.join(tempfile.gettempdir(), str(uuid.uuid4()) + os.path.basename(path))
+            with open(temp_path, 'wb') as f:
+                f.write(file_bytes)
+            Image.open(temp_path).load()
+            os.remove(temp_path)
+
+        def memory_upload():
+            Image.open(io.BytesIO(file_bytes)).load()
+
+        print_row(os.path.basename(path), time_call(legacy_upload, repeat), time_call(memory_upload, repeat))
+
+    print("\nPágina PDF renderizada (A4 a 200 DPI): PNG temporal + Image.open vs. imagen directa")
+    print(f"{'archivo':<24} {'antes ms':>10} {'ahora ms':>10} {'ahorro ms':>10}")
+    for path in sample_files():
+        page = Image.open(path).convert('RGB').resize(A4_200_DPI)
+
+        def legacy_page():
+            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_img:
+                page.save(tmp_img.name, 'PNG')
+                temp_image_path = tmp_img.name
+            Image.open(temp_image_path).load()
+            os.remove(temp_image_path)
+
+        def memory_page():
+            page.load()
+
+        print_row(os.path.basename(path), time_call(legacy_page, repeat), time_call(memory_page, repeat))
+
+# -------------------------------------------------------------------------
+# EXTRACCIÓN DE CAMPOS: PATRONES PRECOMPILADOS + TOKENIZACIÓN ÚNICA
+# -------------------------------------------------------------------------
+
+PROVIDERS = ["DISTRIBUIDORA EL SOL C.A.", "Inversiones Lara 2020", "TECNOLOGIA ANDINA S.A.", "Ferreteria Central"]
+DATE_SEPARATORS = ['/', '.', '-']
+
+def synthetic_ocr_corpus(size, seed=42):
+    """
+    Textos con la forma (y el ruido) de la salida de Tesseract sobre las
+    facturas de muestra, con campos y formatos variados.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(size):
+        sep = rng.choice(DATE_SEPARATORS)
+        issue = f"{rng.randint(1, 28):02d}{sep}{rng.randint(1, 12):02d}{sep}{rng.choice(['2024', '2025', '25'])}"
+        due = f"{rng.randint(1, 28):02d}{sep}{rng.randint(1, 12):02d}{sep}2025"
+        subtotal = rng.uniform(10, 5000)
+        lines = [
+            rng.choice(PROVIDERS),
+            f"RIF: J-{rng.randint(10000000, 99999999)}-{rng.randint(0, 9)}",
+            f"Dirección: Av. Principal {rng.randint(1, 200)}, Local {rng.randint(1, 20)}",
+            rng.choice(["FACTURA", "Nro. de Factura:", "Número de Documento Fiscal:"]) + f" {rng.randint(1000, 99999)}",
+            rng.choice(["Fecha de Emisión:", "Fecha de Emisión del Documento:", "FECHA DE EMISION", "Fecha"]) + f" {issue}",
+        ]
+        if rng.random() < 0.6:
+            lines.append(f"Fecha Límite de Pago: {due}")
+        for item in range(rng.randint(3, 25)):
+            lines.append(f"{rng.randint(1, 10)} x Artículo {item} {rng.uniform(1, 300):,.2f}")
+            if rng.random() < 0.15:
+                lines.append(rng.choice(["", "~~ ~ .", "| | |", "—"]))
+        lines.append(f"Sub Total {subtotal:,.2f}")
+        lines.append(f"IVA (16%): {subtotal * 0.16:,.2f}")
+        lines.append(rng.choice(["TOTAL A PAGAR", "TOTAL A PAGAR (Bs.)", "Importe Total"]) + f": {subtotal * 1.16:,.2f}")
+        if rng.random() < 0.3:
+            lines = lines[1:]  # Proveedor ilegible en la cabecera
+        corpus.append("\n".join(lines) + "\n\x0c")
+    return corpus
+
+def load_module_revision(module_name, rev):
+    """Carga `module_name`.py tal como estaba en la revisión git `rev`."""
+    source = subprocess.run(
+        ["git", "show", f"{rev}:{module_name}.py"], capture_output=True, text=True, check=True
+    ).stdout
+    module = types.ModuleType(f"{module_name}_{rev}")
+    module.__file__ = f"{module_name}@{rev}"
+    exec(compile(source, module.__file__, "exec"), module.__dict__)
+    return module
+
+def root_revision():
+    return subprocess.run(
+        ["git", "rev-list", "--max-parents=0", "HEAD"], capture_output=True, text=True, check=True
+    ).stdout.split()[0]
+
+def bench_extraction(size, baseline):
+    """
+    Extracción (debug + campos + validación) sobre un corpus de textos OCR:
+    escaneo por campo de la revisión `baseline` frente al motor actual, ambos
+    con el log de depuración completo; el nivel de log por defecto se
+    informa en una fila aparte.
+    """
+    import processor
+
+    corpus = synthetic_ocr_corpus(size)
+    baseline = baseline or root_revision()
+    legacy = load_module_revision("processor", baseline)
+
+    # En la versión antigua la extracción solo es accesible vía process_invoice_file:
+    # se sustituye el OCR por una función que devuelve el texto del corpus.
+    current_text = {}
+    legacy.Image = types.SimpleNamespace(open=lambda path: path)
+    legacy.pytesseract = types.SimpleNamespace(image_to_string=lambda image, lang: current_text["text"])
+
+    def run_legacy():
+        results = []
+        for text in corpus:
+            current_text["text"] = text
+            results.append(legacy.process_invoice_file("factura.png")["data"])
+        return results
+
+    # La versión base siempre construye el log de depuración completo: la comparación se hace
+    # con el mismo nivel, y el nivel por defecto se mide aparte (ver también `extraction-log`)
+    def run_current(log_level=processor.EXTRACTION_LOG_DEBUG):
+        return [processor.process_invoice_text(text, log_level=log_level)["data"] for text in corpus]
+
+    legacy_results, current_results = run_legacy(), run_current()
+    mismatches = sum(1 for old, new in zip(legacy_results, current_results) if old != new)
+
+    legacy_ms = time_call(run_legacy, 5)
+    current_ms = time_call(run_current, 5)
+    default_ms = time_call(lambda: run_current(processor.EXTRACTION_LOG_LEVEL), 5)
+    print(f"Corpus: {size} textos OCR sintéticos. Base: {baseline[:10]}")
+    print(f"{'motor':<36} {'total ms':>10} {'µs/factura':>12}")
+    print(f"{'escaneo por campo (base, debug)':<36} {legacy_ms:>10.1f} {legacy_ms * 1000 / size:>12.1f}")
+    print(f"{'precompilado + tokens (debug)':<36} {current_ms:>10.1f} {current_ms * 1000 / size:>12.1f}")
+    label = f"precompilado + tokens ({processor.EXTRACTION_LOG_LEVEL})"
+    print(f"{label:<36} {default_ms:>10.1f} {default_ms * 1000 / size:>12.1f}")
+    print(f"Aceleración de la extracción (mismo nivel de log): {legacy_ms / current_ms:.2f}x; "
+          f"con EXTRACTION_LOG_LEVEL={processor.EXTRACTION_LOG_LEVEL}: {legacy_ms / default_ms:.2f}x. "
+          f"Resultados distintos: {mismatches} de {size}.")
+
+# -------------------------------------------------------------------------
+# PREPROCESAMIENTO DE IMAGEN: LATENCIA DE OCR Y PRECISIÓN DE EXTRACCIÓN
+# -------------------------------------------------------------------------
+
+# Valores reales de las facturas de muestra (verificados a mano)
+GROUND_TRUTH = {
+    "factura_test.png": {
+        "provider_name": "Soluciones Tecnológicas del Norte, S.A.",
+        "invoice_number": "FT-2025-9876",
+        "issue_date": datetime(2025, 11, 15),
+        "due_date": datetime(2025, 12, 15),
+        "total_amount": 1250.75,
+        "taxes": 150.75,
+    },
+    "test3.png": {
+        "provider_name": "CONSULTORÍA INNOVA TECH",
+        "invoice_number": "ABC-2025-0015",
+        "issue_date": datetime(2025, 11, 12),
+        "due_date": datetime(2026, 1, 12),
+        "total_amount": 800.00,
+        "taxes": 110.00,
+    },
+    "test4.png": {
+        "provider_name": "DISTRIBUIDORA ELECTRÓNICA C.A.",
+        "invoice_number": "PRV/2025/XYZ",
+        "issue_date": datetime(2025, 10, 20),
+        "due_date": datetime(2025, 11, 20),
+        "total_amount": 4500.99,
+        "taxes": 450.99,
+    },
+}
+
+def field_matches(expected, actual):
+    if isinstance(expected, float):
+        return isinstance(actual, float) and abs(expected - actual) < 0.01
+    if isinstance(expected, str):
+        return isinstance(actual, str) and expected.strip().lower() == actual.strip().lower()
+    return expected == actual
+
+def extraction_accuracy(text, truth):
+    """Fracción de campos extraídos del texto que coinciden con los valores reales."""
+    import processor
+    data = processor.process_invoice_text(text)["data"]
+    return sum(field_matches(value, data.get(field)) for field, value in truth.items()) / len(truth)
+
+def bench_preprocessing(repeat):
+    """OCR sin preprocesar frente a OCR preprocesado sobre las facturas de muestra."""
+    import pytesseract
+    import processor
+    import image_preprocessing
+
+    try:
+        pytesseract.get_tesseract_version()
+        has_tesseract = True
+    except Exception:
+        has_tesseract = False
+        print("Tesseract no está disponible: solo se mide el costo del preprocesamiento.\n")
+
+    print(f"{'archivo':<20} {'px antes':>10} {'px después':>11} {'prep ms':>8}", end="")
+    print(f" {'OCR antes ms':>13} {'OCR después ms':>15} {'prec. antes':>12} {'prec. después':>14}" if has_tesseract else "")
+
+    for path in sample_files():
+        name = os.path.basename(path)
+        image = Image.open(path)
+        image.load()
+        prepared = image_preprocessing.preprocess_image(image)
+        prep_ms = time_call(lambda: image_preprocessing.preprocess_image(image), repeat)
+        row = f"{name:<20} {image.width * image.height:>10} {prepared.width * prepared.height:>11} {prep_ms:>8.1f}"
+
+        if has_tesseract:
+            raw_ms = time_call(lambda: pytesseract.image_to_string(image, lang=processor.OCR_LANG), repeat)
+            prepared_ms = time_call(
+                lambda: pytesseract.image_to_string(image_preprocessing.preprocess_image(image), lang=processor.OCR_LANG), repeat
+            )
+            truth = GROUND_TRUTH.get(name)
+            if truth:
+                raw_accuracy = extraction_accuracy(pytesseract.image_to_string(image, lang=processor.OCR_LANG), truth)
+                prepared_accuracy = extraction_accuracy(pytesseract.image_to_string(prepared, lang=processor.OCR_LANG), truth)
+                accuracy = f"{raw_accuracy:>12.0%} {prepared_accuracy:>14.0%}"
+            else:
+                accuracy = f"{'-':>12} {'-':>14}"
+            row += f" {raw_ms:>13.1f} {prepared_ms:>15.1f} {accuracy}"
+        print(row)
+
+# -------------------------------------------------------------------------
+# BACKENDS DE OCR: SUBPROCESO POR LLAMADA vs. MOTOR PERSISTENTE
+# -------------------------------------------------------------------------
+
+def bench_backends(repeat):
+    """Throughput de cada backend de OCR sobre las facturas de muestra."""
+    import processor
+    import image_preprocessing
+
+    images = []
+    for path in sample_files():
+        image = Image.open(path)
+        images.append(image_preprocessing.preprocess_image(image))
+
+    print(f"{'backend':<12} {'1ª llamada ms':>14} {'ms/imagen':>10} {'imágenes/s':>11}")
+    for name, backend_class in processor.OCR_BACKENDS.items():
+        try:
+            backend = backend_class()
+            backend.version()
+        except Exception as e:
+            print(f"{name:<12} no disponible: {e}")
+            continue
+
+        start = time.perf_counter()
+        backend.image_to_string(images[0])
+        first_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for image in images:
+                backend.image_to_string(image)
+        elapsed = time.perf_counter() - start
+        count = repeat * len(images)
+        print(f"{name:<12} {first_ms:>14.1f} {elapsed * 1000 / count:>10.1f} {count / elapsed:>11.2f}")
+
+# -------------------------------------------------------------------------
+# LOG DE EXTRACCIÓN: EN LA FILA DE invoices vs. TABLA APARTE COMPRIMIDA
+# -------------------------------------------------------------------------
+
+@lru_cache(maxsize=4)
+def synthetic_extraction_results(size, seed=42):
+    import processor
+    # Log completo (debug) para que la comparación con la versión base sea sobre el mismo tamaño
+    return [
+        processor.process_invoice_text(text, log_level=processor.EXTRACTION_LOG_DEBUG)
+        for text in synthetic_ocr_corpus(size, seed)
+    ]
+
+def synthetic_invoice_rows(size, seed=42, start=0):
+    """
+    Filas de facturas (IDs start+1 .. start+size) con los campos y el log que
+    produce la extracción sobre el corpus sintético, reutilizado de forma cíclica.
+    :return: Tupla (filas, logs).
+    """
+    results = synthetic_extraction_results(1000, seed)
+    now = datetime.now()
+    rows, logs = [], []
+    for i in range(start, start + size):
+        result = results[i % len(results)]
+        data = result["data"]
+        rows.append({
+            "id": i + 1,
+            "invoice_number": f"BENCH-{i + 1}",
+            "provider_name": data.get("provider_name"),
+            "issue_date": data.get("issue_date"),
+            "due_date": data.get("due_date"),
+            "total_amount": data.get("total_amount"),
+            "taxes": data.get("taxes"),
+            "status": data.get("status"),
+            "created_at": now,
+            "last_updated": now,
+        })
+        logs.append(result["log"])
+    return rows, logs
+
+def table_bytes(engine, table_name):
+    """Bytes ocupados por una tabla (dbstat) o None si SQLite no lo soporta."""
+    from sqlalchemy import text
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT SUM(pgsize) FROM dbstat WHERE name = :name"), {"name": table_name}).scalar()
+    except Exception:
+        return None
+
+def bench_logs(size, baseline, repeat=200):
+    """
+    Tamaño de fila y latencia de las consultas calientes sobre `size` facturas:
+    log dentro de la fila (revisión `baseline`) frente a invoice_logs comprimido.
+    """
+    from sqlalchemy import create_engine, insert
+    from sqlalchemy.orm import sessionmaker
+    import database
+
+    baseline = baseline or root_revision()
+    legacy = load_module_revision("database", baseline)
+    rows, logs = synthetic_invoice_rows(size)
+    tmp_dir = tempfile.mkdtemp(prefix="bench_logs_")
+
+    def build(name, module, insert_chunk):
+        engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, name)}")
+        module.Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            for start in range(0, size, 10000):
+                insert_chunk(conn, rows[start:start + 10000], logs[start:start + 10000])
+        return engine
+
+    def insert_legacy(conn, chunk, chunk_logs):
+        conn.execute(insert(legacy.Invoice), [dict(row, extraction_log=log) for row, log in zip(chunk, chunk_logs)])
+
+    def insert_current(conn, chunk, chunk_logs):
+        conn.execute(insert(database.Invoice), chunk)
+        conn.execute(insert(database.InvoiceLog), [
+            {"invoice_id": row["id"], "log": database.compress_log(log)} for row, log in zip(chunk, chunk_logs)
+        ])
+
+    print(f"Generando {size} facturas en {tmp_dir} ...")
+    variants = [
+        ("antes", legacy.Invoice, build("before.db", legacy, insert_legacy)),
+        ("ahora", database.Invoice, build("after.db", database, insert_current)),
+    ]
+
+    rng = random.Random(7)
+    ids = [rng.randint(1, size) for _ in range(repeat)]
+    provider = rows[0]["provider_name"]
+    results = {}
+    for label, model, engine in variants:
+        Session = sessionmaker(bind=engine)
+
+        def timed(query):
+            # Primera consulta fuera de la medición (compilación del mapper y caché de páginas)
+            db = Session()
+            query(db, ids[0])
+            db.close()
+            timings = []
+            for invoice_id in ids:
+                db = Session()
+                start = time.perf_counter()
+                query(db, invoice_id)
+                timings.append((time.perf_counter() - start) * 1000)
+                db.close()
+            return statistics.median(timings)
+
+        def scan():
+            db = Session()
+            try:
+                db.query(model).filter(model.provider_name == provider).all()
+            finally:
+                db.close()
+
+        invoices_bytes = table_bytes(engine, "invoices")
+        results[label] = {
+            "bytes/fila invoices": invoices_bytes / size if invoices_bytes else float("nan"),
+            "estado por id (ms)": timed(lambda db, i: db.query(model).filter(model.id == i).first()),
+            "duplicado por número (ms)": timed(
+                lambda db, i: db.query(model).filter(model.invoice_number == f"BENCH-{i}").first()
+            ),
+            "recorrido por proveedor (ms)": time_call(scan, 3),
+        }
+        engine.dispose()
+
+    logs_bytes = table_bytes(variants[1][2], "invoice_logs")
+    print(f"{'métrica':<30} {'antes':>12} {'ahora':>12}")
+    for metric in results["antes"]:
+        print(f"{metric:<30} {results['antes'][metric]:>12.2f} {results['ahora'][metric]:>12.2f}")
+    if logs_bytes:
+        print(f"invoice_logs (comprimido): {logs_bytes / size:.0f} bytes/factura, "
+              f"log sin comprimir: {statistics.mean(len(log.encode('utf-8')) for log in logs):.0f} bytes/factura")
+
+    Session = sessionmaker(bind=variants[1][2])
+    db = Session()
+    try:
+        load_ms = time_call(lambda: database.get_extraction_log(db, ids[0]), repeat)
+    finally:
+        db.close()
+    variants[1][2].dispose()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    print(f"Carga bajo demanda del log (get_extraction_log): {load_ms:.3f} ms")
+
+# -------------------------------------------------------------------------
+# CARGA SOBRE invoices: ÍNDICES, WAL Y CONSULTAS POR COLUMNAS
+# -------------------------------------------------------------------------
+
+def percentiles(timings):
+    cuts = statistics.quantiles(timings, n=100)
+    return statistics.median(timings), cuts[94], cuts[98]
+
+def bench_db_load(size, requests, threads, baseline):
+    """
+    Latencias p50/p95/p99 de las consultas de estado y del webhook sobre
+    `size` facturas, con `threads` clientes concurrentes: esquema, PRAGMAs y
+    funciones de la revisión `baseline` frente a los actuales.
+    """
+    from sqlalchemy import create_engine, event, insert, text
+    from sqlalchemy.orm import sessionmaker
+    import database
+
+    baseline = baseline or root_revision()
+    legacy = load_module_revision("database", baseline)
+    tmp_dir = tempfile.mkdtemp(prefix="bench_db_load_")
+    db_path = os.path.join(tmp_dir, "load.db")
+
+    # Esquema de la versión base: tabla actual sin los índices que se agregaron
+    # después y con las columnas antiguas que ya no existen (vacías)
+    engine = create_engine(f"sqlite:///{db_path}")
+    database.Base.metadata.create_all(engine)
+    legacy_indexes = {index.name for index in legacy.Invoice.__table__.indexes}
+    new_indexes = [index for index in database.Invoice.__table__.indexes if index.name not in legacy_indexes]
+    print(f"Generando {size} facturas en {db_path} ...")
+    with engine.begin() as conn:
+        for index in new_indexes:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+        for column in legacy.Invoice.__table__.columns:
+            if column.name not in database.Invoice.__table__.columns:
+                conn.execute(text(f"ALTER TABLE invoices ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"))
+        for start in range(0, size, 50000):
+            rows, _ = synthetic_invoice_rows(min(50000, size - start), start=start)
+            conn.execute(insert(database.Invoice), rows)
+    engine.dispose()
+
+    def run_load(Session, status_lookup, webhook, listing):
+        """Mezcla de peticiones (80% estado, 15% webhook, 5% listado) repartida entre hilos."""
+        rng = random.Random(11)
+        plan = [
+            (rng.choices(["estado", "webhook", "listado"], weights=[80, 15, 5])[0], rng.randint(1, size))
+            for _ in range(requests)
+        ]
+        operations = {"estado": status_lookup, "webhook": webhook, "listado": listing}
+
+        def execute(step):
+            name, invoice_id = step
+            db = Session()
+            try:
+                start = time.perf_counter()
+                operations[name](db, invoice_id)
+                return name, (time.perf_counter() - start) * 1000
+            finally:
+                db.close()
+
+        timings = {name: [] for name in operations}
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for name, elapsed in executor.map(execute, plan):
+                timings[name].append(elapsed)
+        return timings
+
+    def new_status(invoice_id):
+        return random.choice([database.STATUS_APROBADO, database.STATUS_RECHAZADO])
+
+    # Antes: PRAGMAs por defecto, sin índices, objetos ORM completos
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    Session = sessionmaker(bind=engine)
+    LegacyInvoice = legacy.Invoice
+
+    def legacy_status(db, invoice_id):
+        invoice = db.query(LegacyInvoice).filter(LegacyInvoice.id == invoice_id).first()
+        return invoice.id, invoice.invoice_number, invoice.status, invoice.total_amount, invoice.last_updated
+
+    def legacy_listing(db, invoice_id):
+        return db.query(LegacyInvoice).filter(LegacyInvoice.status == database.STATUS_EN_PROCESO).order_by(
+            LegacyInvoice.issue_date.desc()
+        ).limit(50).all()
+
+    print(f"Carga: {requests} peticiones con {threads} hilos.")
+    before = run_load(
+        Session, legacy_status,
+        lambda db, invoice_id: legacy.update_invoice_status(db, invoice_id, new_status(invoice_id), "benchmark"),
+        legacy_listing
+    )
+    engine.dispose()
+
+    # Ahora: índices nuevos, PRAGMAs de database.py y consultas por columnas
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", database.set_sqlite_pragmas)
+    with engine.begin() as conn:
+        for index in new_indexes:
+            index.create(bind=conn, checkfirst=True)
+    Session = sessionmaker(bind=engine)
+    Invoice = database.Invoice
+
+    def current_status(db, invoice_id):
+        return db.query(
+            Invoice.id, Invoice.invoice_number, Invoice.status, Invoice.total_amount, Invoice.last_updated
+        ).filter(Invoice.id == invoice_id).first()
+
+    def current_listing(db, invoice_id):
+        return db.query(Invoice).filter(Invoice.status == database.STATUS_EN_PROCESO).order_by(
+            Invoice.issue_date.desc()
+        ).limit(50).all()
+
+    after = run_load(
+        Session, current_status,
+        lambda db, invoice_id: database.update_invoice_status(db, invoice_id, new_status(invoice_id), "benchmark"),
+        current_listing
+    )
+    engine.dispose()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print(f"{'operación':<10} {'n':>6} {'p50 antes':>10} {'p50 ahora':>10} {'p95 antes':>10} {'p95 ahora':>10} {'p99 antes':>10} {'p99 ahora':>10}")
+    for name in before:
+        if len(before[name]) < 2 or len(after[name]) < 2:
+            continue
+        (b50, b95, b99), (a50, a95, a99) = percentiles(before[name]), percentiles(after[name])
+        print(f"{name:<10} {len(after[name]):>6} {b50:>10.2f} {a50:>10.2f} {b95:>10.2f} {a95:>10.2f} {b99:>10.2f} {a99:>10.2f}")
+    print("Latencias en ms.")
+
+# -------------------------------------------------------------------------
+# BÚSQUEDA DE TEXTO COMPLETO: LIKE vs. ÍNDICE FTS5
+# -------------------------------------------------------------------------
+
+def synthetic_search_vocabulary(size=5000, seed=5):
+    """Palabras inventadas para los conceptos de las facturas (frecuencia tipo Zipf según su posición)."""
+    rng = random.Random(seed)
+    syllables = ["ma", "re", "to", "sa", "li", "co", "ne", "pu", "ra", "de", "ti", "lo", "ve", "ga", "zu", "fi"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(3, 5))))
+    return sorted(words)
+
+def bench_search(size, queries, like_queries):
+    """
+    Latencias p50/p95/p99 de la búsqueda de texto completo (con fragmentos y
+    filtros) sobre `size` facturas con su texto OCR, frente a un LIKE sobre el
+    mismo texto sin índice.
+    """
+    from sqlalchemy import create_engine, event, insert, text
+    from sqlalchemy.orm import sessionmaker
+    import database
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_search_")
+    db_path = os.path.join(tmp_dir, "search.db")
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", database.set_sqlite_pragmas)
+    database.Base.metadata.create_all(engine)
+    database.create_search_index(engine)
+
+    corpus = synthetic_ocr_corpus(10000)
+    vocabulary = synthetic_search_vocabulary()
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    rng = random.Random(9)
+    print(f"Generando {size} facturas con texto OCR en {db_path} ...")
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        for offset in range(0, size, 50000):
+            rows, _ = synthetic_invoice_rows(min(50000, size - offset), start=offset)
+            conn.execute(insert(database.Invoice), rows)
+            conn.execute(insert(database.InvoiceText), [
+                {
+                    "invoice_id": row["id"],
+                    "ocr_text": f"{row['invoice_number']}\n{corpus[row['id'] % len(corpus)]}"
+                                f"Concepto: {' '.join(rng.choices(vocabulary, weights, k=4))}\n"
+                }
+                for row in rows
+            ])
+    database.optimize_search_index(engine)
+    print(f"Carga e indexado: {time.perf_counter() - start:.1f} s. "
+          f"Tamaño de la base: {os.path.getsize(db_path) / 2 ** 20:.0f} MB")
+
+    Session = sessionmaker(bind=engine)
+    cases = [
+        ("palabra rara", lambda: {"query": rng.choice(vocabulary[2000:])}),
+        ("palabra media", lambda: {"query": rng.choice(vocabulary[50:500])}),
+        ("palabra común", lambda: {"query": rng.choice(vocabulary[:5])}),
+        ("muy común", lambda: {"query": "factura"}),
+        ("prefijo", lambda: {"query": rng.choice(vocabulary[100:1000])[:4] + "*"}),
+        ("dos palabras", lambda: {"query": " ".join(rng.sample(vocabulary[:300], 2))}),
+        ("nº de factura", lambda: {"query": f"BENCH-{rng.randint(1, size)}"}),
+        ("común + estado", lambda: {"query": rng.choice(vocabulary[:5]), "statuses": [database.STATUS_EN_PROCESO]}),
+        ("común + fechas", lambda: {
+            "query": rng.choice(vocabulary[:5]), "date_from": datetime(2025, 3, 1), "date_to": datetime(2025, 4, 1)
+        }),
+    ]
+
+    def measure(run, count):
+        timings = []
+        db = Session()
+        try:
+            for _ in range(count):
+                started = time.perf_counter()
+                run(db)
+                timings.append((time.perf_counter() - started) * 1000)
+        finally:
+            db.close()
+        return timings
+
+    print(f"{'búsqueda':<16} {'método':<6} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, make_args in cases:
+        timings = measure(lambda db: database.search_invoices(db, limit=20, **make_args()), queries)
+        print(f"{name:<16} {'fts5':<6} {len(timings):>5} " + " ".join(f"{p:>9.2f}" for p in percentiles(timings)))
+    like = text("SELECT invoice_id FROM invoice_texts WHERE ocr_text LIKE :pattern LIMIT 20")
+    timings = measure(lambda db: db.execute(like, {"pattern": f"%{rng.choice(vocabulary[2000:])}%"}).all(), like_queries)
+    print(f"{'palabra rara':<16} {'LIKE':<6} {len(timings):>5} " + " ".join(f"{p:>9.2f}" for p in percentiles(timings)))
+
+    engine.dispose()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+# -------------------------------------------------------------------------
+# INFORME DE GASTO: GROUP BY SOBRE invoices vs. RESUMEN spend_summary
+# -------------------------------------------------------------------------
+
+def bench_spend(size, queries, updates):
+    """
+    Latencia del informe de gasto agrupando toda la tabla invoices frente a
+    leer spend_summary, y costo de los triggers en la carga y en los cambios
+    de estado.
+    """
+    from sqlalchemy import create_engine, event, insert, text
+    from sqlalchemy.orm import sessionmaker
+    import database
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_spend_")
+    db_path = os.path.join(tmp_dir, "spend.db")
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", database.set_sqlite_pragmas)
+    database.Base.metadata.create_all(engine)
+
+    def load(start, count):
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            for offset in range(start, start + count, 50000):
+                rows, _ = synthetic_invoice_rows(min(50000, start + count - offset), start=offset)
+                conn.execute(insert(database.Invoice), rows)
+        return time.perf_counter() - started
+
+    # La mitad se carga sin triggers y la otra mitad con ellos
+    half = size // 2
+    print(f"Generando {size} facturas en {db_path} ...")
+    without_triggers = load(0, half)
+    database.create_spend_summary_triggers(engine)
+    with_triggers = load(half, size - half)
+    print(f"Carga sin triggers: {half / without_triggers:,.0f} facturas/s; "
+          f"con triggers: {(size - half) / with_triggers:,.0f} facturas/s")
+
+    Session = sessionmaker(bind=engine)
+    rng = random.Random(3)
+    scan = text(
+        "SELECT provider_name, strftime('%Y-%m', issue_date) AS period, COUNT(*), SUM(total_amount), SUM(taxes) "
+        "FROM invoices WHERE status = :status GROUP BY 1, 2"
+    )
+    statuses = [database.STATUS_EN_PROCESO, database.STATUS_APROBADO, database.STATUS_RECHAZADO]
+
+    def measure(run, count):
+        timings = []
+        db = Session()
+        try:
+            for _ in range(count):
+                started = time.perf_counter()
+                run(db)
+                timings.append((time.perf_counter() - started) * 1000)
+        finally:
+            db.close()
+        return timings
+
+    print(f"{'operación':<28} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    cases = [
+        ("GROUP BY sobre invoices", lambda db: db.execute(scan, {"status": rng.choice(statuses)}).all(), max(1, queries // 20)),
+        ("spend_summary", lambda db: database.spend_report(db, statuses=[rng.choice(statuses)]), queries),
+        ("cambio de estado", lambda db: database.update_invoice_status(
+            db, rng.randint(1, size), rng.choice(statuses)), updates),
+    ]
+    for name, run, count in cases:
+        timings = measure(run, count)
+        print(f"{name:<28} {len(timings):>5} " + " ".join(f"{p:>9.2f}" for p in percentiles(timings)))
+
+    db = Session()
+    try:
+        started = time.perf_counter()
+        differences = database.check_spend_summary(db)
+        print(f"Verificación del resumen: {len(differences)} diferencias ({time.perf_counter() - started:.1f} s)")
+    finally:
+        db.close()
+
+    engine.dispose()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+# -------------------------------------------------------------------------
+# NIVELES DEL LOG DE EXTRACCIÓN
+# -------------------------------------------------------------------------
+
+def bench_extraction_log(size):
+    """Costo de la extracción y tamaño del log con cada nivel de EXTRACTION_LOG_LEVEL."""
+    import processor
+
+    corpus = synthetic_ocr_corpus(size)
+    print(f"Corpus: {size} textos OCR sintéticos.")
+    print(f"{'nivel':<10} {'total ms':>10} {'µs/factura':>12} {'bytes de log':>14}")
+    for level in processor.EXTRACTION_LOG_LEVELS:
+        logs = [processor.process_invoice_text(text, log_level=level)["log"] for text in corpus]
+        elapsed = time_call(lambda: [processor.process_invoice_text(text, log_level=level) for text in corpus], 5)
+        log_bytes = sum(len(log.encode("utf-8")) for log in logs if log) / size
+        print(f"{level:<10} {elapsed:>10.1f} {elapsed * 1000 / size:>12.1f} {log_bytes:>14.0f}")
+
+# -------------------------------------------------------------------------
+# RENDERIZADO DE CORREOS: f-strings POR FACTURA vs. PLANTILLAS COMPILADAS
+# -------------------------------------------------------------------------
+
+def bench_emails(count, baseline):
+    """
+    Renderizado de `count` correos de aprobación y de notificación (mailer.py):
+    f-strings de la revisión `baseline` frente a las plantillas compiladas,
+    que además generan la alternativa en texto plano.
+    """
+    import mailer
+    import email_templates
+    import notification_service
+
+    baseline = baseline or root_revision()
+    rng = random.Random(3)
+    invoices = [
+        types.SimpleNamespace(
+            id=i + 1,
+            invoice_number=f"F-{i + 1:06d}",
+            provider_name=rng.choice(PROVIDERS),
+            issue_date=datetime(2025, rng.randint(1, 12), rng.randint(1, 28)),
+            due_date=datetime(2026, 1, 15) if rng.random() < 0.6 else None,
+            total_amount=rng.uniform(10, 5000),
+            taxes=rng.uniform(1, 800)
+        )
+        for i in range(count)
+    ]
+
+    try:
+        legacy_service = load_module_revision("notification_service", baseline)
+        legacy_mailer = load_module_revision("mailer", baseline)
+    except Exception as e:
+        legacy_service = legacy_mailer = None
+        print(f"No se pudo cargar la versión base ({e}); solo se miden las plantillas.")
+
+    # Primera compilación de las plantillas fuera de la medición
+    start = time.perf_counter()
+    notification_service.render_approval(invoices[0])
+    mailer.create_interactive_email_html(invoices[0])
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    rows = []
+    if legacy_service:
+        rows.append(("aprobación (base, solo HTML)", lambda: [legacy_service.generate_email_body(i) for i in invoices]))
+    rows.append(("aprobación (HTML + texto)", lambda: [notification_service.render_approval(i) for i in invoices]))
+    rows.append(("aprobación en bloque", lambda: notification_service.render_approvals_bulk(invoices)))
+    if legacy_mailer:
+        rows.append(("mailer (base, solo HTML)", lambda: [legacy_mailer.create_interactive_email_html(i) for i in invoices]))
+    rows.append(("mailer (HTML + texto)", lambda: [
+        email_templates.render("invoice_notification", mailer.invoice_notification_context(i)) for i in invoices
+    ]))
+    rows.append(("digests de 20 facturas", lambda: [
+        notification_service.render_approval_digest(invoices[start:start + 20]) for start in range(0, count, 20)
+    ]))
+
+    print(f"{count} correos. Compilación inicial de plantillas: {compile_ms:.2f} ms")
+    print(f"{'renderizado':<30} {'total ms':>10} {'µs/correo':>10}")
+    for name, func in rows:
+        elapsed = time_call(func, 3)
+        print(f"{name:<30} {elapsed:>10.1f} {elapsed * 1000 / count:>10.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks del pipeline de facturas.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    tempfile_parser = subparsers.add_parser("tempfile", help="Costo de los archivos temporales antes del OCR.")
+    tempfile_parser.add_argument("--repeat", type=int, default=20)
+
+    extraction_parser = subparsers.add_parser("extraction", help="Motor de extracción de campos frente a la versión base.")
+    extraction_parser.add_argument("--invoices", type=int, default=2000)
+    extraction_parser.add_argument("--baseline", default=None, help="Revisión git de referencia (por defecto, la inicial).")
+
+    preprocessing_parser = subparsers.add_parser("preprocessing", help="Latencia y precisión del OCR con y sin preprocesamiento.")
+    preprocessing_parser.add_argument("--repeat", type=int, default=5)
+
+    backends_parser = subparsers.add_parser("backends", help="Throughput de los backends de OCR.")
+    backends_parser.add_argument("--repeat", type=int, default=5)
+
+    logs_parser = subparsers.add_parser("logs", help="Tamaño de fila y latencia con el log fuera de invoices.")
+    logs_parser.add_argument("--rows", type=int, default=100000)
+    logs_parser.add_argument("--baseline", default=None, help="Revisión git de referencia (por defecto, la inicial).")
+
+    load_parser = subparsers.add_parser("db-load", help="p99 de estado y webhook sobre una tabla grande.")
+    load_parser.add_argument("--rows", type=int, default=1000000)
+    load_parser.add_argument("--requests", type=int, default=5000)
+    load_parser.add_argument("--threads", type=int, default=4)
+    load_parser.add_argument("--baseline", default=None, help="Revisión git de referencia (por defecto, la inicial).")
+
+    search_parser = subparsers.add_parser("search", help="Latencia de la búsqueda de texto completo.")
+    search_parser.add_argument("--rows", type=int, default=1000000)
+    search_parser.add_argument("--queries", type=int, default=200, help="Búsquedas por tipo.")
+    search_parser.add_argument("--like-queries", type=int, default=5, help="Búsquedas con LIKE (sin índice).")
+
+    spend_parser = subparsers.add_parser("spend", help="Informe de gasto con y sin el resumen incremental.")
+    spend_parser.add_argument("--rows", type=int, default=1000000)
+    spend_parser.add_argument("--queries", type=int, default=200, help="Consultas al resumen.")
+    spend_parser.add_argument("--updates", type=int, default=2000, help="Cambios de estado.")
+
+    extraction_log_parser = subparsers.add_parser("extraction-log", help="Costo de cada nivel del log de extracción.")
+    extraction_log_parser.add_argument("--invoices", type=int, default=2000)
+
+    emails_parser = subparsers.add_parser("emails", help="Renderizado masivo de correos.")
+    emails_parser.add_argument("--count", type=int, default=10000)
+    emails_parser.add_argument("--baseline", default=None, help="Revisión git de referencia (por defecto, la inicial).")
+
+    args = parser.parse_args()
+    if args.benchmark == "tempfile":
+        bench_tempfile(args.repeat)
+    elif args.benchmark == "extraction":
+        bench_extraction(args.invoices, args.baseline)
+    elif args.benchmark == "preprocessing":
+        bench_preprocessing(args.repeat)
+    elif args.benchmark == "backends":
+        bench_backends(args.repeat)
+    elif args.benchmark == "logs":
+        bench_logs(args.rows, args.baseline)
+    elif args.benchmark == "db-load":
+        bench_db_load(args.rows, args.requests, args.threads, args.baseline)
+    elif args.benchmark == "search":
+        bench_search(args.rows, args.queries, args.like_queries)
+    elif args.benchmark == "spend":
+        bench_spend(args.rows, args.queries, args.updates)
+    elif args.benchmark == "extraction-log":
+        bench_extraction_log(args.invoices)
+    elif args.benchmark == "emails":
+        bench_emails(args.count, args.baseline)
@@ -0,0 +1,112 @@
+# email_templates.py
+
+"""
+Capa de plantillas de correo compartida por notification_service.py y mailer.py.
+
+Las plantillas viven en templates/email/ con la sintaxis de string.Template
+($campo o ${campo}) y cada cuerpo HTML tiene su alternativa en texto plano
+(.html / .txt). Cada archivo se lee y se compila una sola vez por proceso en
+una lista de fragmentos fijos, de modo que renderizar es rellenar los huecos
+y hacer un único join. En las plantillas .html los valores se escapan
+automáticamente.
+"""
+
+import os
+import html
+import string
+from collections import namedtuple
+from functools import lru_cache
+from email.message import EmailMessage
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "email")
+
+# Fragmento ya renderizado en ambas variantes (p. ej. las filas de una tabla);
+# se inserta tal cual, sin volver a escaparlo.
+RenderedPart = namedtuple("RenderedPart", ["html", "text"])
+
+class CompiledTemplate:
+    """
+    Plantilla string.Template partida una sola vez en fragmentos fijos y
+    huecos; renderizar es rellenar los huecos y unir la lista.
+    """
+
+    def __init__(self, source, is_html):
+        self.is_html = is_html
+        parts, slots = [], []
+        literal, position = [], 0
+        for match in string.Template.pattern.finditer(source):
+            if match.group("invalid") is not None:
+                raise ValueError(f"Marcador inválido en la posición {match.start()} de la plantilla.")
+            literal.append(source[position:match.start()])
+            position = match.end()
+            if match.group("escaped") is not None:
+                literal.append("$")
+                continue
+            parts.append("".join(literal))
+            literal = []
+            slots.append((len(parts), match.group("named") or match.group("braced")))
+            parts.append(None)
+        literal.append(source[position:])
+        parts.append("".join(literal))
+
+        self._parts = parts
+        self._slots = slots
+        self.fields = tuple(dict.fromkeys(name for _, name in slots))
+        self._convert = _convert_html if is_html else _convert_text
+
+    def render(self, context):
+        output = self._parts[:]
+        convert = self._convert
+        for index, name in self._slots:
+            output[index] = convert(context[name])
+        return "".join(output)
+
+def _convert_html(value):
+    if isinstance(value, RenderedPart):
+        return value.html
+    return html.escape(str(value)) if value is not None else "N/A"
+
+def _convert_text(value):
+    if isinstance(value, RenderedPart):
+        return value.text
+    return str(value) if value is not None else "N/A"
+
+@lru_cache(maxsize=None)
+def get_template(filename):
+    """Plantilla compilada de templates/email/ (se lee y compila una vez por proceso)."""
+    with open(os.path.join(TEMPLATES_DIR, filename), 'r', encoding='utf-8') as f:
+        source = f.read()
+    return CompiledTemplate(source, is_html=filename.endswith(".html"))
+
+def render(name, context):
+    """
+    Renderiza la plantilla `name` (sin extensión) en sus dos variantes.
+    :return: Tupla (html, texto).
+    """
+    return get_template(name + ".html").render(context), get_template(name + ".txt").render(context)
+
+def render_rows(name, contexts):
+    """Renderiza y une un bloque repetido (filas de una tabla) para insertarlo en otra plantilla."""
+    html_template, text_template = get_template(name + ".html"), get_template(name + ".txt")
+    return RenderedPart(
+        "".join(html_template.render(context) for context in contexts),
+        "".join(text_template.render(context) for context in contexts)
+    )
+
+def render_bulk(name, contexts):
+    """
+    Renderiza muchos correos con la misma plantilla (notificaciones masivas).
+    :return: Lista de tuplas (html, texto) en el orden de `contexts`.
+    """
+    html_render, text_render = get_template(name + ".html").render, get_template(name + ".txt").render
+    return [(html_render(context), text_render(context)) for context in contexts]
+
+def build_message(subject, sender, recipient, html_body, text_body):
+    """Mensaje multipart/alternative: texto plano y HTML."""
+    message = EmailMessage()
+    message['Subject'] = subject
+    message['From'] = sender
+    message['To'] = recipient
+    message.set_content(text_body)
+    message.add_alternative(html_body, subtype='html')
+    return message
@@ -0,0 +1,310 @@
+# event_stream.py
+
+"""
+Difusión de cambios de estado de las facturas (Server-Sent Events).
+
+Los cambios se registran en invoice_events en la misma transacción que los
+produce (update_invoice_status, la subida síncrona, la cola de OCR de
+worker.py), de modo que también llegan los de otros procesos. Cada proceso
+de la app tiene un único hilo que lee los eventos nuevos y los reparte
+entre los clientes conectados: la base de datos recibe una consulta por
+intervalo, no una por cliente.
+
+Cada evento lleva su ID en los datos. El `id:` de cada mensaje SSE es la
+posición desde la que reanudar: el ID más alto por debajo del cual ya no
+queda ningún evento por confirmar (ver EventCursor). Un cliente que se
+reconecta con Last-Event-ID recibe los eventos que se perdió; alguno de los
+más recientes puede repetirse y se reconoce por su ID.
+"""
+
+import os
+import json
+import queue
+import logging
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, or_
+from dotenv import load_dotenv
+
+from database import SessionLocal, InvoiceEvent
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Configuración del stream
+EVENT_POLL_INTERVAL = float(os.environ.get("EVENT_POLL_INTERVAL", 0.5))
+EVENT_BATCH_SIZE = int(os.environ.get("EVENT_BATCH_SIZE", 500))
+# Eventos pendientes por cliente; un cliente más lento se desconecta y se reanuda con Last-Event-ID
+EVENT_SUBSCRIBER_QUEUE = int(os.environ.get("EVENT_SUBSCRIBER_QUEUE", 1000))
+# Antigüedad máxima de los eventos guardados (horas) y cada cuánto se purgan (segundos)
+EVENT_RETENTION_HOURS = float(os.environ.get("EVENT_RETENTION_HOURS", 24))
+EVENT_PRUNE_INTERVAL = float(os.environ.get("EVENT_PRUNE_INTERVAL", 3600))
+# Segundos que se espera a que se confirme un ID saltado antes de darlo por perdido
+EVENT_GAP_TIMEOUT = float(os.environ.get("EVENT_GAP_TIMEOUT", 60))
+# IDs saltados que se siguen como máximo
+EVENT_MAX_GAPS = int(os.environ.get("EVENT_MAX_GAPS", 10000))
+
+# -------------------------------------------------------------------------
+# LECTURA DE EVENTOS
+# -------------------------------------------------------------------------
+
+def serialize_event(event):
+    return {
+        "id": event.id,
+        "invoice_id": event.invoice_id,
+        "status": event.status,
+        "job_status": event.job_status,
+        "created_at": event.created_at.isoformat() if event.created_at else None
+    }
+
+def events_since(db, last_id, invoice_ids=None, limit=EVENT_BATCH_SIZE):
+    """Eventos con ID mayor que `last_id` (opcionalmente solo de `invoice_ids`), en orden."""
+    query = db.query(InvoiceEvent).filter(InvoiceEvent.id > last_id)
+    if invoice_ids:
+        query = query.filter(InvoiceEvent.invoice_id.in_(invoice_ids))
+    return query.order_by(InvoiceEvent.id).limit(limit).all()
+
+def latest_event_id(db):
+    return db.query(func.max(InvoiceEvent.id)).scalar() or 0
+
+class EventCursor:
+    """
+    Posición de lectura de invoice_events que no pierde los eventos
+    confirmados fuera de orden.
+
+    En PostgreSQL el ID se asigna al insertar, no al confirmar: una
+    transacción con el ID 41 puede confirmarse después de que otra con el 42
+    ya se haya leído, y un `id > last_id` no la vería nunca. Los IDs saltados
+    quedan como huecos pendientes y se vuelven a consultar en cada lectura
+    hasta que aparecen o pasa EVENT_GAP_TIMEOUT (las transacciones revertidas
+    también dejan huecos en la secuencia).
+    """
+
+    def __init__(self, last_id=0, gap_timeout=EVENT_GAP_TIMEOUT, max_gaps=EVENT_MAX_GAPS):
+        self.last_id = last_id
+        self.gap_timeout = gap_timeout
+        self.max_gaps = max_gaps
+        # ID saltado -> momento (time.monotonic) en que se deja de esperar
+        self.gaps = {}
+
+    @property
+    def resume_id(self):
+        """ID por debajo del cual ya no queda nada pendiente."""
+        return min(self.gaps) - 1 if self.gaps else self.last_id
+
+    def fetch(self, db, limit=EVENT_BATCH_SIZE):
+        """Eventos nuevos o que rellenan un hueco, en orden. No mueve la posición: ver advance()."""
+        condition = InvoiceEvent.id > self.last_id
+        if self.gaps:
+            condition = or_(condition, InvoiceEvent.id.in_(list(self.gaps)))
+        return db.query(InvoiceEvent).filter(condition).order_by(InvoiceEvent.id).limit(limit).all()
+
+    def advance(self, events):
+        """Registra los eventos de fetch(): rellena huecos, anota los nuevos y descarta los caducados."""
+        now = time.monotonic()
+        for event in events:
+            if self.gaps.pop(event.id, None) is not None or event.id <= self.last_id:
+                continue
+            skipped = range(self.last_id + 1, event.id)
+            room = self.max_gaps - len(self.gaps)
+            if len(skipped) > room:
+                logger.warning("Salto de %d IDs en invoice_events; solo se esperan los %d últimos", len(skipped), max(room, 0))
+                skipped = skipped[len(skipped) - max(room, 0):]
+            for event_id in skipped:
+                self.gaps[event_id] = now + self.gap_timeout
+            self.last_id = event.id
+        for event_id in [event_id for event_id, deadline in self.gaps.items() if deadline <= now]:
+            del self.gaps[event_id]
+        return events
+
+def prune_events(db, retention_hours=EVENT_RETENTION_HOURS):
+    """Elimina los eventos más antiguos que la retención configurada."""
+    deleted = db.query(InvoiceEvent).filter(
+        InvoiceEvent.created_at < datetime.utcnow() - timedelta(hours=retention_hours)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+# -------------------------------------------------------------------------
+# DIFUSIÓN A LOS CLIENTES CONECTADOS
+# -------------------------------------------------------------------------
+
+class Subscription:
+    """Cola de eventos de un cliente, filtrada opcionalmente por facturas."""
+
+    def __init__(self, invoice_ids=None, last_id=0, maxsize=EVENT_SUBSCRIBER_QUEUE):
+        self.invoice_ids = set(invoice_ids) if invoice_ids else None
+        # El cliente ya tiene todos los eventos hasta `last_id`
+        self.last_id = last_id
+        # Posición para reanudar (el `id:` de SSE); solo avanza
+        self.resume_id = last_id
+        self.events = queue.Queue(maxsize=maxsize)
+        # Se marca si el cliente no consume a tiempo; el stream se cierra y el cliente se reanuda
+        self.overflowed = False
+        # Posición del difusor al suscribirse (ver EventBroker.subscribe); None si aún no leía
+        self.broker_last_id = None
+        self.broker_gaps = frozenset()
+        # Eventos enviados por la recuperación que el difusor todavía publicará
+        self._delivered = set()
+
+    def wants(self, event):
+        return self.invoice_ids is None or event["invoice_id"] in self.invoice_ids
+
+    def _advance_resume(self, event_id, broker_resume_id):
+        if broker_resume_id is not None:
+            self.resume_id = max(self.resume_id, min(event_id, broker_resume_id))
+        return self.resume_id
+
+    def catch_up(self, event_id, broker_resume_id):
+        """
+        Anota un evento enviado por la recuperación inicial, leída cuando el
+        difusor estaba en `broker_resume_id`, y devuelve la posición desde la
+        que reanudar tras él.
+        """
+        if self.broker_last_id is None or event_id > self.broker_last_id or event_id in self.broker_gaps:
+            self._delivered.add(event_id)
+        return self._advance_resume(event_id, broker_resume_id)
+
+    def get(self, timeout):
+        """Siguiente evento nuevo o None si no llegó ninguno en `timeout` segundos."""
+        try:
+            event, broker_resume_id = self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self._advance_resume(event["id"], broker_resume_id)
+        if event["id"] <= self.last_id or event["id"] in self._delivered:
+            self._delivered.discard(event["id"])
+            return None
+        return event
+
+class EventBroker:
+    """
+    Un hilo por proceso lee invoice_events cada EVENT_POLL_INTERVAL segundos
+    mientras haya clientes conectados y reparte cada evento nuevo.
+    """
+
+    def __init__(self, poll_interval=EVENT_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._cursor = None
+        self._last_prune = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="invoice-events", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def subscribe(self, invoice_ids=None, last_id=0):
+        """
+        Registra un cliente que ya conoce los eventos hasta `last_id`. Los
+        eventos confirmados antes de suscribirse los recupera el propio
+        cliente con events_since() y los anota con Subscription.catch_up():
+        con la posición del difusor en este momento se sabe cuáles volverá
+        a publicar y se descartan al llegar.
+        """
+        subscription = Subscription(invoice_ids, last_id)
+        with self._lock:
+            if self._cursor is not None:
+                subscription.broker_last_id = self._cursor.last_id
+                subscription.broker_gaps = frozenset(self._cursor.gaps)
+            self._subscribers.add(subscription)
+        self._wakeup.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    @property
+    def resume_id(self):
+        """Posición del difusor: por debajo de ella no queda ningún evento por confirmar."""
+        cursor = self._cursor
+        return cursor.resume_id if cursor is not None else None
+
+    def publish(self, event, resume_id, subscribers):
+        """Entrega un evento serializado a los clientes interesados."""
+        for subscription in subscribers:
+            if not subscription.wants(event):
+                continue
+            try:
+                subscription.events.put_nowait((event, resume_id))
+            except queue.Full:
+                subscription.overflowed = True
+                self.unsubscribe(subscription)
+
+    def poll_once(self, db):
+        """Lee los eventos confirmados desde la última lectura y los reparte."""
+        events = self._cursor.fetch(db)
+        # La posición y los clientes que reciben el lote cambian a la vez que en subscribe()
+        with self._lock:
+            self._cursor.advance(events)
+            resume_id = self._cursor.resume_id
+            subscribers = list(self._subscribers)
+        for event in events:
+            self.publish(serialize_event(event), min(event.id, resume_id), subscribers)
+        return len(events)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            with self._lock:
+                cursors = [subscription.resume_id for subscription in self._subscribers]
+                if not cursors:
+                    self._cursor = None
+                elif self._cursor is None:
+                    # Al reanudar basta con leer desde el cliente más atrasado
+                    self._cursor = EventCursor(min(cursors))
+            if not cursors:
+                # Sin clientes no se consulta la base de datos
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            db = SessionLocal()
+            try:
+                read = self.poll_once(db)
+                if self._last_prune is None or datetime.utcnow() - self._last_prune > timedelta(seconds=EVENT_PRUNE_INTERVAL):
+                    prune_events(db)
+                    self._last_prune = datetime.utcnow()
+            except Exception:
+                read = 0
+                logger.exception("Error al leer los eventos de estado")
+            finally:
+                db.close()
+
+            # Si el lote vino lleno quedan eventos por leer
+            if read < EVENT_BATCH_SIZE:
+                self._stopped.wait(self.poll_interval)
+
+_broker = None
+_broker_pid = None
+_broker_lock = threading.Lock()
+
+def get_broker():
+    """Difusor compartido del proceso; se inicia en el primer uso (uno nuevo tras un fork)."""
+    global _broker, _broker_pid
+    with _broker_lock:
+        if _broker is None or _broker_pid != os.getpid():
+            _broker = EventBroker().start()
+            _broker_pid = os.getpid()
+            atexit.register(_broker.stop)
+        return _broker
+
+def format_sse(data, event_id=None, event="status"):
+    """Mensaje en el formato de Server-Sent Events."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
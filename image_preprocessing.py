@@ -0,0 +1,167 @@
+# image_preprocessing.py
+
+import os
+from PIL import Image, ImageOps
+from dotenv import load_dotenv
+
+load_dotenv()
+
+def _env_flag(name, default):
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+# -------------------------------------------------------------------------
+# CONFIGURACIÓN DEL PREPROCESAMIENTO (antes de Tesseract)
+# -------------------------------------------------------------------------
+PREPROCESS_SETTINGS = {
+    # Activa todo el preprocesamiento
+    "enabled": _env_flag("PREPROCESS_ENABLED", "true"),
+    # Reducción a la resolución objetivo (solo se reduce, nunca se amplía)
+    "target_dpi": int(os.environ.get("PREPROCESS_TARGET_DPI", 300)),
+    # Lado máximo en píxeles cuando la imagen no trae DPI (A4 a 300 DPI)
+    "max_side": int(os.environ.get("PREPROCESS_MAX_SIDE", 3508)),
+    # Binarización con umbral de Otsu
+    "binarize": _env_flag("PREPROCESS_BINARIZE", "true"),
+    # Corrección de inclinación: ángulo máximo y paso de búsqueda (grados)
+    "deskew": _env_flag("PREPROCESS_DESKEW", "true"),
+    "max_skew": float(os.environ.get("PREPROCESS_MAX_SKEW", 5.0)),
+    "skew_step": float(os.environ.get("PREPROCESS_SKEW_STEP", 0.5)),
+    # Recorte al contenido, con un margen en píxeles
+    "crop": _env_flag("PREPROCESS_CROP", "true"),
+    "crop_margin": int(os.environ.get("PREPROCESS_CROP_MARGIN", 10)),
+}
+
+# Ancho de la miniatura usada para estimar la inclinación
+SKEW_THUMBNAIL_WIDTH = 400
+# Paso de la búsqueda gruesa de inclinación (grados); luego se refina con skew_step
+SKEW_COARSE_STEP = 1.0
+
+def config_signature(settings=None):
+    """
+    Cadena que identifica la configuración activa. Forma parte de la clave
+    de la caché de OCR, porque el texto reconocido depende de ella.
+    """
+    settings = PREPROCESS_SETTINGS if settings is None else settings
+    if not settings["enabled"]:
+        return "prep-off"
+    return "prep-" + ",".join(f"{key}={settings[key]}" for key in sorted(settings) if key != "enabled")
+
+# -------------------------------------------------------------------------
+# PASOS DEL PREPROCESAMIENTO
+# -------------------------------------------------------------------------
+
+def otsu_threshold(gray):
+    """Umbral de Otsu calculado sobre el histograma de una imagen en escala de grises."""
+    histogram = gray.histogram()[:256]
+    total = sum(histogram)
+    sum_total = sum(i * count for i, count in enumerate(histogram))
+
+    sum_background, weight_background = 0, 0
+    best_threshold, best_variance = 0, -1.0
+    for threshold, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += threshold * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_total - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = threshold, variance
+    return best_threshold
+
+def normalize_polarity(gray, threshold):
+    """Invierte las imágenes con fondo oscuro para dejar texto negro sobre blanco."""
+    histogram = gray.histogram()[:256]
+    dark_pixels = sum(histogram[:threshold + 1])
+    if dark_pixels > sum(histogram) / 2:
+        return ImageOps.invert(gray)
+    return gray
+
+def downscale(image, settings):
+    """Reduce la imagen a la resolución objetivo (o al lado máximo si no trae DPI)."""
+    dpi = image.info.get("dpi")
+    scale = 1.0
+    if dpi and dpi[0] and dpi[0] > settings["target_dpi"]:
+        scale = settings["target_dpi"] / float(dpi[0])
+    elif max(image.size) > settings["max_side"]:
+        scale = settings["max_side"] / float(max(image.size))
+
+    if scale >= 1.0:
+        return image
+    new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(new_size, Image.LANCZOS)
+
+def _row_profile_score(ink):
+    """Nitidez del perfil horizontal: alta cuando las líneas de texto están alineadas."""
+    rows = list(ink.resize((1, ink.height), Image.BOX).getdata())
+    return sum((rows[i + 1] - rows[i]) ** 2 for i in range(len(rows) - 1))
+
+def estimate_skew(gray, threshold, settings):
+    """Ángulo (grados) que mejor alinea las líneas de texto, por perfil de proyección."""
+    ink = gray.point([255 if i <= threshold else 0 for i in range(256)])
+    if ink.width > SKEW_THUMBNAIL_WIDTH:
+        ink = ink.resize((SKEW_THUMBNAIL_WIDTH, max(1, round(ink.height * SKEW_THUMBNAIL_WIDTH / ink.width))), Image.BOX)
+
+    scores = {0.0: _row_profile_score(ink)}
+
+    def score(angle):
+        if angle not in scores:
+            scores[angle] = _row_profile_score(ink.rotate(angle, resample=Image.NEAREST, fillcolor=0))
+        return scores[angle]
+
+    # Búsqueda gruesa en todo el rango y refinamiento alrededor del mejor ángulo
+    coarse_step = max(SKEW_COARSE_STEP, settings["skew_step"])
+    coarse_steps = int(settings["max_skew"] / coarse_step)
+    best_angle = max((step * coarse_step for step in range(-coarse_steps, coarse_steps + 1)), key=score)
+
+    fine_steps = int(coarse_step / settings["skew_step"])
+    candidates = [best_angle + step * settings["skew_step"] for step in range(-fine_steps + 1, fine_steps)]
+    return max((angle for angle in candidates if abs(angle) <= settings["max_skew"]), key=score)
+
+def crop_to_content(image, margin):
+    """Recorta la imagen (texto oscuro sobre blanco) al rectángulo con contenido."""
+    bbox = ImageOps.invert(image).getbbox()
+    if not bbox:
+        return image
+    left, top, right, bottom = bbox
+    return image.crop((
+        max(0, left - margin),
+        max(0, top - margin),
+        min(image.width, right + margin),
+        min(image.height, bottom + margin)
+    ))
+
+def preprocess_image(image, settings=None):
+    """
+    Prepara una imagen para Tesseract: escala de grises, reducción a la
+    resolución objetivo, corrección de inclinación, binarización y recorte
+    al contenido. Cada paso se puede desactivar en PREPROCESS_SETTINGS.
+    """
+    settings = PREPROCESS_SETTINGS if settings is None else settings
+    if not settings["enabled"]:
+        return image
+
+    gray = ImageOps.grayscale(image) if image.mode != "L" else image
+    gray.info = dict(image.info)
+    gray = downscale(gray, settings)
+
+    threshold = otsu_threshold(gray)
+    gray = normalize_polarity(gray, threshold)
+    # Umbral recalculado sobre la imagen ya normalizada
+    threshold = otsu_threshold(gray)
+
+    if settings["deskew"]:
+        angle = estimate_skew(gray, threshold, settings)
+        if angle:
+            gray = gray.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+    if settings["binarize"]:
+        gray = gray.point([0 if i <= threshold else 255 for i in range(256)])
+
+    if settings["crop"]:
+        gray = crop_to_content(gray, settings["crop_margin"])
+
+    return gray
@@ -0,0 +1,257 @@
+# ingest.py
+
+"""
+Ingesta masiva de facturas (backfill de archivos históricos).
+
+Uso:
+    python ingest.py <directorio | manifiesto.jsonl | lista.txt> [--workers N] [--batch-size N]
+
+Procesa los archivos con process_invoice_file en un pool de procesos e
+inserta los resultados en lotes (una transacción por lote). Las rutas de
+cada lote confirmado se guardan en el archivo de checkpoint, de modo que
+tras una caída la ingesta continúa donde quedó. Se puede ejecutar a la vez
+que la app o que otra ingesta: los conflictos se descartan como duplicados.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from database import (
+    SessionLocal,
+    Invoice,
+    InvoiceLog,
+    InvoiceText,
+    OutboxMessage,
+    check_schema,
+    compress_log,
+    add_invoice_events,
+    approval_notification_rows,
+    hash_blocks_reupload,
+    optimize_search_index,
+    STATUS_EN_PROCESO,
+    JOB_COMPLETADO
+)
+from ocr_cache import file_sha256
+from processor import process_invoice_file
+from notification_service import APPROVER_EMAILS
+
+ALLOWED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.pdf')
+DEFAULT_CHECKPOINT = ".ingest_checkpoint"
+
+# -------------------------------------------------------------------------
+# ORIGEN DE LOS ARCHIVOS
+# -------------------------------------------------------------------------
+
+def iter_source_paths(source):
+    """Rutas de facturas de un directorio (recursivo) o de un manifiesto."""
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if name.lower().endswith(ALLOWED_EXTENSIONS):
+                    yield os.path.join(root, name)
+        return
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if source.lower().endswith('.jsonl'):
+                # Manifiesto JSONL: una entrada por línea con la ruta del archivo
+                entry = json.loads(line)
+                line = entry.get("path") or entry.get("file_path") or entry.get("file")
+                if not line:
+                    continue
+            yield line if os.path.isabs(line) else os.path.join(base_dir, line)
+
+def load_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        return {line.rstrip('\n') for line in f if line.strip()}
+
+def append_checkpoint(checkpoint_path, paths):
+    with open(checkpoint_path, 'a', encoding='utf-8') as f:
+        f.writelines(path + '\n' for path in paths)
+        f.flush()
+        os.fsync(f.fileno())
+
+# -------------------------------------------------------------------------
+# PROCESAMIENTO E INSERCIÓN POR LOTES
+# -------------------------------------------------------------------------
+
+def process_path(path):
+    """Tarea del pool: hash + OCR + extracción de un archivo."""
+    try:
+        file_hash = file_sha256(path)
+    except OSError as e:
+        return path, None, {"data": {}, "log": "", "error": str(e)}
+    return path, file_hash, process_invoice_file(path, file_hash)
+
+def existing_keys(db, hashes, numbers):
+    """
+    Hashes y números de factura del lote que ya están en la base de datos.
+    Como en find_invoice_by_hash, el archivo de un trabajo fallido no cuenta
+    como duplicado y se puede volver a ingerir.
+    """
+    seen_hashes = {
+        row.file_hash for row in
+        db.query(Invoice.file_hash).filter(Invoice.file_hash.in_(hashes), hash_blocks_reupload())
+    }
+    seen_numbers = {
+        row.invoice_number for row in
+        db.query(Invoice.invoice_number).filter(Invoice.invoice_number.in_(numbers))
+    } if numbers else set()
+    return seen_hashes, seen_numbers
+
+def insert_rows(db, rows, logs, texts):
+    """
+    Inserta las facturas con sus logs y textos de OCR, y como las demás vías
+    de alta, su evento del stream de estados y, si quedan 'En Proceso', la
+    solicitud de aprobación en el outbox.
+    """
+    invoice_ids = db.execute(insert(Invoice).returning(Invoice.id, sort_by_parameter_order=True), rows).scalars().all()
+    log_rows = [
+        {"invoice_id": invoice_id, "log": compress_log(log)}
+        for invoice_id, log in zip(invoice_ids, logs) if log
+    ]
+    if log_rows:
+        db.execute(insert(InvoiceLog), log_rows)
+    text_rows = [
+        {"invoice_id": invoice_id, "ocr_text": ocr_text}
+        for invoice_id, ocr_text in zip(invoice_ids, texts) if ocr_text
+    ]
+    if text_rows:
+        db.execute(insert(InvoiceText), text_rows)
+    add_invoice_events(db, [(invoice_id, row["status"], row["job_status"]) for invoice_id, row in zip(invoice_ids, rows)])
+    pending = [invoice_id for invoice_id, row in zip(invoice_ids, rows) if row["status"] == STATUS_EN_PROCESO]
+    outbox_rows = approval_notification_rows(pending, APPROVER_EMAILS)
+    if outbox_rows:
+        db.execute(insert(OutboxMessage), outbox_rows)
+
+def insert_batch(db, batch):
+    """
+    Inserta un lote de resultados en una sola transacción. Descarta los
+    duplicados (por hash o número de factura) tanto contra la base de datos
+    como dentro del propio lote. Si otro proceso inserta una de las facturas
+    entre la consulta y la inserción, el lote se reintenta fila a fila y se
+    descartan solo las que chocan.
+    :return: Tupla (insertadas, duplicadas).
+    """
+    hashes = [file_hash for _, file_hash, _ in batch]
+    numbers = [result["data"].get("invoice_number") for _, _, result in batch if result["data"].get("invoice_number")]
+    seen_hashes, seen_numbers = existing_keys(db, hashes, numbers)
+
+    rows, logs, texts = [], [], []
+    for _, file_hash, result in batch:
+        data = result["data"]
+        invoice_number = data.get("invoice_number")
+        if file_hash in seen_hashes or (invoice_number and invoice_number in seen_numbers):
+            continue
+        seen_hashes.add(file_hash)
+        if invoice_number:
+            seen_numbers.add(invoice_number)
+
+        rows.append({
+            "invoice_number": invoice_number,
+            "provider_name": data.get("provider_name"),
+            "issue_date": data.get("issue_date"),
+            "due_date": data.get("due_date"),
+            "total_amount": data.get("total_amount"),
+            "taxes": data.get("taxes"),
+            "status": data.get("status"),
+            "text_source": result.get("text_source"),
+            "file_hash": file_hash,
+            "job_status": JOB_COMPLETADO,
+        })
+        logs.append(result.get("log"))
+        texts.append(result.get("text"))
+
+    inserted = 0
+    if rows:
+        try:
+            with db.begin_nested():
+                insert_rows(db, rows, logs, texts)
+            inserted = len(rows)
+        except IntegrityError:
+            for row, log, ocr_text in zip(rows, logs, texts):
+                try:
+                    with db.begin_nested():
+                        insert_rows(db, [row], [log], [ocr_text])
+                    inserted += 1
+                except IntegrityError:
+                    pass
+    db.commit()
+    return inserted, len(batch) - inserted
+
+def ingest(source, workers=None, batch_size=200, checkpoint_path=DEFAULT_CHECKPOINT):
+    """Ejecuta la ingesta completa e imprime el progreso y el throughput."""
+    check_schema()
+    done = load_checkpoint(checkpoint_path)
+    paths = [path for path in iter_source_paths(source) if path not in done]
+    print(f"Archivos pendientes: {len(paths)} (ya en checkpoint: {len(done)}).")
+    if not paths:
+        return
+
+    totals = {"processed": 0, "inserted": 0, "duplicates": 0, "errors": 0}
+    start = time.perf_counter()
+    batch, batch_paths = [], []
+    db = SessionLocal()
+
+    def flush():
+        inserted, duplicates = insert_batch(db, batch)
+        append_checkpoint(checkpoint_path, batch_paths)
+        totals["inserted"] += inserted
+        totals["duplicates"] += duplicates
+        batch.clear()
+        batch_paths.clear()
+
+        elapsed = time.perf_counter() - start
+        print(
+            f"[{totals['processed']}/{len(paths)}] {totals['processed'] / elapsed:.2f} archivos/s | "
+            f"insertadas: {totals['inserted']} duplicadas: {totals['duplicates']} errores: {totals['errors']}"
+        )
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for path, file_hash, result in executor.map(process_path, paths, chunksize=4):
+                totals["processed"] += 1
+                if result.get("error"):
+                    # No se guarda en el checkpoint: se reintenta en la próxima ejecución
+                    totals["errors"] += 1
+                    print(f"❌ {path}: {result['error']}", file=sys.stderr)
+                else:
+                    batch.append((path, file_hash, result))
+                    batch_paths.append(path)
+
+                if len(batch) >= batch_size:
+                    flush()
+            if batch:
+                flush()
+    finally:
+        db.close()
+
+    if totals["inserted"]:
+        # Tras una carga masiva el índice de texto completo queda en muchos segmentos
+        optimize_search_index()
+
+    elapsed = time.perf_counter() - start
+    print(f"Ingesta finalizada en {elapsed:.1f} s ({totals['processed'] / elapsed:.2f} archivos/s).")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ingesta masiva de facturas en la base de datos.")
+    parser.add_argument("source", help="Directorio de facturas o manifiesto (.jsonl con 'path', o una ruta por línea).")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos de OCR (por defecto, uno por núcleo).")
+    parser.add_argument("--batch-size", type=int, default=200, help="Facturas por transacción.")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="Archivo de checkpoint para reanudar.")
+    args = parser.parse_args()
+
+    ingest(args.source, args.workers, args.batch_size, args.checkpoint)
@@ -0,0 +1,67 @@
+# log_config.py
+
+"""
+Configuración del logging de la aplicación y de los procesos en segundo
+plano (worker.py, outbox_relay.py).
+
+LOG_FORMAT=json emite un objeto JSON por línea con los campos pasados en
+`extra` (invoice_id, status, ...), listo para un agregador de logs;
+LOG_FORMAT=text (por defecto) los añade como clave=valor al mensaje.
+"""
+
+import os
+import sys
+import json
+import logging
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+
+# Atributos propios de LogRecord: el resto son los campos pasados en `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+def _extra_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+class JsonFormatter(logging.Formatter):
+    """Un objeto JSON por línea: fecha, nivel, logger, mensaje y campos extra."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Formato legible con los campos extra como clave=valor."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        extra = _extra_fields(record)
+        if extra:
+            line += " " + " ".join(f"{key}={value}" for key, value in extra.items())
+        return line
+
+def configure_logging(level=None, fmt=None):
+    """Configura el logger raíz una sola vez por proceso (las llamadas siguientes no hacen nada)."""
+    root = logging.getLogger()
+    if getattr(root, "_invoice_logging_configured", False):
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if (fmt or LOG_FORMAT) == "json" else TextFormatter())
+    root.addHandler(handler)
+    root.setLevel(level or LOG_LEVEL)
+    root._invoice_logging_configured = True
@@ -0,0 +1,177 @@
+# metrics.py
+
+"""
+Métricas del pipeline de facturas en el formato de texto de Prometheus.
+
+Contadores e histogramas en memoria, por proceso, sin dependencias: cada
+observación es una búsqueda binaria en los buckets y una suma bajo un
+lock, de modo que pueden quedar activos en producción. La app los publica
+en /metrics; worker.py y outbox_relay.py (procesos aparte) pueden
+publicar los suyos con start_metrics_server() (opción --metrics-port).
+"""
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Buckets (segundos) pensados para etapas que van de milisegundos (regex) a decenas de segundos (OCR)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REGISTRY = []
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Contador monótono, opcionalmente con etiquetas."""
+
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+class Histogram:
+    """Histograma acumulativo (buckets, suma y número de observaciones)."""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # etiquetas -> [cuentas por bucket (+Inf al final), suma]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Mide la duración del bloque `with` (también si termina con excepción)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+def render_metrics():
+    """Todas las métricas registradas en el formato de texto de Prometheus."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type_name}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+# -------------------------------------------------------------------------
+# MÉTRICAS DEL PIPELINE
+# -------------------------------------------------------------------------
+
+STAGE_SECONDS = Histogram(
+    "invoice_stage_seconds",
+    "Duración de cada etapa del procesamiento de una factura.",
+    ["stage"]
+)
+OCR_PAGES = Counter(
+    "invoice_ocr_pages",
+    "Páginas o imágenes reconocidas, según si el texto salió de la caché de OCR.",
+    ["cache"]
+)
+EXTRACTED_FIELDS = Counter(
+    "invoice_fields",
+    "Campos de la factura extraídos o ausentes tras la extracción.",
+    ["field", "result"]
+)
+PROCESSED_INVOICES = Counter(
+    "invoice_processed",
+    "Facturas procesadas por resultado (en_proceso, rechazada, error).",
+    ["result"]
+)
+REJECTIONS = Counter(
+    "invoice_rejections",
+    "Subidas o facturas rechazadas por motivo.",
+    ["reason"]
+)
+EMAILS = Counter(
+    "notification_emails",
+    "Correos de notificación por resultado del envío (sent, failed, retry).",
+    ["result"]
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds",
+    "Duración de las peticiones HTTP por endpoint y código de estado.",
+    ["endpoint", "method", "status"]
+)
+
+# -------------------------------------------------------------------------
+# SERVIDOR PARA LOS PROCESOS SIN FLASK (worker.py, outbox_relay.py)
+# -------------------------------------------------------------------------
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Publica las métricas del proceso en http://host:port/ desde un hilo en segundo plano."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,197 @@
+# notification_dispatcher.py
+
+"""
+Envío de correo por un pool de conexiones SMTP ya autenticadas.
+
+Las solicitudes de aprobación no se envían desde las peticiones HTTP: se
+registran en notification_outbox y las entrega outbox_relay.py, que agrupa
+las facturas de cada aprobador y guarda los reintentos en la base de datos.
+Este módulo aporta la conexión: el pool, la clasificación de errores
+permanentes y send_message() para los envíos directos (mailer.py).
+
+Prueba local contra un servidor SMTP de pruebas (sin TLS ni autenticación):
+    python -m aiosmtpd -n -l localhost:8025
+    SMTP_HOST=localhost SMTP_PORT=8025 SMTP_AUTH=false python outbox_relay.py --once
+"""
+
+import os
+import time
+import logging
+import queue
+import atexit
+import smtplib
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+from metrics import STAGE_SECONDS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+def _env_flag(name, default):
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+# -------------------------------------------------------------------------
+# CONFIGURACIÓN SMTP: una sola cuenta, que se autentica y es el remitente (From)
+# de todos los correos (notification_service.py, outbox_relay.py y mailer.py)
+# -------------------------------------------------------------------------
+EMAIL_USER = os.environ.get("EMAIL_USER")
+EMAIL_PASSWORD = os.environ.get("EMAIL_PASSWORD")
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
+# STARTTLS (puerto 587) o SSL implícito (puerto 465)
+SMTP_SSL = _env_flag("SMTP_SSL", "true" if SMTP_PORT == 465 else "false")
+SMTP_STARTTLS = _env_flag("SMTP_STARTTLS", "false" if SMTP_SSL else "true")
+SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", 30))
+# Desactivar para servidores locales de pruebas sin AUTH (p. ej. aiosmtpd)
+SMTP_AUTH = _env_flag("SMTP_AUTH", "true")
+
+# Conexiones simultáneas del pool
+SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", 2))
+# Segundos de inactividad tras los que una conexión se verifica con NOOP antes de reutilizarla
+SMTP_IDLE_CHECK = float(os.environ.get("SMTP_IDLE_CHECK", 30))
+
+# Variables de versiones anteriores que ya no se leen
+IGNORED_MAIL_VARIABLES = [
+    name for name in ("MAIL_SERVER", "MAIL_PORT", "MAIL_USERNAME", "MAIL_PASSWORD", "SMTP_USER", "SMTP_PASSWORD")
+    if os.environ.get(name)
+]
+if IGNORED_MAIL_VARIABLES:
+    logger.warning("Se ignoran %s: configure EMAIL_USER, EMAIL_PASSWORD, SMTP_HOST y SMTP_PORT.",
+                   ", ".join(IGNORED_MAIL_VARIABLES))
+
+# -------------------------------------------------------------------------
+# POOL DE CONEXIONES SMTP
+# -------------------------------------------------------------------------
+
+class SMTPConnectionPool:
+    """
+    Pool de conexiones SMTP autenticadas. El handshake TLS y el login se
+    hacen una vez por conexión y no una vez por correo.
+    """
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, user=EMAIL_USER, password=EMAIL_PASSWORD,
+                 use_ssl=SMTP_SSL, starttls=SMTP_STARTTLS, size=SMTP_POOL_SIZE,
+                 timeout=SMTP_TIMEOUT, idle_check=SMTP_IDLE_CHECK):
+        self.host, self.port = host, port
+        self.user, self.password = user, password
+        self.use_ssl, self.starttls = use_ssl, starttls
+        self.size, self.timeout, self.idle_check = size, timeout, idle_check
+        self.opened = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                server.starttls()
+        if SMTP_AUTH and self.user and self.password:
+            server.login(self.user, self.password)
+        with self._lock:
+            self.opened += 1
+        return server
+
+    @staticmethod
+    def _discard(server):
+        try:
+            server.close()
+        except Exception:
+            pass
+
+    def _checkout(self):
+        """Conexión ociosa (verificada con NOOP si lleva tiempo sin uso) o una nueva."""
+        while True:
+            try:
+                server, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - last_used < self.idle_check:
+                return server
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._discard(server)
+
+    @contextmanager
+    def connection(self):
+        """Presta una conexión del pool; se devuelve al terminar o se descarta si quedó inservible."""
+        self._slots.acquire()
+        server = None
+        try:
+            server = self._checkout()
+            yield server
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException):
+            # Si el servidor rechazó el mensaje, la conexión sigue siendo válida
+            if server is not None:
+                try:
+                    server.rset()
+                except Exception:
+                    self._discard(server)
+                    server = None
+            raise
+        except Exception:
+            if server is not None:
+                self._discard(server)
+                server = None
+            raise
+        finally:
+            if server is not None:
+                self._idle.put((server, time.monotonic()))
+            self._slots.release()
+
+    def close(self):
+        """Cierra las conexiones ociosas."""
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                server.quit()
+            except Exception:
+                self._discard(server)
+
+# -------------------------------------------------------------------------
+# ENVÍO
+# -------------------------------------------------------------------------
+
+def is_permanent_error(error):
+    """Errores que no se resuelven reintentando (credenciales, destinatario o mensaje rechazados)."""
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        # 4xx (buzón lleno, greylisting...) es temporal; solo se descarta si todos los rechazos son 5xx
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Pool SMTP compartido del proceso; se crea en el primer uso y se cierra al
+    salir. Tras un fork se crea uno nuevo (las conexiones no se comparten).
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = SMTPConnectionPool()
+            _pool_pid = os.getpid()
+            atexit.register(_pool.close)
+        return _pool
+
+def send_message(message, pool=None):
+    """Envía un mensaje por una conexión del pool (el compartido si no se indica otro)."""
+    pool = pool or get_pool()
+    with STAGE_SECONDS.time(stage="email_send"):
+        with pool.connection() as server:
+            server.send_message(message)
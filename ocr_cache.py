@@ -0,0 +1,152 @@
+# ocr_cache.py
+
+import os
+import hashlib
+import argparse
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configuración de la caché de texto OCR en disco
+OCR_CACHE_DIR = os.environ.get("OCR_CACHE_DIR", ".ocr_cache")
+OCR_CACHE_MAX_BYTES = int(os.environ.get("OCR_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+OCR_CACHE_ENABLED = os.environ.get("OCR_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Al superar el límite se libera espacio hasta esta fracción, para no desalojar en cada escritura
+OCR_CACHE_EVICT_TO = float(os.environ.get("OCR_CACHE_EVICT_TO", 0.9))
+# Cada cuántas escrituras se vuelve a medir la caché en disco (también escriben otros procesos)
+OCR_CACHE_RESCAN_EVERY = int(os.environ.get("OCR_CACHE_RESCAN_EVERY", 1000))
+
+# Tamaño de la caché estimado por este proceso: se mide recorriendo el
+# directorio una vez y luego se suma cada escritura
+_cache_bytes = None
+_stores_since_scan = 0
+_size_lock = threading.Lock()
+
+def file_sha256(file_path, chunk_size=64 * 1024):
+    """Calcula el SHA-256 del contenido de un archivo en disco."""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def cache_key(file_hash, lang, page, engine_version):
+    """Clave de la caché: hash del archivo + idioma + página + versión del motor."""
+    raw_key = f"{file_hash}|{lang}|{page}|{engine_version}"
+    return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+def _entry_path(key):
+    # Subdirectorios por prefijo para no acumular miles de archivos en una carpeta
+    return os.path.join(OCR_CACHE_DIR, key[:2], key + ".txt")
+
+def get_cached_text(file_hash, lang, page, engine_version):
+    """
+    Devuelve el texto OCR almacenado o None si no está en caché.
+    Cada acierto actualiza la fecha de acceso del archivo (orden LRU).
+    """
+    if not OCR_CACHE_ENABLED or not file_hash:
+        return None
+
+    path = _entry_path(cache_key(file_hash, lang, page, engine_version))
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        os.utime(path, None)
+        return text
+    except (FileNotFoundError, OSError):
+        return None
+
+def store_text(file_hash, lang, page, engine_version, text):
+    """
+    Guarda el texto OCR en la caché. El límite de tamaño se comprueba con el
+    tamaño acumulado en memoria; el directorio solo se recorre al superarlo
+    o cada OCR_CACHE_RESCAN_EVERY escrituras.
+    """
+    if not OCR_CACHE_ENABLED or not file_hash:
+        return
+
+    path = _entry_path(cache_key(file_hash, lang, page, engine_version))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Escritura atómica: otro proceso nunca lee un archivo a medio escribir
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    size = os.path.getsize(tmp_path)
+    try:
+        size -= os.path.getsize(path)
+    except FileNotFoundError:
+        pass
+    os.replace(tmp_path, path)
+    _track_store(size)
+
+def _track_store(delta):
+    """Suma la escritura al tamaño estimado y desaloja solo si se supera el límite."""
+    global _cache_bytes, _stores_since_scan
+    with _size_lock:
+        rescan = _cache_bytes is None or _stores_since_scan >= OCR_CACHE_RESCAN_EVERY
+        if not rescan:
+            _cache_bytes += delta
+            _stores_since_scan += 1
+            rescan = _cache_bytes > OCR_CACHE_MAX_BYTES
+    if rescan:
+        evict_lru()
+
+def _iter_entries():
+    if not os.path.isdir(OCR_CACHE_DIR):
+        return
+    for root, _, files in os.walk(OCR_CACHE_DIR):
+        for name in files:
+            if name.endswith('.txt'):
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+def evict_lru(max_bytes=None):
+    """
+    Mide la caché en disco y, si supera `max_bytes`, elimina las entradas
+    menos usadas hasta quedar en OCR_CACHE_EVICT_TO de ese límite.
+    """
+    global _cache_bytes, _stores_since_scan
+    max_bytes = OCR_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = list(_iter_entries())
+    total = sum(size for _, size, _ in entries)
+
+    removed = 0
+    if total > max_bytes:
+        target = max_bytes * OCR_CACHE_EVICT_TO
+        for path, size, _ in sorted(entries, key=lambda entry: entry[2]):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+
+    with _size_lock:
+        _cache_bytes, _stores_since_scan = total, 0
+    return removed
+
+def cache_stats():
+    """Número de entradas y bytes ocupados por la caché."""
+    entries = list(_iter_entries())
+    return {"entries": len(entries), "bytes": sum(size for _, size, _ in entries), "max_bytes": OCR_CACHE_MAX_BYTES}
+
+def clear_cache():
+    """Vacía la caché por completo."""
+    return evict_lru(max_bytes=0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Administración de la caché de texto OCR.")
+    parser.add_argument("--clear", action="store_true", help="Elimina todas las entradas.")
+    args = parser.parse_args()
+
+    if args.clear:
+        print(f"Entradas eliminadas: {clear_cache()}")
+    print(cache_stats())
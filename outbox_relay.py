@@ -0,0 +1,242 @@
+# outbox_relay.py
+
+"""
+Relay del outbox de notificaciones.
+
+Las solicitudes de aprobación se registran en notification_outbox en la
+misma transacción que la factura (app.py / worker.py). Este proceso las
+reserva por lotes, envía un correo por destinatario y lote (un digest si
+hay varias facturas) por el pool SMTP de notification_dispatcher.py, y
+guarda el estado de cada entrega con reintentos y backoff exponencial. Sin
+EMAIL_USER (el remitente) el relay no arranca.
+
+La entrega es "al menos una vez": si el relay cae entre el envío y el
+registro del estado, el lote se reenvía con el mismo Message-ID, que los
+clientes de correo usan para descartar duplicados.
+
+Uso:
+    python outbox_relay.py [--batch-size N] [--poll-interval S] [--once] [--stats]
+"""
+
+import os
+import time
+import logging
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import update, func
+from dotenv import load_dotenv
+
+from database import (
+    SessionLocal,
+    Invoice,
+    OutboxMessage,
+    check_schema,
+    STATUS_EN_PROCESO,
+    OUTBOX_PENDIENTE,
+    OUTBOX_ENVIANDO,
+    OUTBOX_ENVIADO,
+    OUTBOX_FALLIDO,
+    OUTBOX_DESCARTADO
+)
+from notification_dispatcher import SMTPConnectionPool, is_permanent_error, send_message
+from notification_service import build_approval_message, EMAIL_USER
+from metrics import EMAILS, start_metrics_server
+from log_config import configure_logging
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Configuración del relay
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 50))
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", 2.0))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 5))
+# Espera antes del reintento n: OUTBOX_RETRY_BACKOFF * 2^(n-1) segundos
+OUTBOX_RETRY_BACKOFF = float(os.environ.get("OUTBOX_RETRY_BACKOFF", 30))
+# Reservas 'Enviando' más antiguas que esto se consideran abandonadas (caída del relay)
+OUTBOX_CLAIM_TIMEOUT = float(os.environ.get("OUTBOX_CLAIM_TIMEOUT", 600))
+
+MESSAGE_ID_DOMAIN = EMAIL_USER.split("@")[-1] if EMAIL_USER and "@" in EMAIL_USER else "facturas.local"
+
+def check_config():
+    """Falla al arrancar si falta la configuración sin la que ningún correo sería válido."""
+    if not EMAIL_USER:
+        raise RuntimeError("EMAIL_USER no está configurada: es el remitente (From) de las notificaciones.")
+
+# -------------------------------------------------------------------------
+# RESERVA DE LOTES
+# -------------------------------------------------------------------------
+
+def requeue_stale_claims(db, timeout=OUTBOX_CLAIM_TIMEOUT):
+    """Devuelve a 'Pendiente' las entradas reservadas por un relay que no terminó."""
+    requeued = db.query(OutboxMessage).filter(
+        OutboxMessage.state == OUTBOX_ENVIANDO,
+        OutboxMessage.claimed_at < datetime.utcnow() - timedelta(seconds=timeout)
+    ).update({OutboxMessage.state: OUTBOX_PENDIENTE}, synchronize_session=False)
+    db.commit()
+    return requeued
+
+def claim_batch(db, batch_size=OUTBOX_BATCH_SIZE):
+    """
+    Reserva de forma atómica hasta `batch_size` entradas pendientes. El UPDATE
+    condicionado al estado 'Pendiente' impide que dos relays tomen la misma.
+    :return: Lista de OutboxMessage reservados.
+    """
+    now = datetime.utcnow()
+    candidates = [row.id for row in db.query(OutboxMessage.id).filter(
+        OutboxMessage.state == OUTBOX_PENDIENTE,
+        OutboxMessage.next_attempt_at <= now
+    ).order_by(OutboxMessage.id).limit(batch_size)]
+    if not candidates:
+        return []
+
+    claimed = db.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id.in_(candidates), OutboxMessage.state == OUTBOX_PENDIENTE)
+        .values({OutboxMessage.state: OUTBOX_ENVIANDO, OutboxMessage.claimed_at: now})
+        .returning(OutboxMessage.id)
+    ).scalars().all()
+    db.commit()
+    if not claimed:
+        return []
+    return db.query(OutboxMessage).filter(OutboxMessage.id.in_(claimed)).order_by(OutboxMessage.id).all()
+
+# -------------------------------------------------------------------------
+# ENTREGA Y REGISTRO DEL ESTADO
+# -------------------------------------------------------------------------
+
+def message_id_for(entries):
+    """Message-ID determinista del lote: un reenvío del mismo lote lleva el mismo ID."""
+    return f"<outbox-{'-'.join(str(entry.id) for entry in entries)}@{MESSAGE_ID_DOMAIN}>"
+
+def mark_failed_attempt(entries, error):
+    """Programa el reintento con backoff o marca la entrega como fallida."""
+    permanent = is_permanent_error(error)
+    for entry in entries:
+        entry.attempts += 1
+        entry.last_error = str(error)
+        if permanent or entry.attempts >= OUTBOX_MAX_ATTEMPTS:
+            entry.state = OUTBOX_FALLIDO
+        else:
+            entry.state = OUTBOX_PENDIENTE
+            entry.next_attempt_at = datetime.utcnow() + timedelta(seconds=OUTBOX_RETRY_BACKOFF * 2 ** (entry.attempts - 1))
+
+def deliver_batch(db, pool, entries):
+    """
+    Envía un lote reservado: un correo por destinatario con todas sus facturas.
+    Las facturas que ya no están 'En Proceso' se descartan sin enviar.
+    :return: Diccionario con el número de entradas por estado final.
+    """
+    invoice_ids = {entry.invoice_id for entry in entries}
+    invoices = {
+        row.id: row for row in db.query(
+            Invoice.id, Invoice.invoice_number, Invoice.provider_name,
+            Invoice.issue_date, Invoice.total_amount, Invoice.status
+        ).filter(Invoice.id.in_(invoice_ids))
+    }
+
+    counts = {OUTBOX_ENVIADO: 0, OUTBOX_PENDIENTE: 0, OUTBOX_FALLIDO: 0, OUTBOX_DESCARTADO: 0}
+    by_recipient = {}
+    for entry in entries:
+        invoice = invoices.get(entry.invoice_id)
+        if invoice is None or invoice.status != STATUS_EN_PROCESO:
+            entry.state = OUTBOX_DESCARTADO
+            counts[OUTBOX_DESCARTADO] += 1
+        else:
+            by_recipient.setdefault(entry.recipient, []).append(entry)
+    db.commit()
+
+    for recipient, group in by_recipient.items():
+        message = build_approval_message(recipient, [invoices[entry.invoice_id] for entry in group])
+        message['Message-ID'] = message_id_for(group)
+        try:
+            send_message(message, pool)
+        except Exception as e:
+            mark_failed_attempt(group, e)
+            EMAILS.inc(result="failed" if group[0].state == OUTBOX_FALLIDO else "retry")
+            logger.error("Error al enviar %d notificación(es): %s", len(group), e, extra={"recipient": recipient})
+        else:
+            EMAILS.inc(result="sent")
+            sent_at = datetime.utcnow()
+            for entry in group:
+                entry.state = OUTBOX_ENVIADO
+                entry.attempts += 1
+                entry.sent_at = sent_at
+                entry.message_id = message['Message-ID']
+                entry.last_error = None
+            logger.info("%d notificación(es) enviada(s)", len(group), extra={"recipient": recipient})
+        db.commit()
+        for entry in group:
+            counts[entry.state] += 1
+    return counts
+
+def relay_once(pool, batch_size=OUTBOX_BATCH_SIZE):
+    """Procesa un lote. :return: Número de entradas reservadas."""
+    db = SessionLocal()
+    try:
+        entries = claim_batch(db, batch_size)
+        if entries:
+            deliver_batch(db, pool, entries)
+        return len(entries)
+    finally:
+        db.close()
+
+def relay_loop(batch_size=OUTBOX_BATCH_SIZE, poll_interval=OUTBOX_POLL_INTERVAL, once=False):
+    """Bucle del relay: drena el outbox hasta ser detenido (o hasta vaciarlo con once=True)."""
+    check_config()
+    check_schema()
+    pool = SMTPConnectionPool()
+    try:
+        db = SessionLocal()
+        try:
+            requeued = requeue_stale_claims(db)
+            if requeued:
+                logger.info("Se reencolaron %d notificaciones interrumpidas.", requeued)
+        finally:
+            db.close()
+
+        while True:
+            claimed = relay_once(pool, batch_size)
+            if claimed == batch_size:
+                continue
+            if once:
+                break
+            time.sleep(poll_interval)
+    finally:
+        pool.close()
+
+def outbox_stats():
+    """Número de notificaciones por estado de entrega."""
+    db = SessionLocal()
+    try:
+        return dict(db.query(OutboxMessage.state, func.count()).group_by(OutboxMessage.state).all())
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Relay del outbox de notificaciones por correo.")
+    parser.add_argument("--batch-size", type=int, default=OUTBOX_BATCH_SIZE, help="Notificaciones por lote.")
+    parser.add_argument("--poll-interval", type=float, default=OUTBOX_POLL_INTERVAL, help="Segundos entre sondeos.")
+    parser.add_argument("--once", action="store_true", help="Vacía el outbox y termina.")
+    parser.add_argument("--stats", action="store_true", help="Muestra las notificaciones por estado y termina.")
+    parser.add_argument("--metrics-port", type=int, help="Publica las métricas de Prometheus en este puerto.")
+    args = parser.parse_args()
+    configure_logging()
+
+    if args.stats:
+        check_schema()
+        print(outbox_stats())
+        raise SystemExit(0)
+
+    try:
+        check_config()
+    except RuntimeError as e:
+        parser.exit(1, f"{e}\n")
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    print("Relay del outbox iniciado. Ctrl+C para detener.")
+    try:
+        relay_loop(args.batch_size, args.poll_interval, args.once)
+    except KeyboardInterrupt:
+        print("Deteniendo el relay del outbox...")
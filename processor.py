@@ -5,8 +5,29 @@ from PIL import Image
 import re
 from datetime import datetime
 import os
-import tempfile
-from pdf2image import convert_from_path
+import io
+import time
+import queue
+import hashlib
+import subprocess
+import threading
+from functools import lru_cache
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+import logging
+import ocr_cache
+import image_preprocessing
+from metrics import STAGE_SECONDS, OCR_PAGES, EXTRACTED_FIELDS, PROCESSED_INVOICES, REJECTIONS
+
+try:
+    # Backend opcional: API C de Tesseract con los modelos cargados en memoria
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
 
 # Importar constantes de estado del módulo de la base de datos
 POPPLER_PATH = r"C:\Users\barba\Downloads\Release-25.11.0-0\poppler-25.11.0\Library\bin"
@@ -23,6 +44,47 @@ except ImportError:
 # -------------------------------------------------------------------------
 pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
+# Idioma(s) de Tesseract; forma parte de la clave de la caché de OCR
+OCR_LANG = 'spa+eng'
+
+# Backend de OCR: 'auto' (tesserocr si está instalado), 'tesserocr' o 'subprocess'
+OCR_BACKEND = os.environ.get("OCR_BACKEND", "auto").lower()
+
+# -------------------------------------------------------------------------
+# CONFIGURACIÓN DE PDFs MULTIPÁGINA
+# -------------------------------------------------------------------------
+# Máximo de páginas a procesar (0 = todas). Con 1 se procesa solo la primera página.
+PDF_MAX_PAGES = int(os.environ.get("PDF_MAX_PAGES", 0))
+# Páginas renderizadas y reconocidas en paralelo: hilos del pool del proceso y tamaño de cada lote
+OCR_THREADS = int(os.environ.get("OCR_THREADS", os.cpu_count() or 1))
+# Instancias de tesserocr por proceso: máximo de imágenes reconocidas a la vez con ese backend
+OCR_ENGINES = int(os.environ.get("OCR_ENGINES", OCR_THREADS))
+# Detener el OCR en cuanto se encuentren todos los campos obligatorios
+PDF_STOP_EARLY = os.environ.get("PDF_STOP_EARLY", "true").lower() in ("1", "true", "yes")
+
+# Capa de texto nativa de PDFs digitales: se usa si tiene al menos
+# PDF_TEXT_MIN_CHARS caracteres visibles; si no, se recurre al OCR.
+PDF_TEXT_LAYER = os.environ.get("PDF_TEXT_LAYER", "true").lower() in ("1", "true", "yes")
+PDF_TEXT_MIN_CHARS = int(os.environ.get("PDF_TEXT_MIN_CHARS", 100))
+
+# Origen del texto de la factura (se registra en el resultado y en la DB)
+TEXT_SOURCE_PDF = "pdf_text"
+TEXT_SOURCE_OCR = "ocr"
+
+# Nivel del log de extracción que se guarda con cada factura:
+#   off: sin log; summary: pasos del OCR, campos extraídos y validación;
+#   debug: además el análisis del texto OCR (líneas clave, fechas, montos).
+# El análisis de debug se puede reconstruir después desde la caché de OCR
+# (rebuild_extraction_log), así que no hace falta calcularlo en cada factura.
+EXTRACTION_LOG_OFF = "off"
+EXTRACTION_LOG_SUMMARY = "summary"
+EXTRACTION_LOG_DEBUG = "debug"
+EXTRACTION_LOG_LEVELS = (EXTRACTION_LOG_OFF, EXTRACTION_LOG_SUMMARY, EXTRACTION_LOG_DEBUG)
+EXTRACTION_LOG_LEVEL = os.environ.get("EXTRACTION_LOG_LEVEL", EXTRACTION_LOG_SUMMARY).lower()
+
+# Campos obligatorios para la validación
+REQUIRED_FIELDS = ["provider_name", "invoice_number", "issue_date", "total_amount", "taxes"]
+
 # -------------------------------------------------------------------------
 # EXPRESIONES REGULARES MEJORADAS
 # -------------------------------------------------------------------------
@@ -97,42 +159,188 @@ def extract_date(text):
                 continue
     return None
 
+# -------------------------------------------------------------------------
+# PATRONES PRECOMPILADOS (se compilan una sola vez al importar el módulo)
+# -------------------------------------------------------------------------
+# Cada patrón va acompañado de sus anclas: los literales (en minúsculas) con
+# los que puede empezar una coincidencia. La búsqueda arranca en la primera
+# aparición de un ancla y se omite si no aparece ninguna. None = sin anclas.
+
+# Patrones de REGEX_PATTERNS compilados con los flags usados en la búsqueda
+COMPILED_PATTERNS = {
+    field: re.compile(pattern, re.IGNORECASE | re.MULTILINE | re.DOTALL)
+    for field, pattern in REGEX_PATTERNS.items()
+}
+PATTERN_ANCHORS = {
+    "invoice_number": None,
+    "total_amount": ("importe", "total"),
+    "taxes": ("impuesto", "iva", "tax", "monto"),
+    "issue_date": ("fecha",),
+    "provider_name": None,
+    "due_date": ("venc", "fecha", "due"),
+}
+
+DATE_TOKEN_RE = re.compile(r'\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4}')
+AMOUNT_TOKEN_RE = re.compile(r'[\$€]?\s*[\d\.,]+\s*[\$€]?')
+NUMERIC_ONLY_RE = re.compile(r'^[\d\s\.\-]+$')
+WHITESPACE_RE = re.compile(r'\s+')
+
+# Palabras clave (en minúsculas) de las líneas relevantes del debug
+KEYWORDS = ['fecha', 'emisión', 'emision', 'factura', 'vencimiento', 'documento', 'total', 'pagar']
+
+# Proveedor
+PROVIDER_PATTERNS = [
+    (None, re.compile(r"^([A-Z][A-ZÑÁÉÍÓÚ\s\.\,]*[A-Z])(?:\s*\n|\s*RIF|\s*NIT|\s*Dirección|$)", re.MULTILINE)),
+    (None, re.compile(r"^([^\n\r\d\$€@]{5,50})[\r\n]", re.MULTILINE)),
+    (None, re.compile(r"^(.+?)[\r\n](?=.*RIF|.*NIT|.*Fecha|.*FACTURA|.*Dirección)", re.MULTILINE)),
+]
+PROVIDER_RIF_PATTERNS = [
+    (("rif",), re.compile(r"RIF[^\n]*[\r\n]\s*([^\n\r]+)", re.IGNORECASE)),
+    (("nit",), re.compile(r"NIT[^\n]*[\r\n]\s*([^\n\r]+)", re.IGNORECASE)),
+    (("identificación",), re.compile(r"IDENTIFICACIÓN[^\n]*[\r\n]\s*([^\n\r]+)", re.IGNORECASE)),
+    (("ruc",), re.compile(r"RUC[^\n]*[\r\n]\s*([^\n\r]+)", re.IGNORECASE)),
+    (("dirección",), re.compile(r"Dirección[^\n]*[\r\n]\s*([^\n\r]+)", re.IGNORECASE)),
+]
+
+# Fecha de emisión
+ISSUE_DATE_PATTERNS = [
+    # Patrón específico para "Fecha de Emisión del Documento: 15.06.2025"
+    (("fecha",), re.compile(r"Fecha\s*de\s*Emisi[oó]n\s*del\s*Documento\s*[:\-]*\s*(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4})", re.IGNORECASE | re.MULTILINE)),
+    # Patrón para "Fecha de Emisión:"
+    (("fecha",), re.compile(r"Fecha\s*de\s*Emisi[oó]n\s*[:\-]*\s*(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4})", re.IGNORECASE | re.MULTILINE)),
+    # Patrón más flexible
+    (("fecha",), re.compile(r"(?:Fecha\s*de\s*Emisi[oó]n|FECHA\s*DE\s*EMISI[OÓ]N)[^\d]*(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4})", re.IGNORECASE | re.MULTILINE)),
+    # Patrón general para fecha después de "Fecha"
+    (("fecha",), re.compile(r"Fecha[^\d\n]{0,30}(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4})", re.IGNORECASE | re.MULTILINE)),
+    # Buscar cualquier fecha cerca de "Emisión"
+    (("emisi",), re.compile(r"Emisi[oó]n[^\d\n]{0,30}(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4})", re.IGNORECASE | re.MULTILINE)),
+    # Buscar "Documento" cerca de fecha
+    (("documento",), re.compile(r"Documento[^\d\n]{0,30}(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4})", re.IGNORECASE | re.MULTILINE)),
+]
+ISSUE_DATE_CONTEXT_PATTERNS = [
+    (("número", "documento"), re.compile(r"(?:Número\s*de\s*Documento|Documento\s*Fiscal)[^\n]*\n([^\n]*)", re.IGNORECASE)),
+    (("¡documento",), re.compile(r"¡Documento\s*Oficial\![^\n]*\n([^\n]*)", re.IGNORECASE)),
+]
+DUE_DATE_EXCLUSION = (("vencimiento", "fecha"), re.compile(r'(?:Vencimiento|Fecha\s*L[ií]mite)[^\d]*(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4})', re.IGNORECASE))
+
+# Monto total (fallback)
+TOTAL_AMOUNT_PATTERNS = [
+    (("total",), re.compile(r"TOTAL\s*A\s*PAGAR[^\(\)]*\([^\)]*\)[^\d]*([\d\.,]+)", re.IGNORECASE)),
+    (("total",), re.compile(r"TOTAL\s*A\s*PAGAR[^\d]*([\d\.,]+)", re.IGNORECASE)),
+    (("importe",), re.compile(r"Importe\s*Total[^\d]*([\d\.,]+)", re.IGNORECASE)),
+    (("total",), re.compile(r"TOTAL[^\d]*([\d\.,]+)", re.IGNORECASE)),
+]
+
+# -------------------------------------------------------------------------
+# TOKENIZACIÓN ÚNICA DEL TEXTO OCR
+# -------------------------------------------------------------------------
+
+class InvoiceText:
+    """
+    Texto OCR tokenizado una sola vez y compartido por todos los resolvers:
+    fechas y montos candidatos, líneas con palabras clave, posiciones de las
+    anclas y el texto con espacios colapsados. Cada token se calcula en la
+    primera consulta.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.lower = text.lower()
+        self._tokens = {}
+
+    def _token(self, name, build):
+        if name not in self._tokens:
+            self._tokens[name] = build()
+        return self._tokens[name]
+
+    @property
+    def dates(self):
+        """Fechas candidatas, en orden de aparición."""
+        return self._token("dates", lambda: DATE_TOKEN_RE.findall(self.text))
+
+    @property
+    def amounts(self):
+        """Montos candidatos, en orden de aparición."""
+        return self._token("amounts", lambda: AMOUNT_TOKEN_RE.findall(self.text))
+
+    @property
+    def keyword_lines(self):
+        """Lista de (número de línea, línea) que contienen alguna palabra clave."""
+        def build():
+            return [
+                (i, line)
+                for i, (line, line_lower) in enumerate(zip(self.text.split('\n'), self.lower.split('\n')))
+                if any(keyword in line_lower for keyword in KEYWORDS)
+            ]
+        return self._token("keyword_lines", build)
+
+    @property
+    def clean(self):
+        """Texto con los espacios colapsados (búsqueda tolerante a espacios)."""
+        return self._token("clean", lambda: WHITESPACE_RE.sub(' ', self.text))
+
+    @property
+    def clean_lower(self):
+        return self._token("clean_lower", lambda: self.clean.lower())
+
+    def _anchor_position(self, anchors, clean):
+        """Primera posición posible de una coincidencia, o -1 si no hay anclas en el texto."""
+        if anchors is None:
+            return 0
+        text, lower = (self.clean, self.clean_lower) if clean else (self.text, self.lower)
+
+        key = ("anchor", anchors, clean)
+        if key not in self._tokens:
+            positions = [pos for pos in (lower.find(anchor) for anchor in anchors) if pos >= 0]
+            if not positions:
+                self._tokens[key] = -1
+            elif len(lower) != len(text):
+                # lower() cambió la longitud (caracteres especiales): sin atajo de posición
+                self._tokens[key] = 0
+            else:
+                self._tokens[key] = min(positions)
+        return self._tokens[key]
+
+    def search(self, pattern, anchors=None, clean=False):
+        """pattern.search desde la primera ancla; None si no hay anclas."""
+        start = self._anchor_position(anchors, clean)
+        if start < 0:
+            return None
+        return pattern.search(self.clean if clean else self.text, start)
+
+    def findall(self, pattern, anchors=None, clean=False):
+        """pattern.findall desde la primera ancla; [] si no hay anclas."""
+        start = self._anchor_position(anchors, clean)
+        if start < 0:
+            return []
+        return pattern.findall(self.clean if clean else self.text, start)
+
+def _as_invoice_text(text):
+    return text if isinstance(text, InvoiceText) else InvoiceText(text)
+
 # -------------------------------------------------------------------------
 # FUNCIÓN MEJORADA PARA EXTRACCIÓN DEL NOMBRE DEL PROVEEDOR
 # -------------------------------------------------------------------------
 
 def extract_provider_name_enhanced(text):
     """Estrategia múltiple para extraer el nombre del proveedor"""
+    tokens = _as_invoice_text(text)
     
     # Estrategia 1: Buscar al inicio del documento con patrón mejorado
-    patterns = [
-        r"^([A-Z][A-ZÑÁÉÍÓÚ\s\.\,]*[A-Z])(?:\s*\n|\s*RIF|\s*NIT|\s*Dirección|$)",
-        r"^([^\n\r\d\$€@]{5,50})[\r\n]",
-        r"^(.+?)[\r\n](?=.*RIF|.*NIT|.*Fecha|.*FACTURA|.*Dirección)",
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text, re.MULTILINE)
+    for anchors, pattern in PROVIDER_PATTERNS:
+        match = tokens.search(pattern, anchors)
         if match:
             provider_name = match.group(1).strip()
             # Validar que sea un nombre razonable (no números solos, no muy corto)
-            if len(provider_name) >= 3 and not re.match(r'^[\d\s\.\-]+$', provider_name):
+            if len(provider_name) >= 3 and not NUMERIC_ONLY_RE.match(provider_name):
                 return provider_name
     
     # Estrategia 2: Buscar después de "RIF" o identificadores similares
-    rif_patterns = [
-        r"RIF[^\n]*[\r\n]\s*([^\n\r]+)",
-        r"NIT[^\n]*[\r\n]\s*([^\n\r]+)",
-        r"IDENTIFICACIÓN[^\n]*[\r\n]\s*([^\n\r]+)",
-        r"RUC[^\n]*[\r\n]\s*([^\n\r]+)",
-        r"Dirección[^\n]*[\r\n]\s*([^\n\r]+)"
-    ]
-    
-    for pattern in rif_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
+    for anchors, pattern in PROVIDER_RIF_PATTERNS:
+        match = tokens.search(pattern, anchors)
         if match:
             candidate = match.group(1).strip()
-            if len(candidate) >= 3 and not re.match(r'^[\d\s\.\-]+$', candidate):
+            if len(candidate) >= 3 and not NUMERIC_ONLY_RE.match(candidate):
                 return candidate
     
     return None
@@ -143,53 +351,35 @@ def extract_provider_name_enhanced(text):
 
 def extract_issue_date_enhanced(text):
     """Estrategia múltiple para extraer la fecha de emisión"""
+    tokens = _as_invoice_text(text)
     
     # ESTRATEGIA 1: Búsqueda directa con múltiples patrones
-    patterns = [
-        # Patrón específico para "Fecha de Emisión del Documento: 15.06.2025"
-        r"Fecha\s*de\s*Emisi[oó]n\s*del\s*Documento\s*[:\-]*\s*(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4})",
-        # Patrón para "Fecha de Emisión:"
-        r"Fecha\s*de\s*Emisi[oó]n\s*[:\-]*\s*(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4})",
-        # Patrón más flexible
-        r"(?:Fecha\s*de\s*Emisi[oó]n|FECHA\s*DE\s*EMISI[OÓ]N)[^\d]*(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4})",
-        # Patrón general para fecha después de "Fecha"
-        r"Fecha[^\d\n]{0,30}(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4})",
-        # Buscar cualquier fecha cerca de "Emisión"
-        r"Emisi[oó]n[^\d\n]{0,30}(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4})",
-        # Buscar "Documento" cerca de fecha
-        r"Documento[^\d\n]{0,30}(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4})",
-    ]
-    
-    for pattern in patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE | re.MULTILINE)
-        for date_str in matches:
+    for anchors, pattern in ISSUE_DATE_PATTERNS:
+        for date_str in tokens.findall(pattern, anchors):
             date_obj = extract_date(date_str)
             if date_obj:
                 return date_obj
     
     # ESTRATEGIA 2: Búsqueda por contexto - línea después de patrones clave
-    context_patterns = [
-        r"(?:Número\s*de\s*Documento|Documento\s*Fiscal)[^\n]*\n([^\n]*)",
-        r"¡Documento\s*Oficial\![^\n]*\n([^\n]*)"
-    ]
-    
-    for pattern in context_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
+    for anchors, pattern in ISSUE_DATE_CONTEXT_PATTERNS:
+        match = tokens.search(pattern, anchors)
         if match:
             context_line = match.group(1)
             # Buscar fecha en esta línea de contexto
-            date_match = re.search(r'(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4})', context_line)
+            date_match = DATE_TOKEN_RE.search(context_line)
             if date_match:
-                date_obj = extract_date(date_match.group(1))
+                date_obj = extract_date(date_match.group(0))
                 if date_obj:
                     return date_obj
     
     # ESTRATEGIA 3: Buscar cualquier fecha que no sea la de vencimiento
-    all_dates = re.findall(r'(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4})', text)
-    due_date_match = re.search(r'(?:Vencimiento|Fecha\s*L[ií]mite)[^\d]*(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4})', text, re.IGNORECASE)
+    # (las fechas candidatas ya vienen de la tokenización)
+    if not tokens.dates:
+        return None
+    due_date_match = tokens.search(DUE_DATE_EXCLUSION[1], DUE_DATE_EXCLUSION[0])
     due_date_str = due_date_match.group(1) if due_date_match else None
     
-    for date_str in all_dates:
+    for date_str in tokens.dates:
         if date_str != due_date_str:  # Excluir la fecha de vencimiento
             date_obj = extract_date(date_str)
             if date_obj:
@@ -205,16 +395,10 @@ def extract_issue_date_enhanced(text):
 
 def extract_total_amount_enhanced(text):
     """Extracción mejorada del monto total"""
+    tokens = _as_invoice_text(text)
     
-    patterns = [
-        r"TOTAL\s*A\s*PAGAR[^\(\)]*\([^\)]*\)[^\d]*([\d\.,]+)",
-        r"TOTAL\s*A\s*PAGAR[^\d]*([\d\.,]+)",
-        r"Importe\s*Total[^\d]*([\d\.,]+)",
-        r"TOTAL[^\d]*([\d\.,]+)",
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
+    for anchors, pattern in TOTAL_AMOUNT_PATTERNS:
+        match = tokens.search(pattern, anchors)
         if match:
             value = match.group(1).strip()
             return clean_and_convert(value)
@@ -227,17 +411,11 @@ def extract_total_amount_enhanced(text):
 
 def debug_ocr_text(text, extraction_log):
     """Función para debug del texto OCR"""
+    tokens = _as_invoice_text(text)
     extraction_log += "\n=== DEBUG OCR TEXT ===\n"
-    lines = text.split('\n')
-    
-    # Encontrar líneas con palabras clave
-    keywords = ['fecha', 'emisión', 'emision', 'factura', 'vencimiento', 'documento', 'total', 'pagar']
-    relevant_lines = []
     
-    for i, line in enumerate(lines):
-        line_lower = line.lower()
-        if any(keyword in line_lower for keyword in keywords):
-            relevant_lines.append(f"Línea {i}: '{line}'")
+    # Líneas con palabras clave (anclas de la tokenización)
+    relevant_lines = [f"Línea {i}: '{line}'" for i, line in tokens.keyword_lines]
     
     if relevant_lines:
         extraction_log += "Líneas relevantes encontradas:\n" + "\n".join(relevant_lines) + "\n"
@@ -245,71 +423,436 @@ def debug_ocr_text(text, extraction_log):
         extraction_log += "No se encontraron líneas con palabras clave relevantes.\n"
     
     # Mostrar todas las fechas encontradas
-    all_dates = re.findall(r'\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4}', text)
-    if all_dates:
-        extraction_log += f"Todas las fechas encontradas: {all_dates}\n"
+    if tokens.dates:
+        extraction_log += f"Todas las fechas encontradas: {tokens.dates}\n"
     
     # Mostrar todos los montos encontrados
-    all_amounts = re.findall(r'[\$€]?\s*[\d\.,]+\s*[\$€]?', text)
-    if all_amounts:
-        extraction_log += f"Todos los montos encontrados: {all_amounts}\n"
+    if tokens.amounts:
+        extraction_log += f"Todos los montos encontrados: {tokens.amounts}\n"
     
     extraction_log += "=== FIN DEBUG ===\n"
     return extraction_log
 
+# -------------------------------------------------------------------------
+# BACKENDS DE OCR
+# -------------------------------------------------------------------------
+
+class SubprocessOCRBackend:
+    """Backend original: pytesseract lanza un proceso tesseract por llamada."""
+    name = "subprocess"
+
+    def image_to_string(self, image):
+        return pytesseract.image_to_string(image, lang=OCR_LANG)
+
+    def version(self):
+        return str(pytesseract.get_tesseract_version())
+
+class TesserocrOCRBackend:
+    """
+    Motor persistente vía tesserocr: pool por proceso de hasta `max_engines`
+    instancias de la API de Tesseract con los modelos de OCR_LANG cargados.
+    Cada imagen toma una instancia libre y la devuelve al terminar, así que
+    el arranque y la carga del traineddata se pagan una vez por instancia y
+    no por hilo (Flask atiende cada petición en un hilo nuevo).
+    """
+    name = "tesserocr"
+
+    def __init__(self, max_engines=OCR_ENGINES):
+        if tesserocr is None:
+            raise ImportError("tesserocr no está instalado")
+        self.max_engines = max(1, max_engines)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # LIFO: se reutiliza la instancia usada más recientemente
+        self._idle = queue.LifoQueue()
+        self._created = 0
+
+    @contextmanager
+    def _engine(self):
+        """Reserva una instancia libre (la crea si aún no se alcanzó max_engines o espera a que se libere una)."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # La API no se hereda bien tras un fork: el proceso hijo crea las suyas
+                self._reset()
+            idle = self._idle
+            create = idle.empty() and self._created < self.max_engines
+            if create:
+                self._created += 1
+        if create:
+            try:
+                api = tesserocr.PyTessBaseAPI(lang=OCR_LANG)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        else:
+            api = idle.get()
+        try:
+            yield api
+        finally:
+            # Libera la imagen y los resultados; los modelos siguen cargados
+            api.Clear()
+            idle.put(api)
+
+    def image_to_string(self, image):
+        with self._engine() as api:
+            api.SetImage(image)
+            return api.GetUTF8Text()
+
+    def version(self):
+        # tesseract_version() devuelve p. ej. "tesseract 5.3.0\n leptonica-1.82.0 ..."
+        return tesserocr.tesseract_version().split()[1]
+
+OCR_BACKENDS = {
+    SubprocessOCRBackend.name: SubprocessOCRBackend,
+    TesserocrOCRBackend.name: TesserocrOCRBackend,
+}
+
+@lru_cache(maxsize=None)
+def get_ocr_backend(name=None):
+    """
+    Instancia (única por proceso) del backend configurado en OCR_BACKEND.
+    Con 'auto' se usa tesserocr si está disponible y, si no, el subproceso.
+    """
+    name = (name or OCR_BACKEND).lower()
+    if name == "auto":
+        name = TesserocrOCRBackend.name if tesserocr is not None else SubprocessOCRBackend.name
+    try:
+        return OCR_BACKENDS[name]()
+    except ImportError as e:
+        logger.warning("Backend de OCR '%s' no disponible (%s). Se usa el subproceso.", name, e)
+        return SubprocessOCRBackend()
+
 # -------------------------------------------------------------------------
 # FUNCIÓN PRINCIPAL DE PROCESAMIENTO MEJORADA
 # -------------------------------------------------------------------------
 
-def process_invoice_file(file_path):
+@lru_cache(maxsize=1)
+def get_engine_version():
+    """
+    Versión del motor de OCR: versión de Tesseract más la configuración de
+    preprocesamiento (ambas cambian el texto reconocido). Se consulta una sola
+    vez por proceso.
+    """
+    try:
+        tesseract_version = get_ocr_backend().version()
+    except Exception:
+        tesseract_version = "unknown"
+    return f"{tesseract_version}|{image_preprocessing.config_signature()}"
+
+def ocr_image(image, file_hash=None, page=0):
+    """
+    Ejecuta Tesseract sobre una imagen PIL (previo preprocesamiento), usando
+    la caché de OCR en disco cuando se conoce el hash del archivo de origen.
+    """
+    engine_version = get_engine_version()
+    text = ocr_cache.get_cached_text(file_hash, OCR_LANG, page, engine_version)
+    if text is None:
+        with STAGE_SECONDS.time(stage="preprocess"):
+            image = image_preprocessing.preprocess_image(image)
+        with STAGE_SECONDS.time(stage="tesseract"):
+            text = get_ocr_backend().image_to_string(image)
+        ocr_cache.store_text(file_hash, OCR_LANG, page, engine_version, text)
+        OCR_PAGES.inc(cache="miss")
+    else:
+        OCR_PAGES.inc(cache="hit")
+    return text
+
+# -------------------------------------------------------------------------
+# POPPLER EN MEMORIA: el PDF entra por stdin y la página sale por stdout
+# -------------------------------------------------------------------------
+
+# Resolución de renderizado (la misma que usa pdf2image por defecto)
+PDF_DPI = 200
+
+def _poppler_command(name):
+    """Ruta del ejecutable de Poppler (POPPLER_PATH si existe, si no el PATH)."""
+    if POPPLER_PATH and os.path.isdir(POPPLER_PATH):
+        return os.path.join(POPPLER_PATH, name)
+    return name
+
+def pdf_page_count_from_bytes(pdf_bytes):
+    """Número de páginas de un PDF en memoria (pdfinfo leyendo de stdin)."""
+    result = subprocess.run([_poppler_command("pdfinfo"), "-"], input=pdf_bytes, capture_output=True, check=True)
+    for line in result.stdout.decode('utf-8', 'ignore').splitlines():
+        if line.startswith("Pages:"):
+            return int(line.split(":", 1)[1])
+    return 0
+
+def render_pdf_page_from_bytes(pdf_bytes, page):
+    """
+    Renderiza una página (índice desde 0) de un PDF en memoria y devuelve la
+    imagen PIL. pdftoppm sin raíz de salida escribe el PPM en stdout, así
+    que no se crea ningún archivo intermedio.
+    """
+    result = subprocess.run(
+        [_poppler_command("pdftoppm"), "-f", str(page + 1), "-l", str(page + 1), "-r", str(PDF_DPI), "-"],
+        input=pdf_bytes,
+        capture_output=True,
+        check=True
+    )
+    if not result.stdout:
+        raise Exception(f"No se pudo convertir la página {page + 1} del PDF.")
+    return Image.open(io.BytesIO(result.stdout))
+
+def extract_pdf_text_layer(file_path, pdf_bytes=None, max_pages=None):
+    """
+    Lee la capa de texto embebida de un PDF con pdftotext (-layout conserva
+    la disposición de las columnas). Devuelve '' si el PDF no tiene texto.
+    """
+    max_pages = PDF_MAX_PAGES if max_pages is None else max_pages
+    command = [_poppler_command("pdftotext"), "-layout", "-enc", "UTF-8"]
+    if max_pages:
+        command += ["-l", str(max_pages)]
+    command += ["-" if pdf_bytes is not None else file_path, "-"]
+
+    result = subprocess.run(command, input=pdf_bytes, capture_output=True, check=True)
+    # pdftotext separa las páginas con un salto de página
+    return result.stdout.decode('utf-8', 'ignore').replace('\f', '\n')
+
+def is_text_layer_usable(text, min_chars=None):
+    """La capa de texto es útil si tiene suficientes caracteres visibles."""
+    min_chars = PDF_TEXT_MIN_CHARS if min_chars is None else min_chars
+    return sum(1 for char in text if not char.isspace()) >= min_chars
+
+def ocr_pdf_page(file_path, page, file_hash=None, pdf_bytes=None):
+    """
+    Renderiza una sola página del PDF (first_page/last_page) y la pasa a
+    Tesseract. Si el texto de la página está en caché no se renderiza.
+    Con `pdf_bytes` la página se renderiza en memoria.
+    """
+    engine_version = get_engine_version()
+    text = ocr_cache.get_cached_text(file_hash, OCR_LANG, page, engine_version)
+    if text is not None:
+        OCR_PAGES.inc(cache="hit")
+        return text
+
+    if pdf_bytes is not None:
+        with STAGE_SECONDS.time(stage="pdf_render"):
+            image = render_pdf_page_from_bytes(pdf_bytes, page)
+        return ocr_image(image, file_hash, page)
+
+    with STAGE_SECONDS.time(stage="pdf_render"):
+        images = convert_from_path(
+            file_path,
+            first_page=page + 1,
+            last_page=page + 1,
+            thread_count=1,
+            poppler_path=POPPLER_PATH
+        )
+    if not images:
+        raise Exception(f"No se pudo convertir la página {page + 1} del PDF.")
+    return ocr_image(images[0], file_hash, page)
+
+_ocr_executor = None
+_ocr_executor_pid = None
+_ocr_executor_lock = threading.Lock()
+
+def get_ocr_executor():
+    """
+    Pool de hilos del proceso para reconocer las páginas de los PDFs,
+    compartido por todas las peticiones (uno nuevo tras un fork).
+    """
+    global _ocr_executor, _ocr_executor_pid
+    with _ocr_executor_lock:
+        if _ocr_executor is None or _ocr_executor_pid != os.getpid():
+            _ocr_executor = ThreadPoolExecutor(max_workers=max(1, OCR_THREADS), thread_name_prefix="ocr-page")
+            _ocr_executor_pid = os.getpid()
+        return _ocr_executor
+
+def ocr_pdf(file_path, file_hash=None, max_pages=None, stop_early=None, threads=None, pdf_bytes=None):
+    """
+    OCR de un PDF multipágina. Las páginas se renderizan de una en una y se
+    reconocen en paralelo, en el pool de hilos del proceso
+    (get_ocr_executor), por lotes de `threads` páginas; el texto se une en
+    orden de página. Con `stop_early` no se procesan más lotes una vez
+    encontrados todos los campos obligatorios.
+    
+    :return: Tupla (texto, páginas procesadas, total de páginas).
+    """
+    max_pages = PDF_MAX_PAGES if max_pages is None else max_pages
+    stop_early = PDF_STOP_EARLY if stop_early is None else stop_early
+    threads = max(1, OCR_THREADS if threads is None else threads)
+
+    if pdf_bytes is not None:
+        total_pages = pdf_page_count_from_bytes(pdf_bytes)
+    else:
+        total_pages = pdfinfo_from_path(file_path, poppler_path=POPPLER_PATH).get("Pages", 0)
+    if not total_pages:
+        raise Exception("El PDF está vacío o no se pudo convertir.")
+    pages_to_process = min(total_pages, max_pages) if max_pages else total_pages
+
+    page_texts = []
+    executor = get_ocr_executor()
+    for batch_start in range(0, pages_to_process, threads):
+        batch = range(batch_start, min(batch_start + threads, pages_to_process))
+        page_texts.extend(executor.map(lambda page: ocr_pdf_page(file_path, page, file_hash, pdf_bytes), batch))
+
+        if stop_early and not missing_required_fields(extract_fields("\n".join(page_texts))[0]):
+            break
+
+    return "\n".join(page_texts), len(page_texts), total_pages
+
+def get_cached_document_text(file_hash):
+    """
+    Reconstruye el texto completo de un documento a partir de la caché de OCR
+    (páginas consecutivas desde la 0). Devuelve None si no hay nada en caché.
+    """
+    engine_version = get_engine_version()
+    page_texts = []
+    while True:
+        text = ocr_cache.get_cached_text(file_hash, OCR_LANG, len(page_texts), engine_version)
+        if text is None:
+            break
+        page_texts.append(text)
+    return "\n".join(page_texts) if page_texts else None
+
+def process_invoice_file(file_path, file_hash=None, file_bytes=None, log_level=None):
     """
     Implementa el Módulo 1: OCR, Extracción de PNL (simplificada) y Validación.
-    Maneja archivos PDF convirtiéndolos primero a imágenes.
+    Maneja archivos PDF convirtiéndolos primero a imágenes (todas sus páginas,
+    ver PDF_MAX_PAGES y PDF_STOP_EARLY).
+    
+    :param file_path: Ruta del archivo (imagen o PDF). Con `file_bytes` solo se
+                      usa para detectar el tipo y para el log.
+    :param file_hash: SHA-256 del archivo; si no se indica se calcula. Permite
+                      reutilizar el texto de la caché de OCR sin ejecutar Tesseract.
+    :param file_bytes: Contenido del archivo en memoria; evita cualquier archivo
+                       temporal entre la subida y Tesseract.
+    :param log_level: Nivel del log de extracción (por defecto EXTRACTION_LOG_LEVEL).
     """
     
     extraction_log = f"Iniciando OCR en: {file_path}\n"
     text = ""
+    text_source = TEXT_SOURCE_OCR
     
     try:
-        if file_path.lower().endswith('.pdf'):
-            extraction_log += "Detectado archivo PDF. Convirtiendo a imagen...\n"
-            # Usa pdf2image para convertir el PDF. Se requiere la ruta de Poppler.
-            images = convert_from_path(file_path, poppler_path=POPPLER_PATH)
-            
-            if images:
-                with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_img:
-                    images[0].save(tmp_img.name, 'PNG')
-                    temp_image_path = tmp_img.name
-                
-                text = pytesseract.image_to_string(Image.open(temp_image_path), lang='spa+eng')
-                os.remove(temp_image_path)
+        if file_hash is None and ocr_cache.OCR_CACHE_ENABLED:
+            if file_bytes is not None:
+                file_hash = hashlib.sha256(file_bytes).hexdigest()
             else:
-                raise Exception("El PDF está vacío o no se pudo convertir.")
+                file_hash = ocr_cache.file_sha256(file_path)
+
+        if file_path.lower().endswith('.pdf'):
+            if PDF_TEXT_LAYER:
+                with STAGE_SECONDS.time(stage="pdf_text_layer"):
+                    text = read_pdf_text_layer(file_path, file_bytes)
+                if is_text_layer_usable(text):
+                    text_source = TEXT_SOURCE_PDF
+                    extraction_log += "Detectado PDF digital: se usa la capa de texto embebida (sin OCR).\n"
+                else:
+                    extraction_log += "La capa de texto del PDF falta o es insuficiente. Se recurre al OCR.\n"
+
+            if text_source == TEXT_SOURCE_OCR:
+                extraction_log += "Detectado archivo PDF. Convirtiendo páginas a imagen...\n"
+                # Usa Poppler para convertir el PDF (pdf2image o, en memoria, stdin/stdout).
+                text, processed_pages, total_pages = ocr_pdf(file_path, file_hash, pdf_bytes=file_bytes)
+                extraction_log += f"Páginas procesadas: {processed_pages} de {total_pages}.\n"
                 
         else:
-            text = pytesseract.image_to_string(Image.open(file_path), lang='spa+eng')
+            image_source = io.BytesIO(file_bytes) if file_bytes is not None else file_path
+            text = ocr_image(Image.open(image_source), file_hash)
             
-        extraction_log += "OCR completado con éxito.\n"
-        
-        # Añadir debug del texto OCR
-        extraction_log = debug_ocr_text(text, extraction_log)
-        
-        extraction_log += "--- Texto Extraído (primeros 500 caracteres) ---\n" + text[:500] + "...\n----------------------\n"
+        extraction_log += "OCR completado con éxito.\n" if text_source == TEXT_SOURCE_OCR else "Texto extraído con éxito.\n"
     
     except Exception as e:
         extraction_log += f"🚨 Fallo crítico de OCR: {e}\n"
-        return {"data": {}, "log": extraction_log, "error": str(e)}
-        
+        PROCESSED_INVOICES.inc(result="error")
+        REJECTIONS.inc(reason="ocr_error")
+        logger.warning("Fallo de OCR en %s: %s", file_path, e, extra={"file_hash": file_hash})
+        log = None if (log_level or EXTRACTION_LOG_LEVEL) == EXTRACTION_LOG_OFF else extraction_log
+        return {"data": {}, "log": log, "error": str(e), "text_source": text_source}
+
+    result = process_invoice_text(text, extraction_log, log_level)
+    result["text_source"] = text_source
+    return result
+
+def read_pdf_text_layer(file_path, file_bytes=None):
+    """Capa de texto del PDF o '' si pdftotext no está disponible o falla."""
+    try:
+        return extract_pdf_text_layer(file_path, file_bytes)
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def process_invoice_text(text, extraction_log="", log_level=None):
+    """
+    Extracción de campos y validación a partir del texto OCR ya disponible.
+    Permite re-ejecutar la extracción (p. ej. tras cambiar REGEX_PATTERNS)
+    sin volver a pasar el archivo por Tesseract.
+    El análisis de debug del texto solo se calcula con log_level='debug'.
+    """
+    log_level = EXTRACTION_LOG_LEVEL if log_level is None else log_level
+    start = time.perf_counter()
+    # Tokenización única compartida por el debug y todos los resolvers
+    tokens = InvoiceText(text)
+
+    if log_level == EXTRACTION_LOG_DEBUG:
+        # Añadir debug del texto OCR
+        extraction_log = debug_ocr_text(tokens, extraction_log)
+        extraction_log += "--- Texto Extraído (primeros 500 caracteres) ---\n" + text[:500] + "...\n----------------------\n"
+
     # 2. PNL para identificar campos específicos (usando regex)
-    extracted_data = {}
+    extracted_data, extraction_log = extract_fields(tokens, extraction_log)
+            
+    # 4. Mecanismo de validación de datos extraídos
+    missing = missing_required_fields(extracted_data)
     
-    # Hacemos la búsqueda más tolerante a múltiples espacios
-    clean_text_for_search = re.sub(r'\s+', ' ', text)
+    if missing:
+        extraction_log += "⚠️ Falla de validación: Faltan campos obligatorios o son inválidos.\n"
+        extraction_log += f"Campos faltantes/inválidos: {', '.join(missing)}\n"
+        extracted_data['status'] = STATUS_RECHAZADO
+    else:
+        extracted_data['status'] = STATUS_EN_PROCESO
+        extraction_log += "✅ Validación básica superada. Datos listos para aprobación.\n"
+
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="extraction")
+    record_extraction_metrics(extracted_data, missing)
+    log = None if log_level == EXTRACTION_LOG_OFF else extraction_log
+    return {"data": extracted_data, "log": log, "error": None, "text": text}
+
+def rebuild_extraction_log(file_hash, log_level=EXTRACTION_LOG_DEBUG):
+    """
+    Reconstruye bajo demanda el log de extracción (por defecto con el análisis
+    de debug) a partir del texto guardado en la caché de OCR, sin Tesseract.
+    :return: El log o None si el texto del documento no está en caché.
+    """
+    text = get_cached_document_text(file_hash) if file_hash else None
+    if text is None:
+        return None
+    extraction_log = "Log reconstruido desde la caché de OCR.\n"
+    return process_invoice_text(text, extraction_log, log_level)["log"]
+
+def record_extraction_metrics(extracted_data, missing):
+    """Campos extraídos/ausentes y resultado de la validación de una factura."""
+    for field in COMPILED_PATTERNS:
+        EXTRACTED_FIELDS.inc(field=field, result="extracted" if extracted_data.get(field) else "missing")
+    if missing:
+        PROCESSED_INVOICES.inc(result="rechazada")
+        REJECTIONS.inc(reason="validation")
+    else:
+        PROCESSED_INVOICES.inc(result="en_proceso")
+
+def missing_required_fields(extracted_data):
+    """Lista de campos obligatorios ausentes o inválidos."""
+    return [f for f in REQUIRED_FIELDS if not extracted_data.get(f)]
+
+def extract_fields(text, extraction_log=""):
+    """
+    Extrae los campos de REGEX_PATTERNS del texto OCR (str o InvoiceText).
+    :return: Tupla (datos extraídos, log actualizado).
+    """
+    tokens = _as_invoice_text(text)
+    extracted_data = {}
     
-    for field, pattern in REGEX_PATTERNS.items():
+    # La búsqueda se hace sobre tokens.clean (espacios colapsados)
+    for field, pattern in COMPILED_PATTERNS.items():
+        anchors = PATTERN_ANCHORS[field]
         # Para el provider_name usamos el método mejorado
         if field == "provider_name":
-            extracted_data[field] = extract_provider_name_enhanced(text)
+            extracted_data[field] = extract_provider_name_enhanced(tokens)
             if extracted_data[field]:
                 extraction_log += f"✅ Campo '{field}' extraído con valor: '{extracted_data[field]}'\n"
             else:
@@ -317,7 +860,7 @@ def process_invoice_file(file_path):
         
         # Para issue_date usamos el método mejorado
         elif field == "issue_date":
-            extracted_data[field] = extract_issue_date_enhanced(text)
+            extracted_data[field] = extract_issue_date_enhanced(tokens)
             if extracted_data[field]:
                 extraction_log += f"✅ Campo '{field}' extraído con valor: '{extracted_data[field]}'\n"
             else:
@@ -325,14 +868,14 @@ def process_invoice_file(file_path):
         
         # Para total_amount usamos el método mejorado si el normal falla
         elif field == "total_amount":
-            match = re.search(pattern, clean_text_for_search, re.IGNORECASE | re.MULTILINE | re.DOTALL)
+            match = tokens.search(pattern, anchors, clean=True)
             if match:
                 value = match.group(1).strip()
                 extracted_data[field] = clean_and_convert(value)
                 extraction_log += f"✅ Campo '{field}' extraído con valor: '{value}' -> {extracted_data[field]}\n"
             else:
                 # Fallback al método mejorado
-                extracted_data[field] = extract_total_amount_enhanced(text)
+                extracted_data[field] = extract_total_amount_enhanced(tokens)
                 if extracted_data[field]:
                     extraction_log += f"✅ Campo '{field}' extraído (fallback) con valor: {extracted_data[field]}\n"
                 else:
@@ -340,7 +883,7 @@ def process_invoice_file(file_path):
         
         else:
             # Para los demás campos, usamos el método original
-            match = re.search(pattern, clean_text_for_search, re.IGNORECASE | re.MULTILINE | re.DOTALL)
+            match = tokens.search(pattern, anchors, clean=True)
             if match:
                 value = match.group(1).strip()
                 
@@ -355,18 +898,5 @@ def process_invoice_file(file_path):
                 extraction_log += f"✅ Campo '{field}' extraído con valor: '{value}' -> {extracted_data[field]}\n"
             else:
                 extraction_log += f"❌ Campo '{field}' no encontrado.\n"
-            
-    # 4. Mecanismo de validación de datos extraídos
-    required_fields = ["provider_name", "invoice_number", "issue_date", "total_amount", "taxes"]
-    is_valid = all(extracted_data.get(field) for field in required_fields)
-    
-    if not is_valid:
-        extraction_log += "⚠️ Falla de validación: Faltan campos obligatorios o son inválidos.\n"
-        missing = [f for f in required_fields if not extracted_data.get(f)]
-        extraction_log += f"Campos faltantes/inválidos: {', '.join(missing)}\n"
-        extracted_data['status'] = STATUS_RECHAZADO
-    else:
-        extracted_data['status'] = STATUS_EN_PROCESO
-        extraction_log += "✅ Validación básica superada. Datos listos para aprobación.\n"
 
-    return {"data": extracted_data, "log": extraction_log, "error": None}
\ No newline at end of file
+    return extracted_data, extraction_log
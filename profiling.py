@@ -0,0 +1,226 @@
+# profiling.py
+
+"""
+Perfilado bajo demanda de peticiones concretas (subida, webhook, decisión
+en bloque).
+
+Se activa para todas esas peticiones con PROFILE_REQUESTS=true o, para una
+sola, enviando la cabecera X-Profile-Token con el valor de
+PROFILE_ADMIN_TOKEN. Cada petición perfilada deja en PROFILE_DIR, con el ID
+de la factura en el nombre:
+
+- .pstats: cProfile del hilo de la petición (python -m pstats, snakeviz).
+- .collapsed: pilas muestreadas cada PROFILE_SAMPLE_INTERVAL segundos en
+  formato "marco;marco;marco cuenta" (flamegraph.pl, speedscope). Incluye
+  los hilos que la petición lanza y los del pool compartido de OCR de las
+  páginas de un PDF (con peticiones concurrentes, también su trabajo).
+- .svg: flamegraph generado a partir de esas pilas.
+
+Solo se perfila una petición a la vez; mientras tanto las demás se
+atienden sin perfilar.
+"""
+
+import os
+import sys
+import hmac
+import time
+import zlib
+import argparse
+import pstats
+import cProfile
+import threading
+from html import escape
+from collections import Counter
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+def _env_flag(name, default):
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+# Configuración del perfilado
+PROFILE_REQUESTS = _env_flag("PROFILE_REQUESTS", "false")
+PROFILE_ADMIN_TOKEN = os.environ.get("PROFILE_ADMIN_TOKEN", "")
+PROFILE_HEADER = "X-Profile-Token"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", 0.005))
+# Endpoints (nombres de las vistas de Flask) que se pueden perfilar
+PROFILE_ENDPOINTS = {"upload_invoice", "webhook_handler", "bulk_decision_handler"}
+
+# Hilos compartidos entre peticiones que se muestrean aunque existieran antes (pool de páginas de processor.py)
+PROFILE_SHARED_THREAD_PREFIXES = ("ocr-page",)
+
+# Una sola petición perfilada a la vez
+_profile_lock = threading.Lock()
+
+def profiling_requested(endpoint, headers, enabled=PROFILE_REQUESTS):
+    """Indica si la petición debe perfilarse (flag global o cabecera de administrador)."""
+    if endpoint not in PROFILE_ENDPOINTS:
+        return False
+    if enabled:
+        return True
+    token = headers.get(PROFILE_HEADER)
+    return bool(PROFILE_ADMIN_TOKEN and token and hmac.compare_digest(token, PROFILE_ADMIN_TOKEN))
+
+# -------------------------------------------------------------------------
+# MUESTREO DE PILAS
+# -------------------------------------------------------------------------
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class StackSampler:
+    """
+    Hilo que toma una muestra de la pila del hilo perfilado (y de los hilos
+    creados durante el perfilado o compartidos, ver
+    PROFILE_SHARED_THREAD_PREFIXES) cada `interval` segundos.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        shared = {thread.ident for thread in threading.enumerate() if thread.name.startswith(PROFILE_SHARED_THREAD_PREFIXES)}
+        self._preexisting = set(sys._current_frames()) - {thread_id} - shared
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or thread_id in self._preexisting:
+                    continue
+                self.stacks[_collapse(frame)] += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+# -------------------------------------------------------------------------
+# FLAMEGRAPH (SVG)
+# -------------------------------------------------------------------------
+
+FLAMEGRAPH_WIDTH = 1200
+FLAMEGRAPH_ROW_HEIGHT = 16
+
+def render_flamegraph(stacks, title="Flamegraph"):
+    """SVG con un rectángulo por marco; el ancho es proporcional a las muestras."""
+    root = {"children": {}, "count": 0}
+    for stack, count in stacks.items():
+        node = root
+        node["count"] += count
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"children": {}, "count": 0})
+            node["count"] += count
+
+    total = root["count"] or 1
+    rects, depth_max = [], 0
+
+    def place(node, x, depth):
+        nonlocal depth_max
+        for name, child in sorted(node["children"].items()):
+            width = child["count"] / total * FLAMEGRAPH_WIDTH
+            if width >= 0.5:
+                rects.append((x, depth, width, name, child["count"]))
+                depth_max = max(depth_max, depth)
+                place(child, x, depth + 1)
+            x += width
+
+    place(root, 0.0, 0)
+    height = (depth_max + 3) * FLAMEGRAPH_ROW_HEIGHT
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{FLAMEGRAPH_WIDTH}" height="{height}" '
+        f'font-family="monospace" font-size="11">',
+        f'<text x="4" y="12">{escape(title)} ({root["count"]} muestras)</text>',
+    ]
+    for x, depth, width, name, count in rects:
+        y = height - (depth + 1) * FLAMEGRAPH_ROW_HEIGHT
+        hue = 10 + zlib.crc32(name.encode("utf-8")) % 40
+        label = escape(name[:int(width / 7)]) if width > 21 else ""
+        parts.append(
+            f'<g><title>{escape(name)} ({count} muestras, {count / total:.1%})</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{width:.1f}" height="{FLAMEGRAPH_ROW_HEIGHT - 1}" '
+            f'fill="hsl({hue},85%,60%)"/>'
+            f'<text x="{x + 2:.1f}" y="{y + 11}">{label}</text></g>'
+        )
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+# -------------------------------------------------------------------------
+# PERFIL DE UNA PETICIÓN
+# -------------------------------------------------------------------------
+
+class RequestProfile:
+    """cProfile y muestreo de pilas de una petición, guardados al terminar."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.profiler = cProfile.Profile()
+        self.sampler = StackSampler(threading.get_ident())
+
+    @classmethod
+    def start(cls, endpoint):
+        """Inicia el perfilado o devuelve None si ya hay otra petición perfilándose."""
+        if not _profile_lock.acquire(blocking=False):
+            return None
+        try:
+            profile = cls(endpoint)
+            profile.sampler.start()
+            profile.profiler.enable()
+            return profile
+        except Exception:
+            _profile_lock.release()
+            raise
+
+    def stop(self, invoice_id=None, directory=PROFILE_DIR):
+        """
+        Detiene el perfilado y guarda los tres archivos.
+        :return: Ruta base de los archivos (sin extensión).
+        """
+        try:
+            self.profiler.disable()
+            self.sampler.stop()
+            elapsed = time.perf_counter() - self.started
+
+            os.makedirs(directory, exist_ok=True)
+            tag = f"factura-{invoice_id}" if invoice_id is not None else "sin-factura"
+            base = os.path.join(directory, f"{tag}-{self.endpoint}-{datetime.now():%Y%m%d-%H%M%S-%f}")
+
+            self.profiler.dump_stats(base + ".pstats")
+            with open(base + ".collapsed", "w", encoding="utf-8") as f:
+                f.write(self.sampler.collapsed())
+            with open(base + ".svg", "w", encoding="utf-8") as f:
+                f.write(render_flamegraph(self.sampler.stacks, f"{self.endpoint} {tag} ({elapsed:.2f} s)"))
+            return base
+        finally:
+            _profile_lock.release()
+
+def print_top_functions(path, limit=20):
+    """Resumen de un .pstats guardado, ordenado por tiempo acumulado."""
+    pstats.Stats(path).sort_stats("cumulative").print_stats(limit)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Resumen de un perfil guardado (.pstats).")
+    parser.add_argument("path", help="Archivo .pstats generado por una petición perfilada.")
+    parser.add_argument("--limit", type=int, default=20, help="Número de funciones a mostrar.")
+    args = parser.parse_args()
+    print_top_functions(args.path, args.limit)
@@ -0,0 +1,132 @@
+# tests/conftest.py
+
+"""
+Configuración común de las pruebas.
+
+Los módulos del proyecto leen su configuración (DATABASE_URL, OCR_CACHE_DIR)
+al importarse, así que las variables se fijan aquí antes de importarlos: las
+pruebas usan una base SQLite y una caché de OCR temporales, nunca las del
+directorio de trabajo.
+
+Las pruebas que usan el fixture `db` se ejecutan también contra PostgreSQL:
+el de TEST_POSTGRES_URL (una base desechable: se crean y vacían sus tablas)
+o, si está instalado, un servidor temporal de pgserver. Sin ninguno de los
+dos, esas variantes se omiten.
+"""
+
+import os
+import sys
+import shutil
+import logging
+import tempfile
+from datetime import datetime
+
+TEST_DIR = tempfile.mkdtemp(prefix="invoice_tests_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DIR, 'invoices.db')}"
+os.environ["OCR_CACHE_DIR"] = os.path.join(TEST_DIR, "ocr_cache")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Los logs los captura pytest: configure_logging() no añade su handler de stdout
+logging.getLogger()._invoice_logging_configured = True
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import database
+
+# Como en un despliegue, la base se migra antes de arrancar la aplicación
+# (app.py solo comprueba la versión del esquema al importarse)
+database.init_db()
+
+try:
+    # Servidor PostgreSQL temporal para las pruebas (opcional)
+    import pgserver
+except ImportError:
+    pgserver = None
+
+TEST_POSTGRES_URL = os.environ.get("TEST_POSTGRES_URL")
+
+def clear_tables(engine):
+    """
+    Vacía todas las tablas (los triggers limpian también los índices y
+    resúmenes derivados) salvo la versión del esquema.
+    """
+    with engine.begin() as conn:
+        for table in reversed(database.Base.metadata.sorted_tables):
+            if table is not database.SchemaVersion.__table__:
+                conn.execute(table.delete())
+
+@pytest.fixture(scope="session", autouse=True)
+def test_database():
+    yield
+    database.Engine.dispose()
+    shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+@pytest.fixture(scope="session")
+def postgres_engine():
+    """Motor de PostgreSQL con el esquema, el índice de texto completo y los triggers creados."""
+    server = None
+    if TEST_POSTGRES_URL:
+        url = TEST_POSTGRES_URL
+    elif pgserver is not None:
+        server = pgserver.get_server(os.path.join(TEST_DIR, "postgres"), cleanup_mode="stop")
+        url = server.get_uri().replace("postgresql://", "postgresql+psycopg2://", 1)
+    else:
+        pytest.skip("Sin PostgreSQL: defina TEST_POSTGRES_URL o instale pgserver.")
+
+    engine = create_engine(url, **database.engine_options(url))
+    database.Base.metadata.create_all(engine)
+    database.create_search_index(engine)
+    database.create_spend_summary_triggers(engine)
+    clear_tables(engine)
+    yield engine
+    engine.dispose()
+    if server is not None:
+        server.cleanup()
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def engine(request):
+    if request.param == "postgresql":
+        return request.getfixturevalue("postgres_engine")
+    return database.Engine
+
+@pytest.fixture
+def db(engine):
+    """Sesión sobre la base de pruebas; las tablas se vacían al terminar."""
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+        clear_tables(engine)
+
+@pytest.fixture
+def client(db, tmp_path):
+    """Cliente de pruebas de Flask con las subidas en un directorio temporal."""
+    from app import app
+    app.config.update(TESTING=True, UPLOAD_FOLDER=str(tmp_path))
+    return app.test_client()
+
+@pytest.fixture
+def make_invoice(db):
+    """Crea y confirma una factura con el OCR terminado; los campos se pueden sobrescribir."""
+    counter = iter(range(1, 1000000))
+
+    def make(**fields):
+        number = next(counter)
+        values = {
+            "invoice_number": f"TEST-{number}",
+            "provider_name": "ACME S.A.",
+            "issue_date": datetime(2025, 3, 10),
+            "total_amount": 100.0,
+            "taxes": 16.0,
+            "status": database.STATUS_EN_PROCESO,
+            "job_status": database.JOB_COMPLETADO,
+        }
+        values.update(fields)
+        invoice = database.Invoice(**values)
+        db.add(invoice)
+        db.commit()
+        return invoice
+
+    return make
@@ -0,0 +1,215 @@
+# tests/test_app.py
+
+import io
+import os
+import json
+import hashlib
+from datetime import datetime
+
+import pytest
+
+from database import Invoice, InvoiceEvent, InvoiceLog, compress_log, JOB_EN_COLA, STATUS_APROBADO, STATUS_RECHAZADO, BULK_TRANSICION_INVALIDA
+
+# La app usa el motor de database.py (SQLite en las pruebas)
+pytestmark = pytest.mark.parametrize("engine", ["sqlite"], indirect=True)
+
+PDF_BYTES = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n1 0 obj\n<<>>\nendobj\ntrailer\n<<>>\n%%EOF\n"
+
+def upload(client, content=PDF_BYTES, filename="factura.pdf", mode="async"):
+    return client.post(
+        f"/api/v1/invoice/upload?mode={mode}",
+        data={"file": (io.BytesIO(content), filename)},
+        content_type="multipart/form-data"
+    )
+
+def test_enqueued_job_has_no_status(client, db):
+    response = upload(client)
+
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+    invoice = db.query(Invoice).filter(Invoice.id == job_id).one()
+    assert invoice.job_status == JOB_EN_COLA
+    assert invoice.status is None
+    assert db.query(Invoice.id).filter(Invoice.id == job_id, Invoice.status.is_(None)).count() == 1
+    event = db.query(InvoiceEvent).filter(InvoiceEvent.invoice_id == job_id).one()
+    assert (event.status, event.job_status) == (None, JOB_EN_COLA)
+
+def webhook(client, invoice_id, action):
+    return client.get(f"/api/v1/invoice/webhook?invoice_id={invoice_id}&action={action}")
+
+def test_webhook_cannot_reverse_a_decision(client, db, make_invoice):
+    invoice = make_invoice()
+
+    assert webhook(client, invoice.id, "approve").status_code == 200
+    # El mismo enlace abierto dos veces confirma sin volver a registrar el cambio
+    assert webhook(client, invoice.id, "approve").status_code == 200
+    assert webhook(client, invoice.id, "reject").status_code == 409
+    db.expire_all()
+    assert db.get(Invoice, invoice.id).status == STATUS_APROBADO
+    assert db.query(InvoiceEvent).filter(InvoiceEvent.invoice_id == invoice.id).count() == 1
+
+def test_webhook_and_bulk_decision_reject_queued_jobs(client, db):
+    job_id = upload(client).get_json()["job_id"]
+
+    assert webhook(client, job_id, "approve").status_code == 409
+    response = client.post("/api/v1/invoices/decision", json={"invoice_ids": [job_id], "action": "approve"})
+    assert response.get_json()["results"][0]["result"] == BULK_TRANSICION_INVALIDA
+    assert webhook(client, 999999, "approve").status_code == 404
+    db.expire_all()
+    assert db.get(Invoice, job_id).status is None
+
+def test_concurrent_identical_uploads_conflict(client, db, monkeypatch, tmp_path):
+    import app as app_module
+
+    first_job = upload(client).get_json()["job_id"]
+
+    # La segunda subida pasa la consulta previa como si la primera aún no se hubiera insertado;
+    # las consultas siguientes (tras el IntegrityError) ven la base de datos real
+    real_find = app_module.find_invoice_by_hash
+    pre_check_calls = []
+    def racing_find(db, file_hash):
+        if not pre_check_calls:
+            pre_check_calls.append(file_hash)
+            return None
+        return real_find(db, file_hash)
+    enqueued = []
+    real_enqueue = app_module.enqueue_invoice
+    def spy_enqueue(*args):
+        enqueued.append(args)
+        return real_enqueue(*args)
+    monkeypatch.setattr(app_module, "find_invoice_by_hash", racing_find)
+    monkeypatch.setattr(app_module, "enqueue_invoice", spy_enqueue)
+
+    response = upload(client)
+
+    # El 409 lo produce el índice único al insertar, no la consulta previa
+    assert len(pre_check_calls) == 1 and len(enqueued) == 1
+    assert response.status_code == 409
+    assert response.get_json()["invoice_id"] == first_job
+    assert db.query(Invoice).count() == 1
+    # El archivo guardado por la subida rechazada se elimina
+    assert [path.name for path in tmp_path.iterdir()] == [
+        os.path.basename(db.get(Invoice, first_job).file_path)
+    ]
+
+def test_duplicate_upload_is_rejected_before_ocr(client, db, make_invoice, monkeypatch):
+    import app as app_module
+    existing = make_invoice(file_hash=hashlib.sha256(PDF_BYTES).hexdigest())
+    monkeypatch.setattr(app_module, "process_invoice_file",
+                        lambda *args, **kwargs: pytest.fail("el duplicado pasó por el OCR"))
+
+    response = upload(client, mode="sync")
+
+    assert response.status_code == 409
+    assert response.get_json()["invoice_id"] == existing.id
+    assert db.query(Invoice).count() == 1
+
+# -------------------------------------------------------------------------
+# RECEPCIÓN EN STREAMING: TIPO REAL Y TAMAÑO MÁXIMO
+# -------------------------------------------------------------------------
+
+def test_upload_sniffs_the_real_file_type(client, db, tmp_path, monkeypatch):
+    import upload_stream
+    chunks = []
+    real_write = upload_stream.UploadSpool.write
+    monkeypatch.setattr(upload_stream.UploadSpool, "write", lambda self, data: chunks.append(data) or real_write(self, data))
+
+    # Un ejecutable con extensión .pdf se rechaza en el primer trozo, sin leer el resto
+    response = upload(client, content=b"MZ\x90\x00" + b"\x00" * 200000, filename="factura.pdf")
+    assert response.status_code == 415
+    assert len(chunks) == 1
+    # Más corto que cualquier firma
+    assert upload(client, content=b"%PD", filename="factura.pdf").status_code == 415
+    assert db.query(Invoice).count() == 0 and list(tmp_path.iterdir()) == []
+
+    # Un PNG subido como .pdf se guarda y se procesa como PNG
+    response = upload(client, content=b"\x89PNG\r\n\x1a\n" + b"\x00" * 64, filename="factura.pdf")
+    assert response.status_code == 202
+    assert db.get(Invoice, response.get_json()["job_id"]).file_path.endswith("factura.png")
+
+def test_upload_over_the_size_limit_is_rejected(client, db, tmp_path, monkeypatch):
+    from app import app
+    monkeypatch.setitem(app.config, "MAX_CONTENT_LENGTH", 1024 * 1024)
+
+    response = upload(client, content=PDF_BYTES + b"0" * (1024 * 1024))
+
+    assert response.status_code == 413
+    assert "1 MB" in response.get_json()["message"]
+    assert db.query(Invoice).count() == 0 and list(tmp_path.iterdir()) == []
+
+# -------------------------------------------------------------------------
+# LISTADO CON PAGINACIÓN POR CURSOR Y EXPORTACIÓN NDJSON
+# -------------------------------------------------------------------------
+
+def test_invoice_listing_pages_by_cursor_with_filters(client, db, make_invoice):
+    ids = [make_invoice(issue_date=datetime(2025, 3, day)).id for day in range(1, 6)]
+    rejected = make_invoice(status=STATUS_RECHAZADO, provider_name="Otro S.L.").id
+
+    pages, cursor = [], None
+    while True:
+        body = client.get("/api/v1/invoices?status=En Proceso&limit=2" + (f"&cursor={cursor}" if cursor else "")).get_json()
+        pages.append([invoice["id"] for invoice in body["invoices"]])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    # De la más reciente a la más antigua, sin repetir ni saltar filas
+    assert pages == [ids[4:2:-1], ids[2:0:-1], ids[:1]]
+
+    body = client.get("/api/v1/invoices?fields=invoice_number,status&provider=Otro S.L.").get_json()
+    assert body["invoices"] == [{"id": rejected, "invoice_number": "TEST-6", "status": STATUS_RECHAZADO}]
+    # date_to sin hora incluye el día completo
+    body = client.get("/api/v1/invoices?date_from=2025-03-02&date_to=2025-03-03&status=En Proceso").get_json()
+    assert [invoice["id"] for invoice in body["invoices"]] == [ids[2], ids[1]]
+    assert client.get("/api/v1/invoices?fields=extraction_log").status_code == 400
+    assert client.get("/api/v1/invoices?cursor=abc").status_code == 400
+
+def test_invoice_export_streams_ndjson_in_keyset_batches(client, db, make_invoice, monkeypatch):
+    from app import app
+    monkeypatch.setitem(app.config, "EXPORT_BATCH_SIZE", 2)
+    ids = [make_invoice().id for _ in range(5)]
+
+    response = client.get("/api/v1/invoices?format=ndjson&fields=total_amount")
+    assert response.mimetype == "application/x-ndjson"
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == [{"id": invoice_id, "total_amount": 100.0} for invoice_id in reversed(ids)]
+
+    response = client.get(f"/api/v1/invoices?limit=3&cursor={ids[4]}", headers={"Accept": "application/x-ndjson"})
+    assert [json.loads(line)["id"] for line in response.get_data(as_text=True).splitlines()] == ids[3::-1][:3]
+
+# -------------------------------------------------------------------------
+# MÉTRICAS
+# -------------------------------------------------------------------------
+
+def test_metrics_endpoint_reports_requests_and_rejections(client, db):
+    upload(client, content=b"GIF89a" + b"\x00" * 16, filename="factura.png")
+    webhook(client, 999999, "approve")
+
+    response = client.get("/metrics")
+
+    assert response.headers["Content-Type"] == "text/plain; version=0.0.4; charset=utf-8"
+    lines = response.get_data(as_text=True).splitlines()
+    assert "# TYPE http_request_seconds histogram" in lines
+    assert any(line.startswith('invoice_rejections_total{reason="unsupported_type"} ') for line in lines)
+    assert any(line.startswith('http_request_seconds_count{endpoint="webhook_handler",method="GET",status="404"} ')
+               for line in lines)
+
+# -------------------------------------------------------------------------
+# LOG DE EXTRACCIÓN BAJO DEMANDA
+# -------------------------------------------------------------------------
+
+def test_debug_log_is_rebuilt_from_the_ocr_cache(client, db, make_invoice):
+    import ocr_cache
+    import processor
+    cached = make_invoice(file_hash="1" * 64)
+    evicted = make_invoice(file_hash="2" * 64)
+    for invoice in (cached, evicted):
+        db.add(InvoiceLog(invoice_id=invoice.id, log=compress_log("log guardado\n")))
+    db.commit()
+    ocr_cache.store_text("1" * 64, processor.OCR_LANG, 0, processor.get_engine_version(), "Factura N°: A-1\nTotal: 10.00")
+
+    assert client.get(f"/api/v1/invoice/{cached.id}/log").get_json()["extraction_log"] == "log guardado\n"
+    body = client.get(f"/api/v1/invoice/{cached.id}/log?level=debug").get_json()
+    assert body["level"] == "debug" and "=== DEBUG OCR TEXT ===" in body["extraction_log"]
+    # Sin el texto en caché se devuelve el log guardado
+    assert client.get(f"/api/v1/invoice/{evicted.id}/log?level=debug").get_json()["extraction_log"] == "log guardado\n"
+    assert client.get("/api/v1/invoice/999999/log").status_code == 404
@@ -0,0 +1,263 @@
+# tests/test_database.py
+
+import random
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, delete, inspect, text, update
+from sqlalchemy.exc import IntegrityError
+
+from database import (
+    Invoice, InvoiceLog, SpendSummary, get_extraction_log, update_invoice_status, bulk_update_invoice_status, check_spend_summary, spend_report,
+    create_spend_summary_triggers, rebuild_spend_summary, create_search_index, search_invoices, find_invoice_by_hash,
+    engine_options, init_db, migrate_db, check_schema, Engine, SPEND_TRIGGER_VERSION, JOB_FALLIDO,
+    STATUS_EN_PROCESO, STATUS_APROBADO, STATUS_RECHAZADO, JOB_EN_COLA, JOB_PROCESANDO, JOB_COMPLETADO,
+    BULK_ACTUALIZADA, BULK_NO_ENCONTRADA, BULK_TRANSICION_INVALIDA
+)
+
+# -------------------------------------------------------------------------
+# DEDUPLICACIÓN POR HASH
+# -------------------------------------------------------------------------
+
+def test_file_hash_is_unique_except_for_failed_jobs(db, make_invoice):
+    failed = make_invoice(file_hash="f" * 64, job_status=JOB_FALLIDO, status=STATUS_RECHAZADO)
+    # Un archivo cuyo trabajo falló se puede volver a subir
+    retry = make_invoice(file_hash="f" * 64, job_status=JOB_EN_COLA, status=None, invoice_number=None)
+    assert find_invoice_by_hash(db, "f" * 64).id == retry.id
+
+    # Una subida simultánea del mismo archivo choca con el índice único
+    db.add(Invoice(file_hash="f" * 64, job_status=JOB_EN_COLA))
+    with pytest.raises(IntegrityError):
+        db.commit()
+    db.rollback()
+    assert db.query(Invoice).filter(Invoice.file_hash == "f" * 64).count() == 2
+    assert failed.id != retry.id
+
+# -------------------------------------------------------------------------
+# BÚSQUEDA DE TEXTO COMPLETO (FTS5 / tsvector)
+# -------------------------------------------------------------------------
+
+def test_search_ranks_matches_and_applies_filters(db, make_invoice):
+    texts = {
+        "papel": "Suministro de papel bond y papel reciclado para la oficina central",
+        "toner": "Cartuchos de tóner para impresoras de la oficina",
+        "otro": "Servicio de mantenimiento preventivo",
+    }
+    invoices = {}
+    for key, ocr_text in texts.items():
+        invoice = make_invoice(status=STATUS_APROBADO if key == "toner" else STATUS_EN_PROCESO)
+        invoice.ocr_text = ocr_text
+        invoices[key] = invoice
+    db.commit()
+
+    rows = search_invoices(db, "oficina")
+    assert {row.id for row in rows} == {invoices["papel"].id, invoices["toner"].id}
+    assert all("**" in row.snippet for row in rows)
+
+    rows = search_invoices(db, "papel")
+    assert [row.id for row in rows] == [invoices["papel"].id]
+    assert rows[0].score > 0
+
+    rows = search_invoices(db, "oficina", statuses=[STATUS_APROBADO])
+    assert [row.id for row in rows] == [invoices["toner"].id]
+    assert search_invoices(db, "inexistente") == []
+
+def test_search_index_setup_does_not_lock_a_busy_table(postgres_engine):
+    # Al arrancar otro proceso, el índice ya existe y no debe esperar a las lecturas en curso
+    url = postgres_engine.url.render_as_string(hide_password=False)
+    impatient = create_engine(url, connect_args={"options": "-c lock_timeout=2000"}, **engine_options(url))
+    try:
+        with postgres_engine.connect() as reader:
+            reader.execute(text("SELECT count(*) FROM invoice_texts"))
+            create_search_index(impatient)
+            reader.rollback()
+    finally:
+        impatient.dispose()
+
+# -------------------------------------------------------------------------
+# DECISIONES Y TRANSICIONES DE ESTADO
+# -------------------------------------------------------------------------
+
+def test_bulk_decision_skips_jobs_in_flight(db, make_invoice):
+    ready = make_invoice()
+    # Filas de trabajos en curso, incluidas las que el antiguo valor por defecto dejó 'En Proceso'
+    queued = make_invoice(job_status=JOB_EN_COLA, invoice_number=None)
+    running = make_invoice(job_status=JOB_PROCESANDO, invoice_number=None, status=None)
+
+    results = bulk_update_invoice_status(db, [ready.id, queued.id, running.id, 999999], STATUS_APROBADO)
+
+    assert results[ready.id][:2] == (BULK_ACTUALIZADA, STATUS_APROBADO)
+    assert results[queued.id][:2] == (BULK_TRANSICION_INVALIDA, STATUS_EN_PROCESO)
+    assert results[running.id][:2] == (BULK_TRANSICION_INVALIDA, None)
+    assert results[999999] == (BULK_NO_ENCONTRADA, None, None)
+    db.expire_all()
+    assert db.get(Invoice, queued.id).status == STATUS_EN_PROCESO
+    assert db.get(Invoice, running.id).status is None
+
+def test_single_decision_follows_allowed_transitions(db, make_invoice):
+    invoice = make_invoice()
+
+    assert update_invoice_status(db, invoice.id, STATUS_APROBADO)[:2] == (BULK_ACTUALIZADA, STATUS_APROBADO)
+    assert update_invoice_status(db, invoice.id, STATUS_RECHAZADO)[:2] == (BULK_TRANSICION_INVALIDA, STATUS_APROBADO)
+    assert update_invoice_status(db, 999999, STATUS_RECHAZADO) == (BULK_NO_ENCONTRADA, None, None)
+    with pytest.raises(ValueError):
+        update_invoice_status(db, invoice.id, STATUS_EN_PROCESO)
+
+# -------------------------------------------------------------------------
+# RESUMEN DE GASTO (spend_summary)
+# -------------------------------------------------------------------------
+
+PROVIDERS = ("ACME S.A.", "Papelería Central", None)
+DATES = (datetime(2025, 1, 31), datetime(2025, 2, 1), datetime(2025, 2, 28, 23, 59), None)
+
+def random_fields(rng):
+    return {
+        "provider_name": rng.choice(PROVIDERS),
+        "issue_date": rng.choice(DATES),
+        "total_amount": rng.choice((0.1, 0.2, 19.99, 1234.56, None)),
+        "taxes": rng.choice((0.01, 3.2, None)),
+    }
+
+def test_spend_summary_matches_recompute_after_random_changes(db, make_invoice):
+    rng = random.Random(7)
+    invoices = [make_invoice(**random_fields(rng)) for _ in range(60)]
+    assert check_spend_summary(db) == []
+
+    for invoice in rng.sample(invoices, 20):
+        for field, value in random_fields(rng).items():
+            setattr(invoice, field, value)
+    db.commit()
+    assert check_spend_summary(db) == []
+
+    update_invoice_status(db, invoices[0].id, STATUS_APROBADO)
+    bulk_update_invoice_status(db, [invoice.id for invoice in invoices[1:30]], STATUS_RECHAZADO)
+    db.execute(update(Invoice).where(Invoice.id.in_([invoice.id for invoice in invoices[30:40]])).values(taxes=1.5))
+    db.commit()
+    assert check_spend_summary(db) == []
+
+    db.delete(invoices[40])
+    db.execute(delete(Invoice).where(Invoice.id.in_([invoice.id for invoice in invoices[41:50]])))
+    db.commit()
+    assert check_spend_summary(db) == []
+
+    db.execute(delete(Invoice))
+    db.commit()
+    assert db.query(SpendSummary).count() == 0
+
+def test_spend_summary_skips_jobs_in_flight(db, make_invoice):
+    make_invoice(total_amount=10.0)
+    # Fila escrita con el antiguo valor por defecto: en cola pero 'En Proceso'
+    queued = make_invoice(job_status=JOB_EN_COLA, invoice_number=None, total_amount=500.0)
+    running = make_invoice(job_status=JOB_PROCESANDO, status=None, invoice_number=None, total_amount=700.0)
+
+    def report():
+        return [tuple(row) for row in spend_report(db, group_by=("status",))]
+
+    assert report() == [(STATUS_EN_PROCESO, 1, 1000, 1600)]
+    assert check_spend_summary(db) == []
+
+    # Al terminar el OCR la factura empieza a contar
+    queued.job_status = JOB_COMPLETADO
+    running.job_status, running.status = JOB_COMPLETADO, STATUS_RECHAZADO
+    db.commit()
+    assert report() == [(STATUS_EN_PROCESO, 2, 51000, 3200), (STATUS_RECHAZADO, 1, 70000, 1600)]
+    assert check_spend_summary(db) == []
+
+def test_spend_summary_replaces_outdated_triggers(db, make_invoice):
+    make_invoice()
+    current = spend_trigger_names(db)
+    for name in current:
+        db.execute(text(drop_trigger_sql(db, name)))
+    # Trigger de una versión anterior y resumen desfasado
+    db.execute(text(
+        "CREATE TRIGGER spend_summary_insert AFTER INSERT ON invoices BEGIN "
+        "UPDATE spend_summary SET invoice_count = invoice_count + 100; END"
+        if db.bind.dialect.name == "sqlite" else
+        "CREATE TRIGGER spend_summary_changes AFTER INSERT ON invoices "
+        "FOR EACH ROW EXECUTE FUNCTION spend_summary_apply_v%d()" % SPEND_TRIGGER_VERSION
+    ))
+    db.execute(text("DELETE FROM spend_summary"))
+    db.commit()
+
+    create_spend_summary_triggers(db.bind)
+
+    assert spend_trigger_names(db) == current
+    assert check_spend_summary(db) == []
+    make_invoice()
+    assert check_spend_summary(db) == []
+    assert rebuild_spend_summary(db.bind) == 1
+
+def spend_trigger_names(db):
+    if db.bind.dialect.name == "sqlite":
+        query = "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'spend_summary%'"
+    else:
+        query = "SELECT tgname FROM pg_trigger WHERE NOT tgisinternal AND tgname LIKE 'spend_summary%'"
+    return set(db.execute(text(query)).scalars())
+
+def drop_trigger_sql(db, name):
+    return f"DROP TRIGGER {name}" + (" ON invoices" if db.bind.dialect.name == "postgresql" else "")
+
+# -------------------------------------------------------------------------
+# MIGRACIÓN Y VERSIÓN DEL ESQUEMA
+# -------------------------------------------------------------------------
+
+def test_processes_only_check_the_schema_version():
+    check_schema()
+
+    with Engine.begin() as conn:
+        conn.execute(text("UPDATE schema_version SET version = version - 1"))
+    with pytest.raises(RuntimeError, match="python database.py migrate"):
+        check_schema()
+
+    init_db()
+    check_schema()
+
+def test_migration_drops_the_redundant_file_hash_index(engine):
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX ix_invoices_file_hash ON invoices (file_hash)"))
+
+    migrate_db(engine)
+
+    indexes = {index["name"] for index in inspect(engine).get_indexes("invoices")}
+    assert "ix_invoices_file_hash" not in indexes
+    assert "uq_invoices_file_hash_active" in indexes
+
+def test_migration_moves_extraction_logs_out_of_invoices(db, engine, make_invoice):
+    long_log = "línea del log\n" * 10000
+    logs = {make_invoice().id: "log corto", make_invoice().id: long_log, make_invoice().id: None}
+    db.commit()
+    # Esquema anterior: el log en la propia fila
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE invoices ADD COLUMN extraction_log TEXT"))
+        for invoice_id, log in logs.items():
+            conn.execute(text("UPDATE invoices SET extraction_log = :log WHERE id = :id"), {"log": log, "id": invoice_id})
+
+    migrate_db(engine)
+
+    assert "extraction_log" not in {column["name"] for column in inspect(engine).get_columns("invoices")}
+    # Los logs se conservan completos (sin el recorte de EXTRACTION_LOG_MAX_CHARS)
+    assert {invoice_id: get_extraction_log(db, invoice_id) for invoice_id in logs} == logs
+    assert db.query(InvoiceLog).count() == 2
+
+# -------------------------------------------------------------------------
+# ÍNDICES Y PRAGMAS DE SQLITE
+# -------------------------------------------------------------------------
+
+@pytest.mark.parametrize("engine", ["sqlite"], indirect=True)
+def test_sqlite_connections_use_wal_and_the_listing_indexes(db):
+    assert db.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+    assert db.execute(text("PRAGMA foreign_keys")).scalar() == 1
+
+    plan = " ".join(row[-1] for row in db.execute(text(
+        "EXPLAIN QUERY PLAN SELECT id FROM invoices WHERE status = 'En Proceso' ORDER BY issue_date DESC LIMIT 50"
+    )))
+    assert "ix_invoices_status_issue_date" in plan
+    assert "TEMP B-TREE" not in plan
+
+def test_migration_adds_missing_indexes_to_existing_databases(engine):
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_invoices_provider_issue_date"))
+
+    migrate_db(engine)
+
+    assert "ix_invoices_provider_issue_date" in {index["name"] for index in inspect(engine).get_indexes("invoices")}
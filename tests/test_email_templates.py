@@ -0,0 +1,51 @@
+# tests/test_email_templates.py
+
+import os
+import html
+import string
+
+import pytest
+
+import email_templates
+from email_templates import CompiledTemplate, RenderedPart, render_rows, build_message
+
+def test_html_slots_are_escaped_and_text_slots_are_not():
+    source = "<p>$provider debe ${amount} $$ (${provider})</p>"
+    context = {"provider": "<b>Tom & Jerry</b>", "amount": 12.5}
+
+    assert CompiledTemplate(source, is_html=True).render(context) == \
+        "<p>&lt;b&gt;Tom &amp; Jerry&lt;/b&gt; debe 12.5 $ (&lt;b&gt;Tom &amp; Jerry&lt;/b&gt;)</p>"
+    assert CompiledTemplate(source, is_html=False).render(context) == "<p><b>Tom & Jerry</b> debe 12.5 $ (<b>Tom & Jerry</b>)</p>"
+    assert CompiledTemplate(source, is_html=True).fields == ("provider", "amount")
+
+def test_missing_values_rendered_parts_and_invalid_markers():
+    template = CompiledTemplate("<table>$rows</table><p>$due</p>", is_html=True)
+    rows = RenderedPart("<tr><td>A&amp;B</td></tr>", "A&B")
+
+    # Las partes ya renderizadas no se escapan dos veces; None se muestra como N/A
+    assert template.render({"rows": rows, "due": None}) == "<table><tr><td>A&amp;B</td></tr></table><p>N/A</p>"
+    with pytest.raises(KeyError):
+        template.render({"rows": rows})
+    with pytest.raises(ValueError):
+        CompiledTemplate("precio: $ 10", is_html=False)
+
+@pytest.mark.parametrize("filename", sorted(os.listdir(email_templates.TEMPLATES_DIR)))
+def test_compiled_templates_match_string_template(filename):
+    template = email_templates.get_template(filename)
+    context = {name: f"<{name} & co>" for name in template.fields}
+    with open(os.path.join(email_templates.TEMPLATES_DIR, filename), encoding="utf-8") as f:
+        source = f.read()
+
+    escape = html.escape if template.is_html else str
+    expected = string.Template(source).substitute({name: escape(value) for name, value in context.items()})
+    assert template.render(context) == expected
+
+def test_rows_and_messages_carry_both_variants():
+    rows = render_rows("approval_digest_row", [{
+        "invoice_id": 1, "invoice_number": "A<1>", "provider_name": "ACME", "issue_date": None,
+        "total_amount": 10, "approve_url": "http://a", "reject_url": "http://r"
+    }])
+    assert "A&lt;1&gt;" in rows.html and "A<1>" in rows.text
+
+    message = build_message("Asunto", "de@example.com", "para@example.com", "<p>hola</p>", "hola")
+    assert [part.get_content_type() for part in message.iter_parts()] == ["text/plain", "text/html"]
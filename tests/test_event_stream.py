@@ -0,0 +1,98 @@
+# tests/test_event_stream.py
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from database import InvoiceEvent, STATUS_APROBADO, STATUS_RECHAZADO
+from event_stream import EventBroker, EventCursor, events_since, latest_event_id
+
+# Solo PostgreSQL asigna IDs que se confirman fuera de orden (SQLite serializa las escrituras)
+pytestmark = pytest.mark.parametrize("engine", ["postgresql"], indirect=True)
+
+@pytest.fixture
+def sessions(engine):
+    """Sesiones adicionales sobre el mismo motor, como transacciones de otros procesos."""
+    opened = []
+
+    def open_session():
+        session = sessionmaker(bind=engine)()
+        opened.append(session)
+        return session
+
+    yield open_session
+    for session in opened:
+        session.close()
+
+def add_event(session, invoice, status):
+    event = InvoiceEvent(invoice_id=invoice.id, status=status)
+    session.add(event)
+    session.flush()
+    return event.id
+
+@pytest.fixture
+def invoice(db, make_invoice):
+    """Factura con un evento ya confirmado: las pruebas leen a partir de él."""
+    invoice = make_invoice()
+    add_event(db, invoice, None)
+    db.commit()
+    return invoice
+
+def test_cursor_waits_for_ids_committed_out_of_order(db, invoice, sessions):
+    cursor = EventCursor(latest_event_id(db))
+    slow, fast = sessions(), sessions()
+
+    early = add_event(slow, invoice, STATUS_APROBADO)
+    late = add_event(fast, invoice, STATUS_RECHAZADO)
+    fast.commit()
+    assert [event.id for event in cursor.advance(cursor.fetch(db))] == [late]
+    assert cursor.resume_id == early - 1
+    db.commit()
+
+    slow.commit()
+    assert [event.id for event in cursor.advance(cursor.fetch(db))] == [early]
+    assert cursor.resume_id == late
+    db.commit()
+    assert cursor.advance(cursor.fetch(db)) == []
+
+def test_cursor_gives_up_on_rolled_back_ids(db, invoice, sessions):
+    cursor = EventCursor(latest_event_id(db), gap_timeout=0)
+    aborted = sessions()
+
+    add_event(aborted, invoice, STATUS_APROBADO)
+    aborted.rollback()
+    kept = add_event(db, invoice, STATUS_RECHAZADO)
+    db.commit()
+
+    assert [event.id for event in cursor.advance(cursor.fetch(db))] == [kept]
+    assert cursor.gaps == {} and cursor.resume_id == kept
+
+def test_broker_delivers_late_commits_once(db, invoice, sessions):
+    start = latest_event_id(db)
+    broker = EventBroker()
+    live = broker.subscribe(last_id=start)
+    broker._cursor = EventCursor(start)
+    slow = sessions()
+
+    early = add_event(slow, invoice, STATUS_APROBADO)
+    late = add_event(db, invoice, STATUS_RECHAZADO)
+    db.commit()
+    broker.poll_once(db)
+    db.commit()
+    assert live.get(timeout=0)["id"] == late
+    assert live.resume_id == early - 1
+
+    # Un cliente que se reconecta ahora recupera los dos eventos por su cuenta
+    reconnected = broker.subscribe(last_id=start)
+    slow.commit()
+    broker_resume_id = broker.resume_id
+    for event in events_since(db, start):
+        reconnected.catch_up(event.id, broker_resume_id)
+    db.commit()
+
+    broker.poll_once(db)
+    assert live.get(timeout=0)["id"] == early
+    assert live.get(timeout=0) is None
+    # El difusor vuelve a publicar el evento tardío y se descarta: ya lo envió la recuperación
+    assert reconnected.get(timeout=0) is None
+    assert reconnected.get(timeout=0) is None
+    assert live.resume_id == reconnected.resume_id == early
@@ -0,0 +1,47 @@
+# tests/test_image_preprocessing.py
+
+from PIL import Image, ImageDraw, ImageOps
+
+import image_preprocessing
+from image_preprocessing import PREPROCESS_SETTINGS, preprocess_image, estimate_skew, otsu_threshold, config_signature
+
+def text_lines(size=(800, 600), background=255, ink=0):
+    """Página sintética: renglones de "texto" (barras) con márgenes amplios."""
+    image = Image.new("L", size, background)
+    draw = ImageDraw.Draw(image)
+    for top in range(150, 450, 40):
+        draw.rectangle((150, top, 650, top + 12), fill=ink)
+    return image
+
+def test_preprocessing_binarizes_crops_and_only_downscales():
+    page = text_lines().convert("RGB")
+    page.info["dpi"] = (600, 600)
+
+    result = preprocess_image(page)
+
+    assert result.mode == "L"
+    assert {value for _, value in result.getcolors()} == {0, 255}
+    # Reducida a 300 DPI y recortada al contenido (250x146 px) con su margen
+    margin = PREPROCESS_SETTINGS["crop_margin"]
+    width, height = result.size
+    assert abs(width - (250 + 2 * margin)) <= 3 and abs(height - (146 + 2 * margin)) <= 3
+
+    # Una imagen pequeña sin DPI no se amplía
+    small = text_lines((200, 100))
+    assert max(image_preprocessing.downscale(small, PREPROCESS_SETTINGS).size) == 200
+
+def test_skew_is_estimated_and_dark_backgrounds_are_inverted():
+    page = text_lines().rotate(3, resample=Image.BICUBIC, fillcolor=255)
+    angle = estimate_skew(page, otsu_threshold(page), PREPROCESS_SETTINGS)
+    assert abs(angle + 3) <= PREPROCESS_SETTINGS["skew_step"]
+
+    # Texto claro sobre fondo oscuro: sale texto negro sobre blanco
+    negative = ImageOps.invert(text_lines())
+    result = preprocess_image(negative, dict(PREPROCESS_SETTINGS, crop=False, deskew=False))
+    assert result.getpixel((10, 10)) == 255
+
+def test_settings_are_part_of_the_ocr_cache_key():
+    assert config_signature(dict(PREPROCESS_SETTINGS, binarize=False)) != config_signature(PREPROCESS_SETTINGS)
+    assert config_signature(dict(PREPROCESS_SETTINGS, enabled=False)) == "prep-off"
+    disabled = text_lines()
+    assert preprocess_image(disabled, dict(PREPROCESS_SETTINGS, enabled=False)) is disabled
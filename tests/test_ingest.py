@@ -0,0 +1,67 @@
+# tests/test_ingest.py
+
+import ingest
+from database import (
+    Invoice, InvoiceText, InvoiceEvent, OutboxMessage, JOB_COMPLETADO, JOB_FALLIDO,
+    STATUS_EN_PROCESO, STATUS_RECHAZADO
+)
+
+def result(invoice_number, text="Factura de prueba", status=STATUS_EN_PROCESO):
+    return {
+        "data": {"invoice_number": invoice_number, "provider_name": "ACME S.A.", "status": status},
+        "log": "ok",
+        "text": text,
+        "text_source": "text_layer",
+    }
+
+def test_failed_jobs_do_not_block_reingestion(db, make_invoice):
+    make_invoice(file_hash="a" * 64, job_status=JOB_FALLIDO, invoice_number=None)
+    make_invoice(file_hash="b" * 64)
+
+    inserted, duplicates = ingest.insert_batch(db, [
+        ("a.pdf", "a" * 64, result("ING-1")),
+        ("b.pdf", "b" * 64, result("ING-2")),
+    ])
+
+    assert (inserted, duplicates) == (1, 1)
+    retried = db.query(Invoice).filter(Invoice.invoice_number == "ING-1").one()
+    assert (retried.file_hash, retried.job_status) == ("a" * 64, JOB_COMPLETADO)
+
+def test_concurrent_inserts_only_skip_the_conflicting_rows(db, make_invoice, monkeypatch):
+    # Otro proceso insertó estas facturas después de la consulta de duplicados
+    make_invoice(file_hash="c" * 64)
+    make_invoice(invoice_number="ING-5")
+    monkeypatch.setattr(ingest, "existing_keys", lambda db, hashes, numbers: (set(), set()))
+
+    inserted, duplicates = ingest.insert_batch(db, [
+        ("c.pdf", "c" * 64, result("ING-3")),
+        ("d.pdf", "d" * 64, result("ING-4", text="Texto de la factura cuatro")),
+        ("e.pdf", "e" * 64, result("ING-5")),
+    ])
+
+    assert (inserted, duplicates) == (1, 2)
+    invoice = db.query(Invoice).filter(Invoice.file_hash == "d" * 64).one()
+    assert invoice.invoice_number == "ING-4"
+    assert db.query(InvoiceText).filter(InvoiceText.invoice_id == invoice.id).one().ocr_text == "Texto de la factura cuatro"
+    assert db.query(Invoice).count() == 3
+
+def test_ingested_invoices_are_announced_like_uploads(db, make_invoice, monkeypatch):
+    monkeypatch.setattr(ingest, "APPROVER_EMAILS", ["ana@example.com", "luis@example.com"])
+    # Un conflicto obliga a reintentar fila a fila: la fila descartada no deja eventos ni correos
+    make_invoice(file_hash="f" * 64)
+    monkeypatch.setattr(ingest, "existing_keys", lambda db, hashes, numbers: (set(), set()))
+
+    assert ingest.insert_batch(db, [
+        ("f.pdf", "f" * 64, result("ING-6")),
+        ("g.pdf", "g" * 64, result("ING-7")),
+        ("h.pdf", "h" * 64, result("ING-8", status=STATUS_RECHAZADO)),
+    ]) == (2, 1)
+
+    ids = {row.invoice_number: row.id for row in db.query(Invoice.invoice_number, Invoice.id)}
+    events = sorted((event.invoice_id, event.status, event.job_status) for event in db.query(InvoiceEvent))
+    assert events == [
+        (ids["ING-7"], STATUS_EN_PROCESO, JOB_COMPLETADO),
+        (ids["ING-8"], STATUS_RECHAZADO, JOB_COMPLETADO),
+    ]
+    outbox = sorted((entry.invoice_id, entry.recipient) for entry in db.query(OutboxMessage))
+    assert outbox == [(ids["ING-7"], "ana@example.com"), (ids["ING-7"], "luis@example.com")]
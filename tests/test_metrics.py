@@ -0,0 +1,58 @@
+# tests/test_metrics.py
+
+import re
+import urllib.request
+
+import pytest
+
+import metrics
+from metrics import Counter, Histogram, render_metrics, start_metrics_server, CONTENT_TYPE
+
+# Línea de muestra del formato de texto de Prometheus: nombre{etiquetas} valor
+SAMPLE_LINE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_]\w*="([^"\\]|\\.)*",?)*\})? (\+Inf|-?[0-9.e+-]+)$')
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Registro vacío para las métricas creadas en la prueba."""
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+    return metrics.REGISTRY
+
+def test_histograms_are_cumulative_with_sum_and_count(registry):
+    histogram = Histogram("stage_seconds", "Duración.", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value, stage="ocr")
+
+    assert render_metrics().splitlines() == [
+        "# HELP stage_seconds Duración.",
+        "# TYPE stage_seconds histogram",
+        'stage_seconds_bucket{stage="ocr",le="0.1"} 2',
+        'stage_seconds_bucket{stage="ocr",le="1.0"} 3',
+        'stage_seconds_bucket{stage="ocr",le="+Inf"} 4',
+        'stage_seconds_sum{stage="ocr"} 5.65',
+        'stage_seconds_count{stage="ocr"} 4',
+    ]
+
+def test_counters_escape_label_values(registry):
+    counter = Counter("rejections", "Rechazos.", ["reason"])
+    counter.inc(reason='dice "hola"\\n')
+    counter.inc(2, reason='dice "hola"\\n')
+    counter.inc(reason="otro\nmotivo")
+
+    lines = render_metrics().splitlines()
+    assert lines[1] == "# TYPE rejections counter"
+    assert lines[2:] == [
+        'rejections_total{reason="dice \\"hola\\"\\\\n"} 3',
+        'rejections_total{reason="otro\\nmotivo"} 1',
+    ]
+    assert all(SAMPLE_LINE.match(line) for line in lines[2:])
+
+def test_processes_without_flask_publish_the_same_text():
+    server = start_metrics_server(0, host="127.0.0.1")
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/") as response:
+            assert response.headers["Content-Type"] == CONTENT_TYPE
+            body = response.read().decode("utf-8")
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert "# TYPE invoice_stage_seconds histogram" in body
@@ -0,0 +1,195 @@
+# tests/test_notifications.py
+
+"""Entrega de correo contra un servidor SMTP local (aiosmtpd), sin TLS ni autenticación."""
+
+import os
+import sys
+import json
+import socket
+import email
+import subprocess
+from email import policy
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from aiosmtpd.controller import Controller
+
+import notification_service
+from email_templates import build_message
+from notification_dispatcher import SMTPConnectionPool, send_message
+from outbox_relay import claim_batch, deliver_batch
+from database import (
+    OutboxMessage, add_approval_notifications, STATUS_APROBADO,
+    OUTBOX_ENVIADO, OUTBOX_PENDIENTE, OUTBOX_FALLIDO, OUTBOX_DESCARTADO
+)
+
+SENDER = "facturas@example.com"
+
+class Inbox:
+    """Handler de aiosmtpd: guarda los mensajes y rechaza los destinatarios de `refuse`."""
+
+    def __init__(self):
+        self.messages = []
+        self.peers = set()
+        # Destinatario -> respuesta SMTP con la que se rechaza
+        self.refuse = {}
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.refuse:
+            return self.refuse[address]
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.peers.add(session.peer)
+        self.messages.append(email.message_from_bytes(envelope.content, policy=policy.default))
+        return "250 Message accepted for delivery"
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture
+def smtp_server():
+    inbox = Inbox()
+    inbox.port = free_port()
+    inbox.controller = Controller(inbox, hostname="127.0.0.1", port=inbox.port)
+    inbox.controller.start()
+    yield inbox
+    inbox.controller.stop()
+
+@pytest.fixture
+def pool(smtp_server):
+    pool = SMTPConnectionPool(host="127.0.0.1", port=smtp_server.port, user=None, password=None,
+                              use_ssl=False, starttls=False, size=2, timeout=5)
+    yield pool
+    pool.close()
+
+def message(number, recipient="aprobador@example.com"):
+    return build_message(f"Prueba #{number}", SENDER, recipient, f"<p>Mensaje {number}</p>", f"Mensaje {number}")
+
+# -------------------------------------------------------------------------
+# CONFIGURACIÓN
+# -------------------------------------------------------------------------
+
+def test_login_sender_and_port_come_from_one_account(tmp_path):
+    # La configuración se lee al importar: se comprueba en un intérprete nuevo
+    env = {
+        key: value for key, value in os.environ.items()
+        if not key.startswith(("SMTP_", "MAIL_", "EMAIL_"))
+    }
+    env.update(EMAIL_USER="facturas@example.com", EMAIL_PASSWORD="secreto",
+               MAIL_USERNAME="otro@example.com", MAIL_PORT="465",
+               PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    script = """
+import json, datetime, types
+import mailer, notification_dispatcher as nd, notification_service
+pool = nd.SMTPConnectionPool()
+sent = []
+mailer.send_message = sent.append
+invoice = types.SimpleNamespace(id=1, invoice_number="F-1", provider_name="ACME", issue_date=datetime.date(2025, 1, 1),
+                                due_date=None, total_amount=10.0, taxes=1.6)
+mailer.BASE_URL = "http://localhost"
+mailer.send_invoice_notification(invoice, "aprobador@example.com")
+print(json.dumps({
+    "user": pool.user, "port": pool.port, "ssl": pool.use_ssl, "starttls": pool.starttls,
+    "mailer_from": sent[0]["From"],
+    "approval_from": notification_service.build_approval_message("a@example.com", [invoice])["From"],
+}))
+"""
+    output = subprocess.run(
+        [sys.executable, "-c", script], env=env, cwd=tmp_path, check=True, capture_output=True, text=True,
+    ).stdout
+    config = json.loads(output.strip().splitlines()[-1])
+
+    assert config == {
+        "user": "facturas@example.com", "port": 587, "ssl": False, "starttls": True,
+        "mailer_from": "facturas@example.com", "approval_from": "facturas@example.com",
+    }
+
+# -------------------------------------------------------------------------
+# POOL DE CONEXIONES
+# -------------------------------------------------------------------------
+
+def test_pool_reuses_its_connections(smtp_server, pool):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda number: send_message(message(number), pool), range(20)))
+
+    assert sorted(m["Subject"] for m in smtp_server.messages) == sorted(f"Prueba #{n}" for n in range(20))
+    assert pool.opened <= pool.size
+    assert len(smtp_server.peers) == pool.opened
+
+def test_pool_replaces_a_connection_the_server_dropped(smtp_server, pool):
+    pool.idle_check = 0
+    send_message(message(1), pool)
+    # Reiniciar el servidor corta la conexión ociosa del pool
+    smtp_server.controller.stop()
+    smtp_server.controller = Controller(smtp_server, hostname="127.0.0.1", port=smtp_server.port)
+    smtp_server.controller.start()
+
+    send_message(message(2), pool)
+
+    assert [m["Subject"] for m in smtp_server.messages] == ["Prueba #1", "Prueba #2"]
+    assert pool.opened == 2
+
+# -------------------------------------------------------------------------
+# RELAY DEL OUTBOX
+# -------------------------------------------------------------------------
+
+@pytest.fixture
+def sender(monkeypatch):
+    monkeypatch.setattr(notification_service, "EMAIL_USER", SENDER)
+
+def deliver(db, pool):
+    return deliver_batch(db, pool, claim_batch(db))
+
+def test_relay_sends_one_digest_per_recipient(db, make_invoice, smtp_server, pool, sender):
+    pending = [make_invoice(), make_invoice()]
+    decided = make_invoice(status=STATUS_APROBADO)
+    for invoice in pending + [decided]:
+        add_approval_notifications(db, invoice.id, ["ana@example.com", "luis@example.com"])
+    db.commit()
+
+    counts = deliver(db, pool)
+
+    assert counts[OUTBOX_ENVIADO] == 4 and counts[OUTBOX_DESCARTADO] == 2
+    received = {m["To"]: m for m in smtp_server.messages}
+    assert sorted(received) == ["ana@example.com", "luis@example.com"]
+    for recipient, received_message in received.items():
+        assert received_message["From"] == SENDER
+        assert "2 Facturas" in received_message["Subject"]
+        body = received_message.get_body(("plain",)).get_content()
+        assert all(invoice.invoice_number in body for invoice in pending)
+        assert decided.invoice_number not in body
+        entries = db.query(OutboxMessage).filter(
+            OutboxMessage.recipient == recipient, OutboxMessage.state == OUTBOX_ENVIADO
+        ).all()
+        assert {entry.message_id for entry in entries} == {received_message["Message-ID"]}
+
+def test_relay_retries_transient_refusals_and_fails_permanent_ones(db, make_invoice, smtp_server, pool, sender):
+    smtp_server.refuse = {
+        "ocupado@example.com": "451 4.3.0 Inténtelo más tarde",
+        "inexistente@example.com": "550 5.1.1 Usuario desconocido",
+    }
+    invoice = make_invoice()
+    add_approval_notifications(db, invoice.id, ["ocupado@example.com", "inexistente@example.com", "ana@example.com"])
+    db.commit()
+
+    counts = deliver(db, pool)
+
+    assert counts == {OUTBOX_ENVIADO: 1, OUTBOX_PENDIENTE: 1, OUTBOX_FALLIDO: 1, OUTBOX_DESCARTADO: 0}
+    assert [m["To"] for m in smtp_server.messages] == ["ana@example.com"]
+    entries = {entry.recipient: entry for entry in db.query(OutboxMessage)}
+    retry = entries["ocupado@example.com"]
+    assert (retry.state, retry.attempts) == (OUTBOX_PENDIENTE, 1)
+    assert retry.next_attempt_at > datetime.utcnow()
+    assert entries["inexistente@example.com"].state == OUTBOX_FALLIDO
+
+    # El servidor vuelve a aceptar al destinatario: el reintento se entrega
+    smtp_server.refuse = {}
+    retry.next_attempt_at = datetime.utcnow()
+    db.commit()
+    assert deliver(db, pool)[OUTBOX_ENVIADO] == 1
+    assert [m["To"] for m in smtp_server.messages] == ["ana@example.com", "ocupado@example.com"]
@@ -0,0 +1,88 @@
+# tests/test_ocr_cache.py
+
+import os
+import time
+
+import pytest
+
+import ocr_cache
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """Caché vacía en un directorio temporal, con el recuento de recorridos del directorio."""
+    monkeypatch.setattr(ocr_cache, "OCR_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(ocr_cache, "OCR_CACHE_ENABLED", True)
+    monkeypatch.setattr(ocr_cache, "_cache_bytes", None)
+    scans = []
+    iter_entries = ocr_cache._iter_entries
+    monkeypatch.setattr(ocr_cache, "_iter_entries", lambda: scans.append(1) or iter_entries())
+    return scans
+
+def test_store_does_not_walk_the_cache_on_every_write(cache, monkeypatch):
+    monkeypatch.setattr(ocr_cache, "OCR_CACHE_MAX_BYTES", 10 ** 6)
+    for page in range(200):
+        ocr_cache.store_text("a" * 64, "spa", page, "5.3", "x" * 100)
+
+    # Solo la medición inicial
+    assert len(cache) == 1
+    assert ocr_cache._cache_bytes == 200 * 100
+    assert ocr_cache.get_cached_text("a" * 64, "spa", 199, "5.3") == "x" * 100
+
+def test_store_evicts_least_recently_used_when_over_the_limit(cache, monkeypatch):
+    monkeypatch.setattr(ocr_cache, "OCR_CACHE_MAX_BYTES", 1000)
+    for page in range(10):
+        ocr_cache.store_text("b" * 64, "spa", page, "5.3", "y" * 100)
+    assert len(cache) == 1
+
+    ocr_cache.store_text("b" * 64, "spa", 10, "5.3", "y" * 100)
+
+    assert len(cache) == 2
+    assert ocr_cache.cache_stats()["bytes"] <= 1000 * ocr_cache.OCR_CACHE_EVICT_TO
+    assert ocr_cache.get_cached_text("b" * 64, "spa", 10, "5.3") is not None
+
+def test_rewriting_an_entry_counts_only_the_size_difference(cache, monkeypatch):
+    monkeypatch.setattr(ocr_cache, "OCR_CACHE_MAX_BYTES", 10 ** 6)
+    ocr_cache.store_text("c" * 64, "spa", 0, "5.3", "z" * 100)
+    ocr_cache.store_text("c" * 64, "spa", 0, "5.3", "z" * 40)
+    assert ocr_cache._cache_bytes == 40
+
+def store_aged(file_hash, page, text, age):
+    """Guarda una entrada con su fecha de último uso `age` segundos en el pasado."""
+    ocr_cache.store_text(file_hash, "spa", page, "5.3", text)
+    path = ocr_cache._entry_path(ocr_cache.cache_key(file_hash, "spa", page, "5.3"))
+    timestamp = time.time() - age
+    os.utime(path, (timestamp, timestamp))
+
+def test_eviction_keeps_recently_read_entries_and_the_size_in_step(cache, monkeypatch):
+    monkeypatch.setattr(ocr_cache, "OCR_CACHE_MAX_BYTES", 1000)
+    for page in range(10):
+        store_aged("d" * 64, page, "w" * 100, age=1000 - page)
+    # Leer la entrada más antigua la convierte en la más reciente
+    assert ocr_cache.get_cached_text("d" * 64, "spa", 0, "5.3") is not None
+
+    ocr_cache.store_text("d" * 64, "spa", 10, "5.3", "w" * 100)
+
+    # 1100 bytes: se desalojan las dos menos usadas hasta quedar en el 90 % del límite
+    cached = [page for page in range(11) if ocr_cache.get_cached_text("d" * 64, "spa", page, "5.3") is not None]
+    assert cached == [0] + list(range(3, 11))
+    assert ocr_cache._cache_bytes == ocr_cache.cache_stats()["bytes"] == 900
+
+def test_periodic_rescan_picks_up_entries_written_by_other_processes(cache, monkeypatch):
+    monkeypatch.setattr(ocr_cache, "OCR_CACHE_MAX_BYTES", 10 ** 6)
+    monkeypatch.setattr(ocr_cache, "OCR_CACHE_RESCAN_EVERY", 3)
+    ocr_cache.store_text("e" * 64, "spa", 0, "5.3", "v" * 100)
+    # Otro worker escribe en el mismo directorio
+    path = ocr_cache._entry_path(ocr_cache.cache_key("f" * 64, "spa", 0, "5.3"))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("u" * 500)
+
+    for page in range(1, 4):
+        ocr_cache.store_text("e" * 64, "spa", page, "5.3", "v" * 100)
+    assert ocr_cache._cache_bytes == 400
+
+    # La escritura número OCR_CACHE_RESCAN_EVERY + 1 vuelve a medir el directorio
+    ocr_cache.store_text("e" * 64, "spa", 4, "5.3", "v" * 100)
+
+    assert len(cache) == 2
+    assert ocr_cache._cache_bytes == ocr_cache.cache_stats()["bytes"] == 1000
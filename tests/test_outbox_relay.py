@@ -0,0 +1,12 @@
+# tests/test_outbox_relay.py
+
+import pytest
+
+import outbox_relay
+
+def test_relay_refuses_to_start_without_a_sender(monkeypatch):
+    monkeypatch.setattr(outbox_relay, "EMAIL_USER", None)
+    monkeypatch.setattr(outbox_relay, "check_schema", lambda: pytest.fail("el relay arrancó sin EMAIL_USER"))
+
+    with pytest.raises(RuntimeError, match="EMAIL_USER"):
+        outbox_relay.relay_loop(once=True)
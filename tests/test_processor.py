@@ -0,0 +1,183 @@
+# tests/test_processor.py
+
+import io
+import time
+import types
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+import processor
+
+class FakeTessAPI:
+    """Sustituto de tesserocr.PyTessBaseAPI que cuenta las instancias creadas."""
+    created = 0
+    lock = threading.Lock()
+
+    def __init__(self, lang):
+        with FakeTessAPI.lock:
+            FakeTessAPI.created += 1
+        self.image = None
+
+    def SetImage(self, image):
+        self.image = image
+
+    def GetUTF8Text(self):
+        return f"texto {self.image}"
+
+    def Clear(self):
+        self.image = None
+
+class FakeTesserocr:
+    PyTessBaseAPI = FakeTessAPI
+
+def test_tesserocr_engines_are_shared_across_threads(monkeypatch):
+    monkeypatch.setattr(processor, "tesserocr", FakeTesserocr)
+    FakeTessAPI.created = 0
+    backend = processor.TesserocrOCRBackend(max_engines=2)
+    results = []
+
+    def recognize(index):
+        results.append(backend.image_to_string(index))
+
+    # Cada petición de Flask llega en un hilo nuevo
+    for batch in range(5):
+        threads = [threading.Thread(target=recognize, args=(batch * 4 + i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert sorted(results) == sorted(f"texto {i}" for i in range(20))
+    assert FakeTessAPI.created <= 2
+
+def test_pdf_pages_share_one_executor():
+    executors = set()
+    threads = [threading.Thread(target=lambda: executors.add(processor.get_ocr_executor())) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(executors) == 1
+
+@pytest.fixture
+def pdf_pages(monkeypatch):
+    """PDF de 5 páginas; registra las páginas reconocidas y cuántas se reconocían a la vez."""
+    recognized, running, lock = [], [0, 0], threading.Lock()
+    monkeypatch.setattr(processor, "pdf_page_count_from_bytes", lambda pdf_bytes: 5)
+
+    def ocr_pdf_page(file_path, page, file_hash=None, pdf_bytes=None):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+            recognized.append(page)
+        return f"página {page}"
+
+    monkeypatch.setattr(processor, "ocr_pdf_page", ocr_pdf_page)
+    # Pool propio: el del proceso tiene tantos hilos como CPUs
+    executor = ThreadPoolExecutor(max_workers=5)
+    monkeypatch.setattr(processor, "get_ocr_executor", lambda: executor)
+    yield types.SimpleNamespace(recognized=recognized, max_running=lambda: running[1])
+    executor.shutdown()
+
+def test_pdf_pages_are_recognized_in_parallel_and_joined_in_order(pdf_pages):
+    text, processed, total = processor.ocr_pdf("f.pdf", pdf_bytes=b"%PDF", stop_early=False, threads=5)
+
+    assert (processed, total) == (5, 5)
+    assert sorted(pdf_pages.recognized) == list(range(5))
+    assert pdf_pages.max_running() > 1
+    # El texto sigue el orden de las páginas, no el de terminación
+    assert text == "\n".join(f"página {page}" for page in range(5))
+
+def test_pdf_pages_respect_the_page_limit_and_stop_early(pdf_pages, monkeypatch):
+    assert processor.ocr_pdf("f.pdf", pdf_bytes=b"%PDF", max_pages=3, stop_early=False, threads=2)[1:] == (3, 5)
+
+    # Con todos los campos encontrados en el primer lote no se renderizan más páginas
+    monkeypatch.setattr(processor, "missing_required_fields", lambda extracted_data: [])
+    pdf_pages.recognized.clear()
+    assert processor.ocr_pdf("f.pdf", pdf_bytes=b"%PDF", stop_early=True, threads=2)[1:] == (2, 5)
+    assert sorted(pdf_pages.recognized) == [0, 1]
+
+class FakeOCRBackend:
+    """Backend de OCR que devuelve el tamaño de la imagen recibida."""
+
+    def image_to_string(self, image):
+        return f"imagen {image.size[0]}x{image.size[1]}"
+
+def test_uploaded_images_are_processed_without_temporary_files(monkeypatch):
+    monkeypatch.setattr(processor, "get_ocr_backend", lambda: FakeOCRBackend())
+    monkeypatch.setattr(processor, "get_engine_version", lambda: "fake")
+    for name in ("NamedTemporaryFile", "TemporaryFile", "SpooledTemporaryFile", "mkstemp", "mkdtemp"):
+        monkeypatch.setattr(tempfile, name, lambda *args, **kwargs: pytest.fail("se creó un archivo temporal"))
+    png = io.BytesIO()
+    Image.new("RGB", (120, 80), "white").save(png, "PNG")
+
+    # La ruta no existe: solo se usa para el tipo y el log
+    result = processor.process_invoice_file("no-existe/factura.png", file_bytes=png.getvalue())
+
+    assert result["error"] is None
+    assert result["text"].startswith("imagen ")
+
+def test_pdf_pages_are_rendered_through_pipes(monkeypatch):
+    page = io.BytesIO()
+    Image.new("RGB", (30, 20), "white").save(page, "PPM")
+    calls = []
+
+    def run(command, input=None, **kwargs):
+        calls.append((command, input))
+        return subprocess.CompletedProcess(command, 0, stdout=page.getvalue())
+
+    monkeypatch.setattr(processor.subprocess, "run", run)
+
+    image = processor.render_pdf_page_from_bytes(b"%PDF-1.4 ...", 2)
+
+    assert image.size == (30, 20)
+    command, stdin = calls[0]
+    # PDF por stdin y página por stdout ("-"): ningún archivo intermedio
+    assert stdin == b"%PDF-1.4 ..."
+    assert command[-1] == "-" and command[1:5] == ["-f", "3", "-l", "3"]
+
+def test_digital_pdfs_use_their_text_layer_and_scans_fall_back_to_ocr(monkeypatch):
+    ocr_calls = []
+    def ocr_pdf(file_path, file_hash=None, pdf_bytes=None):
+        ocr_calls.append(file_path)
+        return "texto del OCR", 1, 1
+    monkeypatch.setattr(processor, "ocr_pdf", ocr_pdf)
+
+    layer = "Factura N° A-1001 emitida por ACME S.A. " * 5
+    monkeypatch.setattr(processor, "extract_pdf_text_layer", lambda file_path, pdf_bytes=None: layer)
+    result = processor.process_invoice_file("digital.pdf", file_hash="d" * 64, file_bytes=b"%PDF")
+    assert (result["text_source"], result["text"], ocr_calls) == (processor.TEXT_SOURCE_PDF, layer, [])
+
+    # Escaneo con una capa de texto casi vacía
+    monkeypatch.setattr(processor, "extract_pdf_text_layer", lambda file_path, pdf_bytes=None: " 1 \n")
+    result = processor.process_invoice_file("escaneo.pdf", file_hash="e" * 64, file_bytes=b"%PDF")
+    assert (result["text_source"], result["text"], ocr_calls) == (processor.TEXT_SOURCE_OCR, "texto del OCR", ["escaneo.pdf"])
+
+    # Sin pdftotext instalado
+    def missing_pdftotext(file_path, pdf_bytes=None):
+        raise FileNotFoundError("pdftotext")
+    monkeypatch.setattr(processor, "extract_pdf_text_layer", missing_pdftotext)
+    assert processor.process_invoice_file("otro.pdf", file_hash="f" * 64, file_bytes=b"%PDF")["text_source"] == processor.TEXT_SOURCE_OCR
+
+INVOICE_TEXT = "ACME S.A.\nFactura N°: A-1001\nFecha: 10/03/2025\nIVA: 16.00\nTotal: 116.00\n"
+
+def test_extraction_log_levels(monkeypatch):
+    debug = processor.process_invoice_text(INVOICE_TEXT, log_level=processor.EXTRACTION_LOG_DEBUG)
+    assert "=== DEBUG OCR TEXT ===" in debug["log"] and "--- Texto Extraído" in debug["log"]
+
+    # Por debajo de debug el análisis del texto ni siquiera se calcula
+    monkeypatch.setattr(processor, "debug_ocr_text", lambda *args: pytest.fail("se calculó el debug"))
+    summary = processor.process_invoice_text(INVOICE_TEXT, log_level=processor.EXTRACTION_LOG_SUMMARY)
+    off = processor.process_invoice_text(INVOICE_TEXT, log_level=processor.EXTRACTION_LOG_OFF)
+
+    assert summary["log"] and "Texto Extraído" not in summary["log"]
+    assert off["log"] is None
+    assert summary["data"] == off["data"] == debug["data"]
@@ -0,0 +1,49 @@
+# tests/test_profiling.py
+
+import pytest
+
+import profiling
+from profiling import RequestProfile, profiling_requested, PROFILE_HEADER
+
+@pytest.fixture
+def admin_token(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_ADMIN_TOKEN", "s3cret")
+    return "s3cret"
+
+def test_only_the_admin_token_enables_profiling(admin_token):
+    assert profiling_requested("upload_invoice", {PROFILE_HEADER: admin_token}, enabled=False)
+    assert not profiling_requested("upload_invoice", {PROFILE_HEADER: "s3cre"}, enabled=False)
+    assert not profiling_requested("upload_invoice", {PROFILE_HEADER: ""}, enabled=False)
+    assert not profiling_requested("upload_invoice", {}, enabled=False)
+    # Ni con el token ni con el flag global se perfilan otros endpoints
+    assert not profiling_requested("metrics_endpoint", {PROFILE_HEADER: admin_token}, enabled=True)
+    assert profiling_requested("webhook_handler", {}, enabled=True)
+
+def test_without_a_configured_token_no_header_enables_profiling(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_ADMIN_TOKEN", "")
+    assert not profiling_requested("upload_invoice", {PROFILE_HEADER: ""}, enabled=False)
+    assert not profiling_requested("upload_invoice", {PROFILE_HEADER: "cualquiera"}, enabled=False)
+
+def test_one_profiled_request_at_a_time(tmp_path):
+    profile = RequestProfile.start("webhook_handler")
+    assert profile is not None
+    assert RequestProfile.start("webhook_handler") is None
+
+    base = profile.stop(invoice_id=7, directory=str(tmp_path))
+
+    assert sorted(path.suffix for path in tmp_path.iterdir()) == [".collapsed", ".pstats", ".svg"]
+    assert base.startswith(str(tmp_path / "factura-7-webhook_handler-"))
+    # El lock se libera al guardar
+    RequestProfile.start("webhook_handler").stop(directory=str(tmp_path))
+
+@pytest.mark.parametrize("engine", ["sqlite"], indirect=True)
+def test_requests_with_the_token_are_profiled(client, make_invoice, admin_token, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    invoice = make_invoice()
+    url = f"/api/v1/invoice/webhook?invoice_id={invoice.id}&action=approve"
+
+    assert "X-Profile" not in client.get(url, headers={PROFILE_HEADER: "otro"}).headers
+    response = client.get(url, headers={PROFILE_HEADER: admin_token})
+
+    assert response.headers["X-Profile"].startswith(f"factura-{invoice.id}-webhook_handler-")
+    assert (tmp_path / profiling.PROFILE_DIR / (response.headers["X-Profile"] + ".pstats")).exists()
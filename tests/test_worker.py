@@ -0,0 +1,121 @@
+# tests/test_worker.py
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import worker
+from database import (
+    Invoice, InvoiceEvent, OutboxMessage, JOB_EN_COLA, JOB_PROCESANDO, JOB_COMPLETADO, JOB_FALLIDO,
+    STATUS_EN_PROCESO, STATUS_RECHAZADO, OUTBOX_DESCARTADO, OUTBOX_PENDIENTE, add_approval_notifications
+)
+
+@pytest.fixture
+def local_time_ahead_of_utc(monkeypatch):
+    """Zona horaria local UTC+5: datetime.now() y datetime.utcnow() difieren."""
+    monkeypatch.setenv("TZ", "Etc/GMT-5")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+def test_claim_records_a_heartbeat(db, make_invoice, local_time_ahead_of_utc):
+    job = make_invoice(job_status=JOB_EN_COLA, status=None, invoice_number=None)
+
+    assert worker.claim_next_job(db) == job.id
+    db.expire_all()
+    claimed = db.get(Invoice, job.id)
+    assert claimed.job_status == JOB_PROCESANDO
+    assert datetime.utcnow() - claimed.job_heartbeat_at < timedelta(minutes=1)
+    # La reserva se fecha con el mismo reloj (UTC) que usa requeue_stale_jobs
+    assert abs(datetime.utcnow() - claimed.last_updated) < timedelta(minutes=1)
+    assert worker.claim_next_job(db) is None
+
+def test_requeue_only_touches_jobs_without_a_recent_heartbeat(db, make_invoice):
+    now = datetime.utcnow()
+    alive = make_invoice(job_status=JOB_PROCESANDO, status=None, invoice_number=None, job_heartbeat_at=now)
+    stale = make_invoice(job_status=JOB_PROCESANDO, status=None, invoice_number=None,
+                         job_heartbeat_at=now - timedelta(seconds=worker.JOB_STALE_AFTER + 60))
+    # Reservado por una versión anterior (sin señal de vida): cuenta la fecha de la reserva
+    legacy = make_invoice(job_status=JOB_PROCESANDO, status=None, invoice_number=None,
+                          last_updated=now - timedelta(days=1))
+
+    assert worker.requeue_stale_jobs(db) == 2
+    db.expire_all()
+    assert db.get(Invoice, alive.id).job_status == JOB_PROCESANDO
+    assert db.get(Invoice, stale.id).job_status == JOB_EN_COLA
+    assert db.get(Invoice, legacy.id).job_status == JOB_EN_COLA
+    # La vuelta a la cola se anuncia en el stream como los demás cambios del trabajo
+    events = db.query(InvoiceEvent.invoice_id, InvoiceEvent.job_status).all()
+    assert sorted(events) == sorted([(stale.id, JOB_EN_COLA), (legacy.id, JOB_EN_COLA)])
+
+@pytest.mark.parametrize("engine", ["sqlite"], indirect=True)
+def test_heartbeat_renews_while_the_job_runs(db, make_invoice):
+    old = datetime.utcnow() - timedelta(hours=1)
+    job = make_invoice(job_status=JOB_PROCESANDO, status=None, invoice_number=None, job_heartbeat_at=old)
+
+    with worker.JobHeartbeat(job.id, interval=0.05):
+        import time
+        time.sleep(0.3)
+
+    db.expire_all()
+    assert db.get(Invoice, job.id).job_heartbeat_at > old
+    assert worker.requeue_stale_jobs(db) == 0
+
+# -------------------------------------------------------------------------
+# RE-EXTRACCIÓN DESDE LA CACHÉ DE OCR
+# -------------------------------------------------------------------------
+
+@pytest.fixture
+def extraction(monkeypatch):
+    """Resultado de extracción por file_hash (el texto en caché es el propio hash)."""
+    results = {}
+    monkeypatch.setattr(worker, "get_cached_document_text", lambda file_hash: file_hash if file_hash in results else None)
+    monkeypatch.setattr(worker, "process_invoice_text", lambda text: {"data": dict(results[text]), "log": "", "text": text})
+    monkeypatch.setattr(worker, "APPROVER_EMAILS", ["ana@example.com"])
+    return results
+
+@pytest.mark.parametrize("engine", ["sqlite"], indirect=True)
+def test_reextract_leaves_jobs_of_the_ocr_pool_alone(db, make_invoice, extraction):
+    jobs = {
+        job_status: make_invoice(file_hash=job_status * 8, job_status=job_status, status=None, invoice_number=None)
+        for job_status in (JOB_EN_COLA, JOB_PROCESANDO, JOB_FALLIDO)
+    }
+    done = make_invoice(file_hash="done", status=STATUS_RECHAZADO)
+    for file_hash in [invoice.file_hash for invoice in jobs.values()] + ["done"]:
+        extraction[file_hash] = {"invoice_number": f"RE-{file_hash}", "status": STATUS_EN_PROCESO}
+
+    assert worker.reextract_invoices() == (1, 0)
+    db.expire_all()
+    assert all(db.get(Invoice, job.id).status is None for job in jobs.values())
+    assert db.get(Invoice, done.id).invoice_number == "RE-done"
+
+@pytest.mark.parametrize("engine", ["sqlite"], indirect=True)
+def test_reextract_does_not_assign_a_number_twice_in_a_batch(db, make_invoice, extraction):
+    first = make_invoice(file_hash="one", invoice_number="OLD-1")
+    second = make_invoice(file_hash="two", invoice_number="OLD-2")
+    extraction["one"] = extraction["two"] = {"invoice_number": "NEW-1", "status": STATUS_EN_PROCESO}
+
+    assert worker.reextract_invoices() == (2, 0)
+    db.expire_all()
+    assert (db.get(Invoice, first.id).invoice_number, db.get(Invoice, second.id).invoice_number) == ("NEW-1", "OLD-2")
+
+@pytest.mark.parametrize("engine", ["sqlite"], indirect=True)
+def test_reextract_announces_status_changes(db, make_invoice, extraction):
+    reopened = make_invoice(file_hash="reopened", status=STATUS_RECHAZADO)
+    # Ya se pidió su aprobación antes, pero se descartó al rechazarse
+    add_approval_notifications(db, reopened.id, ["ana@example.com"])
+    db.query(OutboxMessage).update({OutboxMessage.state: OUTBOX_DESCARTADO})
+    db.commit()
+    unchanged = make_invoice(file_hash="unchanged")
+    extraction["reopened"] = {"invoice_number": reopened.invoice_number, "status": STATUS_EN_PROCESO}
+    extraction["unchanged"] = {"invoice_number": unchanged.invoice_number, "status": STATUS_EN_PROCESO}
+
+    assert worker.reextract_invoices() == (2, 0)
+    events = db.query(InvoiceEvent).all()
+    assert [(event.invoice_id, event.status, event.job_status) for event in events] == [
+        (reopened.id, STATUS_EN_PROCESO, JOB_COMPLETADO)
+    ]
+    outbox = db.query(OutboxMessage).one()
+    assert (outbox.invoice_id, outbox.recipient, outbox.state) == (reopened.id, "ana@example.com", OUTBOX_PENDIENTE)
@@ -0,0 +1,93 @@
+# upload_stream.py
+
+"""
+Recepción de archivos subidos en streaming.
+
+Werkzeug escribe cada archivo del formulario multipart por trozos a medida
+que llega el cuerpo de la petición. Aquí ese destino es un UploadSpool que,
+en el mismo recorrido, calcula el SHA-256 y comprueba los bytes mágicos del
+primer trozo: un archivo que no es PDF, PNG ni JPEG se rechaza (415) sin
+leer el resto del cuerpo, y nunca llega a pdf2image ni a Tesseract. El
+tamaño total lo limita MAX_CONTENT_LENGTH (413) en la configuración de Flask.
+"""
+
+import os
+import hashlib
+import tempfile
+from flask import Request
+from werkzeug.exceptions import UnsupportedMediaType
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Bytes que se mantienen en memoria antes de pasar el archivo a disco
+UPLOAD_SPOOL_MEMORY = int(os.environ.get("UPLOAD_SPOOL_MEMORY_KB", 1024)) * 1024
+
+# Firmas de los tipos admitidos: (prefijo, extensión normalizada)
+MAGIC_SIGNATURES = (
+    (b"%PDF-", "pdf"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+)
+MAGIC_BYTES_NEEDED = max(len(signature) for signature, _ in MAGIC_SIGNATURES)
+
+def sniff_file_type(head):
+    """Tipo del archivo según sus primeros bytes ('pdf', 'png', 'jpg') o None."""
+    for signature, file_type in MAGIC_SIGNATURES:
+        if head.startswith(signature):
+            return file_type
+    return None
+
+class UploadSpool:
+    """
+    Destino de un archivo de la subida: lo guarda (en memoria o, si es
+    grande, en un temporal), lo hashea y verifica su tipo mientras se escribe.
+    """
+
+    def __init__(self, filename=None, max_memory=UPLOAD_SPOOL_MEMORY):
+        self.filename = filename
+        self.file_type = None
+        self.size = 0
+        self._head = b""
+        self._sha256 = hashlib.sha256()
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory)
+
+    def write(self, data):
+        if self.file_type is None and len(self._head) < MAGIC_BYTES_NEEDED:
+            self._head += data[:MAGIC_BYTES_NEEDED]
+            if len(self._head) >= MAGIC_BYTES_NEEDED:
+                self._check_type()
+        self._sha256.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def _check_type(self):
+        self.file_type = sniff_file_type(self._head)
+        if self.file_type is None:
+            raise UnsupportedMediaType(
+                f"El contenido de '{self.filename}' no es un PDF, PNG ni JPEG."
+            )
+
+    def finish(self):
+        """Completa la verificación (archivos más cortos que la firma) y vuelve al inicio."""
+        if self.file_type is None:
+            self._check_type()
+        self._file.seek(0)
+        return self
+
+    @property
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+    # Interfaz de archivo que usa FileStorage (read, seek, save, close...)
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+class StreamingUploadRequest(Request):
+    """Petición de Flask cuyos archivos subidos se reciben en un UploadSpool."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadSpool(filename)
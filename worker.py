@@ -0,0 +1,364 @@
+# worker.py
+
+import os
+import time
+import logging
+import argparse
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+from sqlalchemy import func, or_, update
+from sqlalchemy.exc import IntegrityError
+from dotenv import load_dotenv
+
+# Módulos del Proyecto
+from database import (
+    Engine,
+    SessionLocal,
+    Invoice,
+    check_schema,
+    fill_invoice_from_result,
+    add_approval_notifications,
+    add_invoice_event,
+    add_invoice_events,
+    STATUS_EN_PROCESO,
+    STATUS_RECHAZADO,
+    JOB_EN_COLA,
+    JOB_PROCESANDO,
+    JOB_COMPLETADO,
+    JOB_FALLIDO
+)
+from processor import process_invoice_file, process_invoice_text, get_cached_document_text
+from notification_service import APPROVER_EMAILS
+from metrics import STAGE_SECONDS, REJECTIONS, start_metrics_server
+from log_config import configure_logging
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Configuración del pool de OCR (número de procesos y espera entre sondeos)
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", 2))
+POLL_INTERVAL = float(os.environ.get("OCR_POLL_INTERVAL", 1.0))
+# Señal de vida de los trabajos 'Procesando' (segundos) y antigüedad a partir de la cual
+# se consideran abandonados (proceso caído) y vuelven a la cola
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get("OCR_JOB_HEARTBEAT_INTERVAL", 30))
+JOB_STALE_AFTER = float(os.environ.get("OCR_JOB_STALE_AFTER", 300))
+
+# -------------------------------------------------------------------------
+# GESTIÓN DE LA COLA PERSISTENTE (tabla invoices)
+# -------------------------------------------------------------------------
+
+def claim_next_job(db):
+    """
+    Reserva el siguiente trabajo en cola de forma atómica.
+
+    El UPDATE condicionado al estado 'En Cola' garantiza que dos procesos
+    no tomen el mismo trabajo.
+    :return: ID de la factura reservada o None si la cola está vacía.
+    """
+    while True:
+        row = db.query(Invoice.id).filter(Invoice.job_status == JOB_EN_COLA).order_by(Invoice.id).first()
+        if row is None:
+            return None
+
+        claimed = db.query(Invoice).filter(
+            Invoice.id == row.id,
+            Invoice.job_status == JOB_EN_COLA
+        ).update({
+            Invoice.job_status: JOB_PROCESANDO,
+            Invoice.job_heartbeat_at: datetime.utcnow(),
+            Invoice.last_updated: datetime.utcnow()
+        }, synchronize_session=False)
+        if claimed:
+            add_invoice_event(db, row.id, None, JOB_PROCESANDO)
+        db.commit()
+
+        if claimed:
+            return row.id
+        # Otro proceso lo tomó primero: intenta con el siguiente
+
+def requeue_stale_jobs(db, stale_after=JOB_STALE_AFTER):
+    """
+    Devuelve a la cola los trabajos 'Procesando' cuya señal de vida tiene más
+    de `stale_after` segundos (el proceso que los tenía se cayó). Los que
+    siguen en curso en otros procesos u hosts renuevan la señal y no se tocan.
+    Cada trabajo devuelto a la cola se anuncia en el stream de eventos.
+    """
+    # job_heartbeat_at y last_updated se escriben en UTC, como el corte
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_after)
+    requeued = db.execute(
+        update(Invoice)
+        .where(
+            Invoice.job_status == JOB_PROCESANDO,
+            # Trabajos reservados antes de job_heartbeat_at: cuenta la fecha de la reserva
+            func.coalesce(Invoice.job_heartbeat_at, Invoice.last_updated) < cutoff
+        )
+        .values(job_status=JOB_EN_COLA, job_heartbeat_at=None, last_updated=datetime.utcnow())
+        .returning(Invoice.id, Invoice.status, Invoice.job_status)
+    ).all()
+    add_invoice_events(db, [(row.id, row.status, row.job_status) for row in requeued])
+    db.commit()
+    return len(requeued)
+
+class JobHeartbeat:
+    """
+    Hilo que renueva job_heartbeat_at del trabajo en curso cada `interval`
+    segundos mientras dura el OCR, con su propia sesión.
+    """
+
+    def __init__(self, invoice_id, interval=JOB_HEARTBEAT_INTERVAL):
+        self.invoice_id = invoice_id
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"job-heartbeat-{invoice_id}", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            db = SessionLocal()
+            try:
+                db.query(Invoice).filter(
+                    Invoice.id == self.invoice_id,
+                    Invoice.job_status == JOB_PROCESANDO
+                ).update({Invoice.job_heartbeat_at: datetime.utcnow()}, synchronize_session=False)
+                db.commit()
+            except Exception:
+                logger.exception("No se pudo renovar la señal de vida del trabajo", extra={"invoice_id": self.invoice_id})
+            finally:
+                db.close()
+
+def fail_job(db, invoice, error, log=None):
+    """Marca el trabajo como fallido (la factura queda rechazada) y lo confirma."""
+    invoice.job_status = JOB_FALLIDO
+    invoice.job_error = error
+    invoice.status = STATUS_RECHAZADO
+    invoice.extraction_log = log
+    add_invoice_event(db, invoice.id, invoice.status, invoice.job_status)
+    db.commit()
+    return invoice
+
+def run_job(db, invoice_id):
+    """
+    Ejecuta el OCR y la extracción de un trabajo reservado y guarda el resultado
+    en el mismo registro de la factura.
+    """
+    invoice = db.query(Invoice).filter(Invoice.id == invoice_id).first()
+    if invoice is None:
+        return None
+
+    file_path = invoice.file_path
+    # Cierra la transacción de lectura antes del OCR: en SQLite, una lectura abierta
+    # no podría escribir después de que JobHeartbeat confirme sus cambios
+    db.commit()
+    with JobHeartbeat(invoice_id), STAGE_SECONDS.time(stage="process_file"):
+        processing_result = process_invoice_file(file_path, invoice.file_hash)
+    extraction_error = processing_result.get("error")
+
+    try:
+        if extraction_error:
+            return fail_job(db, invoice, f"Fallo al procesar el archivo por error de OCR: {extraction_error}",
+                            processing_result.get("log"))
+
+        fill_invoice_from_result(invoice, processing_result)
+        invoice.job_status = JOB_COMPLETADO
+        invoice.job_error = None
+        invoice.file_path = None
+
+        # Si el estado es "En Proceso", la notificación (Módulo 3) va al outbox en la misma transacción
+        if invoice.status == STATUS_EN_PROCESO:
+            add_approval_notifications(db, invoice.id, APPROVER_EMAILS)
+        add_invoice_event(db, invoice.id, invoice.status, invoice.job_status)
+        try:
+            with STAGE_SECONDS.time(stage="db_commit"):
+                db.commit()
+        except IntegrityError:
+            # Duplicado: la restricción única de invoice_number decide, aunque otro
+            # proceso haya insertado el mismo número en paralelo
+            db.rollback()
+            invoice_number = processing_result.get("data", {}).get("invoice_number")
+            existing_invoice = db.query(Invoice.id).filter(
+                Invoice.invoice_number == invoice_number,
+                Invoice.id != invoice_id
+            ).first() if invoice_number else None
+            if existing_invoice is None:
+                raise
+            REJECTIONS.inc(reason="duplicate")
+            return fail_job(db, invoice,
+                            f"La factura con número {invoice_number} ya existe en la base de datos (ID {existing_invoice.id}).",
+                            processing_result.get("log"))
+        db.refresh(invoice)
+        return invoice
+
+    except Exception as e:
+        db.rollback()
+        db.query(Invoice).filter(Invoice.id == invoice_id).update(
+            {Invoice.job_status: JOB_FALLIDO, Invoice.job_error: str(e)}, synchronize_session=False
+        )
+        add_invoice_event(db, invoice_id, None, JOB_FALLIDO)
+        db.commit()
+        logger.exception("Error interno al procesar el trabajo", extra={"invoice_id": invoice_id})
+        return None
+    finally:
+        if file_path and os.path.exists(file_path):
+            os.remove(file_path)
+
+def reextract_invoices(batch_size=500):
+    """
+    Re-ejecuta la extracción de campos sobre las facturas almacenadas usando
+    el texto de la caché de OCR (sin Tesseract). Las facturas cuya decisión
+    ya fue tomada conservan su estado, y las de trabajos pendientes o
+    fallidos no se tocan (son del pool de OCR). Un cambio de estado se
+    registra como los demás: evento del stream y, si vuelve a 'En Proceso',
+    solicitud de aprobación en el outbox. También guarda su texto completo
+    para la búsqueda (facturas procesadas antes de invoice_texts).
+    :return: Tupla (actualizadas, sin texto en caché).
+    """
+    check_schema()
+    updated, missing = 0, 0
+    last_id = 0
+
+    db = SessionLocal()
+    try:
+        while True:
+            invoices = db.query(Invoice).filter(
+                Invoice.id > last_id,
+                Invoice.file_hash.isnot(None),
+                or_(Invoice.job_status.is_(None), Invoice.job_status == JOB_COMPLETADO)
+            ).order_by(Invoice.id).limit(batch_size).all()
+            if not invoices:
+                break
+
+            # Números asignados en este lote (aún sin confirmar, la consulta no los ve)
+            assigned_numbers = set()
+            for invoice in invoices:
+                text = get_cached_document_text(invoice.file_hash)
+                if text is None:
+                    missing += 1
+                    continue
+
+                previous_status = invoice.status
+                previous_number = invoice.invoice_number
+                processing_result = process_invoice_text(text)
+                processing_result["text_source"] = invoice.text_source
+                fill_invoice_from_result(invoice, processing_result)
+
+                # No romper la unicidad del número de factura
+                if invoice.invoice_number and invoice.invoice_number != previous_number:
+                    clash = invoice.invoice_number in assigned_numbers or db.query(Invoice.id).filter(
+                        Invoice.invoice_number == invoice.invoice_number,
+                        Invoice.id != invoice.id
+                    ).first()
+                    if clash:
+                        invoice.invoice_number = previous_number
+                    else:
+                        assigned_numbers.add(invoice.invoice_number)
+                if invoice.decision_justification:
+                    invoice.status = previous_status
+                if invoice.status != previous_status:
+                    if invoice.status == STATUS_EN_PROCESO:
+                        add_approval_notifications(db, invoice.id, APPROVER_EMAILS)
+                    add_invoice_event(db, invoice.id, invoice.status, invoice.job_status)
+                updated += 1
+
+            db.commit()
+            last_id = invoices[-1].id
+    finally:
+        db.close()
+    return updated, missing
+
+# -------------------------------------------------------------------------
+# POOL DE PROCESOS DE OCR
+# -------------------------------------------------------------------------
+
+def worker_loop(poll_interval=POLL_INTERVAL, max_jobs=None, metrics_port=None):
+    """
+    Bucle de un proceso de OCR: drena la cola hasta ser detenido. Mientras
+    la cola está vacía, cada JOB_STALE_AFTER segundos reencola los trabajos
+    abandonados por procesos caídos (también de otros hosts).
+    """
+    # Las conexiones heredadas del proceso padre no deben reutilizarse ni cerrarse:
+    # siguen siendo del padre (close=False solo las descarta en este proceso)
+    Engine.dispose(close=False)
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    processed = 0
+    last_requeue = time.monotonic()
+
+    while max_jobs is None or processed < max_jobs:
+        db = SessionLocal()
+        try:
+            invoice_id = claim_next_job(db)
+            if invoice_id is None:
+                if max_jobs is not None:
+                    break
+                if time.monotonic() - last_requeue >= JOB_STALE_AFTER:
+                    requeued = requeue_stale_jobs(db)
+                    if requeued:
+                        logger.info("Se reencolaron %d trabajos abandonados.", requeued)
+                    last_requeue = time.monotonic()
+                time.sleep(poll_interval)
+                continue
+            run_job(db, invoice_id)
+            processed += 1
+        finally:
+            db.close()
+    return processed
+
+def start_worker_pool(num_workers=OCR_WORKERS, poll_interval=POLL_INTERVAL, metrics_port=None):
+    """
+    Inicia `num_workers` procesos de OCR y los devuelve. Con `metrics_port`
+    el proceso i publica sus métricas en el puerto metrics_port + i.
+    """
+    check_schema()
+    db = SessionLocal()
+    try:
+        requeued = requeue_stale_jobs(db)
+        if requeued:
+            logger.info("Se reencolaron %d trabajos abandonados.", requeued)
+    finally:
+        db.close()
+
+    processes = []
+    for i in range(num_workers):
+        process = multiprocessing.Process(
+            target=worker_loop,
+            args=(poll_interval, None, metrics_port + i if metrics_port else None),
+            name=f"ocr-worker-{i}",
+            daemon=True
+        )
+        process.start()
+        processes.append(process)
+    return processes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pool de procesos de OCR para la cola de facturas.")
+    parser.add_argument("--workers", type=int, default=OCR_WORKERS, help="Número de procesos de OCR.")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL, help="Segundos entre sondeos de la cola.")
+    parser.add_argument("--reextract", action="store_true", help="Re-extrae los campos desde la caché de OCR y termina.")
+    parser.add_argument("--metrics-port", type=int, help="Primer puerto para las métricas de Prometheus (uno por proceso).")
+    args = parser.parse_args()
+    configure_logging()
+
+    if args.reextract:
+        updated, missing = reextract_invoices()
+        print(f"Facturas re-extraídas: {updated}. Sin texto en caché: {missing}.")
+        raise SystemExit(0)
+
+    workers = start_worker_pool(args.workers, args.poll_interval, args.metrics_port)
+    print(f"Pool de OCR iniciado con {len(workers)} procesos. Ctrl+C para detener.")
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        print("Deteniendo el pool de OCR...")
+        for worker in workers:
+            worker.terminate()